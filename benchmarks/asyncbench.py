@@ -0,0 +1,139 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import time
+import argparse
+
+from benchutils import InProcessPortal, Client, run_clients, \
+    latency_stats, emit
+from circuits import BaseComponent
+from circuits.core.events import Event
+from circuits.core.handlers import handler
+from circuits.core.manager import sleep
+from circuits_minpor import Portlet
+
+DESCRIPTION = """
+Measures full page renders of a portal with portlets that wait for a
+(simulated) local service while rendering. The portlets either wait
+in the render thread (synchronous) or render asynchronously.
+The results are written as JSON.
+"""
+
+
+class service_request(Event):
+    """
+    A request to the simulated service.
+    """
+
+
+class LocalService(BaseComponent):
+    """
+    A service that answers requests after the given delay without
+    blocking the event loop.
+    """
+
+    channel = "bench-service"
+
+    def __init__(self, delay, *args, **kwargs):
+        super(LocalService, self).__init__(*args, **kwargs)
+        self._delay = delay
+
+    @handler("service_request")
+    def _on_service_request(self, key):
+        yield sleep(self._delay)
+        yield "Answer for " + key
+
+
+class SyncWaitingPortlet(Portlet):
+    """
+    Waits for the service's delay in the render thread.
+    """
+
+    def __init__(self, delay, *args, **kwargs):
+        super(SyncWaitingPortlet, self).__init__(*args, **kwargs)
+        self._delay = delay
+
+    def description(self, locales=[]):
+        return Portlet.Description(self._handle, "Waiting Portlet")
+
+    def do_render(self, mime_type, mode, window_state, locales,
+                  url_generator, invocation_id, portal, **kwargs):
+        time.sleep(self._delay)
+        return "<div>Answer for %s</div>" % self._handle
+
+
+class AsyncWaitingPortlet(Portlet):
+    """
+    Calls the service while rendering asynchronously.
+    """
+
+    def description(self, locales=[]):
+        return Portlet.Description(self._handle, "Waiting Portlet")
+
+    def async_render(self, mime_type, mode, window_state, locales,
+                     url_generator, invocation_id, portal, **kwargs):
+        answer = yield self.call(service_request(self._handle),
+                                 LocalService.channel)
+        yield "<div>%s</div>" % answer.value
+
+
+def measure(factory, args):
+    portal = InProcessPortal(args.portlets, 0, portlet_factory=factory)
+    LocalService(args.delay).register(portal.manager)
+    portal.start()
+    try:
+        clients = [Client(portal.port) for _ in range(args.sessions)]
+        for client in clients:
+            client.get("/")
+        latencies, errors = run_clients \
+            (clients, lambda c: c.get("/")[0] == 200, args.duration)
+    finally:
+        portal.stop()
+    result = latency_stats(latencies, args.duration)
+    result["errors"] = errors
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--portlets", type=int, default=50,
+                        help="number of waiting portlets per page")
+    parser.add_argument("--delay", type=float, default=0.05,
+                        help="time in seconds that a portlet waits")
+    parser.add_argument("--sessions", type=int, default=4,
+                        help="number of concurrent client sessions")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="duration of each measurement in seconds")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+
+    result = { "timestamp": time.time(),
+               "parameters": dict(vars(args)),
+               "results": {
+                   "sync": measure(lambda rows:
+                                   SyncWaitingPortlet(args.delay), args),
+                   "async": measure(lambda rows:
+                                    AsyncWaitingPortlet(), args) } }
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
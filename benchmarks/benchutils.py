@@ -0,0 +1,489 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import os
+import sys
+import time
+import json
+import socket
+import struct
+import base64
+import hashlib
+import httplib
+import threading
+from Cookie import SimpleCookie
+
+from circuits import Manager, BaseComponent
+from circuits.core.events import Event
+from circuits.core.handlers import handler
+from circuits.web.servers import BaseServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuits_minpor import Portal, Portlet, TemplatePortlet
+from circuits_minpor.portal.events import portal_update
+
+
+class bench_action(Event):
+    """
+    The event fired by the action URLs of the synthetic portlets.
+    """
+
+
+class SyntheticPortlet(Portlet):
+    """
+    A portlet that renders a table with the given number of rows
+    and handles :class:`bench_action` events. Every action is confirmed
+    to the client with a "bench_action" portal update.
+    """
+
+    def __init__(self, rows=20, *args, **kwargs):
+        super(SyntheticPortlet, self).__init__(*args, **kwargs)
+        self._rows = rows
+        self._actions = 0
+        self._portal_channel = None
+
+    def description(self, locales=[]):
+        return Portlet.Description \
+            (self._handle, "Synthetic Portlet", 
+             events=[(bench_action, self.channel)])
+
+    def do_render(self, mime_type, mode, window_state, locales, 
+                  url_generator, invocation_id, portal, **kwargs):
+        return ("<a href=\"%s\">Action</a><table>" 
+                % url_generator.event_url("benchutils.bench_action")) \
+            + "".join(["<tr><td>%d</td><td>%s</td></tr>" % (i, locales)
+                       for i in range(self._rows)]) + "</table>"
+
+    @handler("portlet_added")
+    def _on_portlet_added(self, portal, portlet):
+        self._portal_channel = portal.channel
+
+    @handler("bench_action")
+    def _on_bench_action(self, *args, **kwargs):
+        self._actions += 1
+        session = kwargs.get("session")
+        if session is not None:
+            self.fire(portal_update(self, session, "bench_action",
+                                    self._actions), self._portal_channel)
+
+
+class CpuPortlet(Portlet):
+    """
+    A portlet with CPU intensive rendering that supports being
+    rendered in a process pool. *work* is the number of hashing
+    rounds per render.
+    """
+
+    def __init__(self, work=20000, *args, **kwargs):
+        super(CpuPortlet, self).__init__(*args, **kwargs)
+        self._work = work
+
+    def description(self, locales=[]):
+        return Portlet.Description(self._handle, "CPU Portlet")
+
+    def pool_render_input(self, mime_type, mode, window_state, locales, 
+                          url_generator, invocation_id, portal, **kwargs):
+        return { "work": self._work, "locales": locales,
+                 "invocation_id": invocation_id }
+
+    @classmethod
+    def pool_render(cls, render_input):
+        digest = str(render_input["invocation_id"])
+        for _ in range(render_input["work"]):
+            digest = hashlib.sha1(digest).hexdigest()
+        return "<div>%s (%s)</div>" % (digest, render_input["locales"])
+
+
+class SyntheticTemplatePortlet(TemplatePortlet):
+    """
+    A template based portlet that renders a localized table with the 
+    given number of rows.
+    """
+
+    def __init__(self, rows=20, *args, **kwargs):
+        super(SyntheticTemplatePortlet, self).__init__ \
+            (os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "templates"), "synthetic", *args, **kwargs)
+        self._rows = rows
+
+    def description(self, locales=[]):
+        return Portlet.Description \
+            (self._handle, self.translation(locales) 
+                .ugettext("Synthetic Template Portlet"))
+
+    def do_render(self, *args, **kwargs):
+        kwargs["context_exts"] = { "rows": self._rows }
+        return super(SyntheticTemplatePortlet, self) \
+            .do_render(*args, **kwargs)
+
+
+class ConnectedSessions(BaseComponent):
+    """
+    Keeps track of the sessions that have an event exchange connection,
+    so that the benchmark can send portal updates to them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ConnectedSessions, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self.sessions = []
+
+    @handler("portal_client_connect")
+    def _on_connect(self, session):
+        with self._lock:
+            self.sessions.append(session)
+
+    @handler("portal_client_disconnect")
+    def _on_disconnect(self, session, sock):
+        with self._lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+
+    def wait_for(self, count, timeout=10):
+        deadline = time.time() + timeout
+        while len(self.sessions) < count and time.time() < deadline:
+            time.sleep(0.01)
+        with self._lock:
+            return list(self.sessions)
+
+
+class InProcessPortal(object):
+    """
+    Runs a portal with synthetic portlets in a background thread of
+    the current process.
+    """
+
+    def __init__(self, portlets=6, template_portlets=6, rows=20, 
+                 portlet_factory=None, cpu_portlets=0, cpu_work=20000,
+                 **portal_kwargs):
+        self.manager = Manager()
+        self.server = BaseServer(("127.0.0.1", 0), channel="bench") \
+            .register(self.manager)
+        self.portal = Portal(self.server, title="Benchmark Portal", 
+                             **portal_kwargs).register(self.manager)
+        self.connected = ConnectedSessions(channel=self.portal.channel) \
+            .register(self.manager)
+        self.portlets = []
+        for _ in range(portlets):
+            self.portlets.append \
+                ((portlet_factory or SyntheticPortlet)(rows=rows)
+                 .register(self.manager))
+        for _ in range(template_portlets):
+            self.portlets.append \
+                (SyntheticTemplatePortlet(rows=rows).register(self.manager))
+        for _ in range(cpu_portlets):
+            self.portlets.append \
+                (CpuPortlet(work=cpu_work).register(self.manager))
+
+    def start(self):
+        self.manager.start()
+        deadline = time.time() + 10
+        while not self.port and time.time() < deadline:
+            time.sleep(0.01)
+        return self
+
+    @property
+    def port(self):
+        sock = getattr(self.server.server, "_sock", None)
+        try:
+            return sock.getsockname()[1] if sock else None
+        except socket.error:
+            return None
+
+    def stop(self):
+        self.manager.stop()
+
+    def fire(self, event, channel=None):
+        self.manager.fire(event, channel or self.portal.channel)
+
+
+class Client(object):
+    """
+    A minimal HTTP client with a persistent connection and its own
+    portal session.
+    """
+
+    def __init__(self, port, locale="en"):
+        self._port = port
+        self._locale = locale
+        self._conn = None
+        self.cookie = None
+
+    def get(self, path, headers=None):
+        """
+        Sends a GET request and returns status, headers and body.
+        """
+        return self.request("GET", path, headers=headers)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request and returns status, headers and body.
+        """
+        hdrs = { "Accept-Language": self._locale }
+        if self.cookie:
+            hdrs["Cookie"] = self.cookie
+        if headers:
+            hdrs.update(headers)
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = httplib.HTTPConnection \
+                    ("127.0.0.1", self._port, timeout=30)
+            try:
+                self._conn.request(method, path, body, headers=hdrs)
+                response = self._conn.getresponse()
+                body = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                self._conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+        set_cookie = response.getheader("Set-Cookie")
+        if set_cookie and not self.cookie:
+            cookie = SimpleCookie(set_cookie)
+            self.cookie = "; ".join(["%s=%s" % (name, morsel.coded_value)
+                                     for name, morsel in cookie.items()])
+        if response.getheader("Connection", "").lower() == "close":
+            self._conn.close()
+            self._conn = None
+        return response.status, dict(response.getheaders()), body
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+
+class WebSocketClient(object):
+    """
+    A minimal, blocking WebSocket client for the event exchange.
+    """
+
+    def __init__(self, port, path, cookie=None):
+        self._sock = socket.create_connection(("127.0.0.1", port))
+        key = base64.b64encode(os.urandom(16))
+        request = ("GET %s HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n"
+                   "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                   "Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n"
+                   % (path, port, key))
+        if cookie:
+            request += "Cookie: %s\r\n" % cookie
+        self._sock.sendall(request + "\r\n")
+        self._buffer = ""
+        while "\r\n\r\n" not in self._buffer:
+            data = self._sock.recv(4096)
+            if not data:
+                raise IOError("Connection closed during handshake")
+            self._buffer += data
+        head, self._buffer = self._buffer.split("\r\n\r\n", 1)
+        if not head.startswith("HTTP/1.1 101"):
+            raise IOError("Handshake failed: " + head.split("\r\n")[0])
+
+    def send(self, text, opcode=1):
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+        mask = os.urandom(4)
+        header = chr(0x80 | opcode)
+        length = len(text)
+        if length < 126:
+            header += chr(0x80 | length)
+        elif length < 65536:
+            header += chr(0x80 | 126) + struct.pack(">H", length)
+        else:
+            header += chr(0x80 | 127) + struct.pack(">Q", length)
+        masked = bytearray(text)
+        for i in range(length):
+            masked[i] ^= ord(mask[i % 4])
+        self._sock.sendall(header + mask + str(masked))
+
+    def receive(self, timeout=10):
+        """
+        Returns the opcode and the payload of the next frame or
+        ``(None, None)`` if the connection has been closed.
+        """
+        self._sock.settimeout(timeout)
+        while True:
+            if len(self._buffer) >= 2:
+                opcode = ord(self._buffer[0]) & 0xf
+                length = ord(self._buffer[1]) & 0x7f
+                offset = 2
+                if length == 126 and len(self._buffer) >= 4:
+                    length = struct.unpack(">H", self._buffer[2:4])[0]
+                    offset = 4
+                elif length == 127 and len(self._buffer) >= 10:
+                    length = struct.unpack(">Q", self._buffer[2:10])[0]
+                    offset = 10
+                if length < 126 or offset > 2:
+                    if len(self._buffer) >= offset + length:
+                        payload = self._buffer[offset:offset + length]
+                        self._buffer = self._buffer[offset + length:]
+                        return opcode, payload
+            data = self._sock.recv(65536)
+            if not data:
+                return None, None
+            self._buffer += data
+
+    def close(self):
+        self._sock.close()
+
+
+class EventStreamClient(object):
+    """
+    A minimal, blocking client for the server-sent events transport
+    of the event exchange. Messages are sent with HTTP POST requests.
+    """
+
+    def __init__(self, port, path, cookie=None):
+        self._port = port
+        self._path = path
+        self._cookie = cookie
+        self._sock = socket.create_connection(("127.0.0.1", port))
+        request = ("GET %s/stream HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n"
+                   "Accept: text/event-stream\r\n" % (path, port))
+        if cookie:
+            request += "Cookie: %s\r\n" % cookie
+        self._sock.sendall(request + "\r\n")
+        self._raw = ""
+        while "\r\n\r\n" not in self._raw:
+            data = self._sock.recv(4096)
+            if not data:
+                raise IOError("Connection closed before response")
+            self._raw += data
+        head, self._raw = self._raw.split("\r\n\r\n", 1)
+        if not head.startswith("HTTP/1.1 200"):
+            raise IOError("Request failed: " + head.split("\r\n")[0])
+        self._chunked = "transfer-encoding: chunked" in head.lower()
+        self._buffer = ""
+        self._poster = None
+
+    def _decode(self):
+        if not self._chunked:
+            self._buffer += self._raw
+            self._raw = ""
+            return
+        while "\r\n" in self._raw:
+            size, rest = self._raw.split("\r\n", 1)
+            size = int(size.split(";")[0], 16)
+            if len(rest) < size + 2:
+                return
+            self._buffer += rest[:size]
+            self._raw = rest[size + 2:]
+
+    def receive(self, timeout=10):
+        """
+        Returns the data of the next event (with opcode 1, like
+        :meth:`WebSocketClient.receive`) or ``(None, None)`` if the
+        connection has been closed.
+        """
+        self._sock.settimeout(timeout)
+        while True:
+            self._decode()
+            if "\n\n" in self._buffer:
+                event, self._buffer = self._buffer.split("\n\n", 1)
+                return 1, "\n".join([line[6:] for line in event.split("\n")
+                                     if line.startswith("data: ")])
+            data = self._sock.recv(65536)
+            if not data:
+                return None, None
+            self._raw += data
+
+    def send(self, text):
+        """
+        Posts the message (a JSON encoded list).
+        """
+        self.post([json.loads(text)])
+
+    def post(self, messages):
+        """
+        Posts the messages in a single request.
+        """
+        if self._poster is None:
+            self._poster = Client(self._port)
+            self._poster.cookie = self._cookie
+        return self._poster.request \
+            ("POST", self._path + "/post", json.dumps(messages),
+             { "Content-Type": "application/json",
+               "X-Portal-Event": "1" })[0]
+
+    def close(self):
+        if self._poster:
+            self._poster.close()
+        self._sock.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def latency_stats(latencies, duration):
+    return { "requests": len(latencies),
+             "per_second": len(latencies) / duration if duration else None,
+             "p50": percentile(latencies, 0.5),
+             "p99": percentile(latencies, 0.99) }
+
+
+def run_clients(clients, func, duration):
+    """
+    Invokes *func* (with the client as argument) repeatedly from
+    one thread per client for *duration* seconds. Returns the
+    latencies of the invocations and the number of errors.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    def loop(client):
+        own = []
+        while time.time() < deadline:
+            started = time.time()
+            try:
+                ok = func(client)
+            except Exception:
+                ok = False
+            if ok:
+                own.append(time.time() - started)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(own)
+    threads = [threading.Thread(target=loop, args=(client,)) 
+               for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def emit(result, output=None):
+    """
+    Writes the result as JSON to the given file or to stdout.
+    """
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as out:
+            out.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,120 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+from benchutils import percentile, emit
+from circuits_minpor.portal.bus import UnixSocketBus
+
+DESCRIPTION = """
+Measures the delivery latency and the throughput of the bus that
+connects the worker processes of a portal. Every worker sends the
+given number of messages to the other workers (round robin) and
+broadcasts the given number of messages. The results are written
+as JSON.
+"""
+
+
+def worker(directory, workers, messages, broadcasts, results):
+    bus = UnixSocketBus(directory)
+    latencies = []
+    lock = threading.Lock()
+    def deliver(message):
+        with lock:
+            latencies.append(time.time() - message[1])
+    bus.start(deliver)
+    # Wait for the other workers
+    while len([name for name in os.listdir(directory)
+               if name.endswith(UnixSocketBus.Suffix)]) < workers:
+        time.sleep(0.01)
+    time.sleep(0.2)
+    peers = [name[:-len(UnixSocketBus.Suffix)]
+             for name in os.listdir(directory)
+             if name.endswith(UnixSocketBus.Suffix)
+             and name[:-len(UnixSocketBus.Suffix)] != bus.worker]
+    started = time.time()
+    for i in range(messages):
+        bus.publish(peers[i % len(peers)], ["bench", time.time()])
+    for i in range(broadcasts):
+        bus.broadcast(["bench", time.time()])
+    sent = time.time() - started
+    expected = messages + broadcasts * len(peers)
+    deadline = time.time() + 10
+    while len(latencies) < expected - bus.dropped \
+        and time.time() < deadline:
+        time.sleep(0.01)
+    # Give the other workers time to deliver
+    time.sleep(0.5)
+    bus.stop()
+    results.put({ "received": latencies, "dropped": bus.dropped,
+                  "send_duration": sent })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of worker processes")
+    parser.add_argument("--messages", type=int, default=10000,
+                        help="messages sent by each worker to its peers")
+    parser.add_argument("--broadcasts", type=int, default=1000,
+                        help="messages broadcast by each worker")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process
+                 (target=worker, args=(directory, args.workers,
+                                       args.messages, args.broadcasts,
+                                       results))
+                 for _ in range(args.workers)]
+    started = time.time()
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    shutil.rmtree(directory, ignore_errors=True)
+    latencies = []
+    for report in reports:
+        latencies.extend(report["received"])
+    send_duration = max([report["send_duration"] for report in reports])
+    result = { "timestamp": started,
+               "parameters": dict(vars(args)),
+               "results": {
+                   "received": len(latencies),
+                   "dropped": sum([report["dropped"] for report in reports]),
+                   "sent_per_second":
+                       (args.messages + args.broadcasts * (args.workers - 1))
+                       * args.workers / send_duration,
+                   "latency_p50": percentile(latencies, 0.5),
+                   "latency_p99": percentile(latencies, 0.99) } }
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
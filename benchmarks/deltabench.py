@@ -0,0 +1,106 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import json
+import time
+import random
+import argparse
+
+from benchutils import InProcessPortal, Client, WebSocketClient, emit
+from circuits_minpor.portal import delta
+from circuits_minpor.portal.events import portal_content_update
+
+DESCRIPTION = """
+Measures the bandwidth used for updating the content of a portlet that
+displays a large table of which a few cells change with every update.
+The content is sent with portal content updates (i.e. as differences)
+to a WebSocket client, which reconstructs the content and verifies it.
+The results are written as JSON.
+"""
+
+
+def table(values):
+    return "<table>" + "".join(["<tr><td>%d</td><td>%s</td></tr>" 
+                                % (row, value)
+                                for row, value in enumerate(values)]) \
+        + "</table>"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="number of table rows")
+    parser.add_argument("--changes", type=int, default=5,
+                        help="number of cells changed with each update")
+    parser.add_argument("--updates", type=int, default=200,
+                        help="number of updates")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+
+    portal = InProcessPortal(1, 0, metrics=True).start()
+    try:
+        client = Client(portal.port)
+        client.get("/")
+        ws = WebSocketClient(portal.port, "/eventExchange", client.cookie)
+        session = portal.connected.wait_for(1)[0]
+        portlet = portal.portlets[0]
+        values = [random.randint(0, 1000) for _ in range(args.rows)]
+        content_bytes = 0
+        received_bytes = 0
+        mismatches = 0
+        current = None
+        started = time.time()
+        for _ in range(args.updates):
+            for _ in range(args.changes):
+                values[random.randrange(args.rows)] = random.randint(0, 1000)
+            content = table(values)
+            content_bytes += len(content)
+            portal.fire(portal_content_update(portlet, session, content))
+            while True:
+                opcode, payload = ws.receive(timeout=10)
+                if opcode is None or "portal_content" in payload:
+                    break
+            received_bytes += len(payload)
+            message = json.loads(payload)
+            if message[4] is None:
+                current = message[5]
+            else:
+                current = delta.apply(delta.tokenize(current), message[5])
+            if current != content:
+                mismatches += 1
+        duration = time.time() - started
+        ws.close()
+        client.close()
+    finally:
+        portal.stop()
+    result = { "timestamp": time.time(),
+               "parameters": dict(vars(args)),
+               "results": {
+                   "content_bytes": content_bytes,
+                   "received_bytes": received_bytes,
+                   "ratio": received_bytes / float(content_bytes),
+                   "updates_per_second": args.updates / duration,
+                   "mismatches": mismatches } }
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
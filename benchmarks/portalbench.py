@@ -0,0 +1,187 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import time
+import itertools
+import argparse
+import threading
+
+from benchutils import InProcessPortal, Client, WebSocketClient, \
+    EventStreamClient, run_clients, latency_stats, emit
+from circuits_minpor.portal.events import portal_update
+
+DESCRIPTION = """
+Measures the performance of a portal with synthetic portlets that runs
+in the same process: full page renders, static resources, action
+round trips and the fan-out of portal updates to WebSocket clients.
+The results are written as JSON, so that runs with different
+parameters or revisions can be compared.
+"""
+
+
+def bench_pages(portal, args):
+    clients = [Client(portal.port, args.locales[i % len(args.locales)])
+               for i in range(args.sessions)]
+    for client in clients:
+        client.get("/")
+    latencies, errors = run_clients \
+        (clients, lambda c: c.get("/")[0] == 200, args.duration)
+    result = latency_stats(latencies, args.duration)
+    result["errors"] = errors
+    return result
+
+
+def bench_static(portal, args):
+    clients = [Client(portal.port) for _ in range(args.sessions)]
+    latencies, errors = run_clients \
+        (clients, lambda c: c.get("/portal-resource/functions.js")[0] == 200,
+         args.duration)
+    result = latency_stats(latencies, args.duration)
+    result["errors"] = errors
+    return result
+
+
+def bench_actions(portal, args):
+    portlet = portal.portlets[0]
+    event_numbers = itertools.count(1000000)
+    path = "/%s/event/%%d/benchutils.bench_action/%s" \
+        % (portlet.description().handle, portlet.channel)
+    clients = [Client(portal.port, args.locales[i % len(args.locales)])
+               for i in range(args.sessions)]
+    for client in clients:
+        client.get("/")
+    latencies, errors = run_clients \
+        (clients, lambda c: c.get(path % next(event_numbers))[0] == 200,
+         args.duration)
+    result = latency_stats(latencies, args.duration)
+    result["errors"] = errors
+    return result
+
+
+def bench_fanout(portal, args):
+    """
+    Connects the WebSocket (or server-sent events) clients and sends
+    *updates* portal updates to each of them. Measures the time until
+    all updates have been received by the clients.
+    """
+    transport = EventStreamClient if args.transport == "sse" \
+        else WebSocketClient
+    sockets = []
+    for _ in range(args.ws_clients):
+        client = Client(portal.port)
+        client.get("/")
+        sockets.append(transport(portal.port, "/eventExchange", 
+                                 client.cookie))
+        client.close()
+    sessions = portal.connected.wait_for(len(sockets))
+    received = []
+    lock = threading.Lock()
+    def receive(ws):
+        count = 0
+        while count < args.updates:
+            opcode, payload = ws.receive(timeout=60)
+            if opcode is None:
+                break
+            if "bench_update" in payload:
+                count += 1
+        with lock:
+            received.append(count)
+    threads = [threading.Thread(target=receive, args=(ws,)) 
+               for ws in sockets]
+    for thread in threads:
+        thread.start()
+    portlet = portal.portlets[0]
+    started = time.time()
+    for i in range(args.updates):
+        for session in sessions:
+            portal.fire(portal_update(portlet, session, "bench_update", i))
+    for thread in threads:
+        thread.join()
+    duration = time.time() - started
+    for ws in sockets:
+        ws.close()
+    return { "transport": args.transport,
+             "clients": len(sessions),
+             "messages": sum(received),
+             "duration": duration,
+             "per_second": sum(received) / duration if duration else None }
+
+
+BENCHMARKS = [("pages", bench_pages), ("static", bench_static),
+              ("actions", bench_actions), ("fanout", bench_fanout)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--portlets", type=int, default=6,
+                        help="number of plain synthetic portlets")
+    parser.add_argument("--template-portlets", type=int, default=6,
+                        help="number of template based synthetic portlets")
+    parser.add_argument("--rows", type=int, default=20,
+                        help="table rows rendered by each portlet")
+    parser.add_argument("--cpu-portlets", type=int, default=0,
+                        help="number of portlets with CPU intensive"
+                        " rendering")
+    parser.add_argument("--cpu-work", type=int, default=20000,
+                        help="hashing rounds per render of a CPU portlet")
+    parser.add_argument("--render-processes", type=int, default=None,
+                        help="render CPU portlets in a pool with the"
+                        " given number of processes")
+    parser.add_argument("--sessions", type=int, default=4,
+                        help="number of concurrent client sessions")
+    parser.add_argument("--locales", default="en,de,fr",
+                        help="comma separated locales used by the sessions")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="duration of each timed benchmark in seconds")
+    parser.add_argument("--ws-clients", type=int, default=50,
+                        help="number of WebSocket clients for fan-out")
+    parser.add_argument("--updates", type=int, default=100,
+                        help="number of updates sent to each WebSocket client")
+    parser.add_argument("--transport", choices=["ws", "sse"], default="ws",
+                        help="transport used by the fan-out clients")
+    parser.add_argument("--only", default=None,
+                        help="comma separated names of the benchmarks to run"
+                        " (%s)" % ", ".join([name for name, _ in BENCHMARKS]))
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+    args.locales = args.locales.split(",")
+    selected = args.only.split(",") if args.only else None
+
+    portal = InProcessPortal(args.portlets, args.template_portlets, 
+                             args.rows, cpu_portlets=args.cpu_portlets,
+                             cpu_work=args.cpu_work,
+                             render_processes=args.render_processes) \
+        .start()
+    try:
+        result = { "timestamp": time.time(),
+                   "parameters": dict(vars(args)),
+                   "results": dict() }
+        for name, bench in BENCHMARKS:
+            if selected and name not in selected:
+                continue
+            result["results"][name] = bench(portal, args)
+    finally:
+        portal.stop()
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
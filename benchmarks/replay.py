@@ -0,0 +1,208 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import time
+import argparse
+import threading
+from collections import defaultdict
+
+from benchutils import Client, WebSocketClient, latency_stats, emit
+from circuits_minpor.portal.recording import read_recording
+
+DESCRIPTION = """
+Replays traffic recorded by a portal (see the portal's "record_file"
+parameter) against a portal running on the local host. Every recorded
+session is replayed by the given number of synthetic sessions. The
+replay can be sped up or slowed down. Request bodies and event
+arguments are replayed only if they have been recorded (see the
+portal's "record_bodies" parameter). The results are written as JSON.
+"""
+
+
+class SessionReplay(threading.Thread):
+    """
+    Replays the records of a single recorded session as a new
+    synthetic session.
+    """
+
+    def __init__(self, port, records, speed, started, stats):
+        super(SessionReplay, self).__init__()
+        self.daemon = True
+        self._port = port
+        self._records = records
+        self._speed = speed
+        self._started = started
+        self._stats = stats
+        self._client = Client(port)
+        self._ws = None
+        self._receiver = None
+
+    def run(self):
+        try:
+            for record in self._records:
+                due = self._started + record[0] / 1000.0 / self._speed
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self._stats.lag(max(0, -delay))
+                try:
+                    getattr(self, "_replay_" + record[2])(*record[3:])
+                except Exception:
+                    self._stats.error(record[2])
+        finally:
+            self._close_ws()
+            self._client.close()
+
+    def _replay_http(self, method, path, query, language,
+                     content_type, body):
+        headers = dict()
+        if language:
+            headers["Accept-Language"] = language
+        if content_type:
+            headers["Content-Type"] = content_type
+        if query:
+            path += "?" + query
+        if body is not None:
+            body = body.encode("latin-1")
+        started = time.time()
+        status = self._client.request(method, path, body, headers)[0]
+        self._stats.response("http", status, time.time() - started)
+
+    def _replay_open(self, path):
+        self._close_ws()
+        self._ws = WebSocketClient(self._port, path, self._client.cookie)
+        self._receiver = threading.Thread(target=self._receive,
+                                          args=(self._ws,))
+        self._receiver.daemon = True
+        self._receiver.start()
+        self._stats.count("ws_open")
+
+    def _replay_ws(self, message):
+        if self._ws is None:
+            self._stats.error("ws")
+            return
+        self._ws.send(message)
+        self._stats.count("ws_sent")
+
+    def _replay_close(self):
+        self._close_ws()
+
+    def _receive(self, ws):
+        while True:
+            try:
+                opcode, payload = ws.receive(timeout=None)
+            except Exception:
+                return
+            if opcode is None:
+                return
+            self._stats.count("ws_received")
+
+    def _close_ws(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+
+class ReplayStats(object):
+    """
+    Collects the results of the replay from all sessions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._lags = []
+        self._statuses = defaultdict(int)
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+
+    def response(self, kind, status, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._statuses[str(status)] += 1
+
+    def lag(self, lag):
+        with self._lock:
+            self._lags.append(lag)
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def error(self, kind):
+        with self._lock:
+            self._errors[kind] += 1
+
+    def result(self, duration):
+        with self._lock:
+            result = latency_stats(self._latencies, duration)
+            result["statuses"] = dict(self._statuses)
+            result["counts"] = dict(self._counts)
+            result["errors"] = dict(self._errors)
+            result["lag"] = latency_stats(self._lags, duration)
+            return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("recording", help="the recorded traffic")
+    parser.add_argument("--port", type=int, default=4444,
+                        help="the port of the portal on the local host")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="speed factor for the replay, e.g. 2 to"
+                        " replay twice as fast as recorded")
+    parser.add_argument("--copies", type=int, default=1,
+                        help="number of synthetic sessions per"
+                        " recorded session")
+    parser.add_argument("--stagger", type=float, default=0,
+                        help="spread the start of the copies of a"
+                        " session over the given number of seconds")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+
+    header, records = read_recording(args.recording)
+    sessions = defaultdict(list)
+    for record in records:
+        sessions[record[1]].append(record)
+    stats = ReplayStats()
+    started = time.time() + 0.5
+    replays = []
+    for copy in range(args.copies):
+        offset = args.stagger * copy / args.copies
+        for session_records in sessions.values():
+            replays.append(SessionReplay(args.port, session_records,
+                                         args.speed, started + offset, stats))
+    for replay in replays:
+        replay.start()
+    for replay in replays:
+        replay.join()
+    duration = time.time() - started
+    result = { "timestamp": time.time(),
+               "parameters": dict(vars(args)),
+               "recording": { "started": header["started"],
+                              "sessions": len(sessions),
+                              "records": len(records) },
+               "results": stats.result(duration) }
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
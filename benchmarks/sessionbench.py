@@ -0,0 +1,102 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import gc
+import time
+import argparse
+import resource
+from uuid import uuid4
+
+from benchutils import InProcessPortal, emit
+
+DESCRIPTION = """
+Measures the memory used by the sessions of a portal. The given number
+of sessions is created (without HTTP requests) and initialized as by
+a page request, optionally with solo tabs. The results are written 
+as JSON.
+"""
+
+
+def resident_memory():
+    """
+    Returns the resident set size of the process in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) \
+                * resource.getpagesize()
+    except IOError:
+        # Maximum only, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--sessions", type=int, default=100000,
+                        help="number of sessions to create")
+    parser.add_argument("--portlets", type=int, default=6,
+                        help="number of portlets")
+    parser.add_argument("--solo-tabs", type=int, default=2,
+                        help="number of solo tabs opened in each session")
+    parser.add_argument("--max-sessions", type=int, default=None,
+                        help="maximum number of sessions kept in memory")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+
+    portal = InProcessPortal(args.portlets, 0, 
+                             max_sessions=args.max_sessions)
+    view = portal.portal._view
+    sessions = view._sessions
+    portlets = portal.portal.portlets
+    gc.collect()
+    before = resident_memory()
+    started = time.time()
+    for _ in range(args.sessions):
+        session = sessions.load(uuid4().hex)
+        view.facade(session)
+        tab_manager = view.tab_manager(session)
+        for portlet in portlets[:args.solo_tabs]:
+            tab_manager.add_solo(portlet)
+        session["_expected_event"] = 1
+    created = time.time() - started
+    gc.collect()
+    used = resident_memory() - before
+    started = time.time()
+    metrics = portal.portal.session_metrics(memory=True)
+    accounting = time.time() - started
+    result = { "timestamp": time.time(),
+               "parameters": dict(vars(args)),
+               "results": {
+                   "kept": metrics["count"],
+                   "evicted": metrics["evicted"],
+                   "created_per_second": args.sessions / created,
+                   "resident_bytes": used,
+                   "resident_bytes_per_session": 
+                       used / float(metrics["count"]),
+                   "accounted_bytes": metrics["bytes"],
+                   "accounted_bytes_per_session":
+                       metrics["bytes"] / float(metrics["count"]),
+                   "accounting_duration": accounting } }
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
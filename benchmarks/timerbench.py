@@ -0,0 +1,216 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import os
+import time
+import random
+import argparse
+
+from benchutils import emit
+from circuits import Manager
+from circuits.core.events import Event
+from circuits.core.handlers import handler
+from circuits.core.components import BaseComponent
+from circuits_bricks.core.timers import Timer
+from circuits_minpor.portal.timerwheel import TimerWheel
+
+DESCRIPTION = """
+Measures the overhead of the portal's timer wheel with the given number
+of periodic callbacks (with intervals chosen at random from the given
+intervals) in a running event loop: the time needed to schedule and 
+to cancel the callbacks and the CPU time used per second while they 
+are being invoked. For comparison, the same is measured for the given 
+number of circuits_bricks timers. Finally, the invocations of periodic
+callbacks after a stall of the event loop are counted (missed 
+invocations must be skipped). The results are written as JSON.
+"""
+
+
+class bench_timer(Event):
+    """
+    Fired by the circuits_bricks timers.
+    """
+
+
+class TimerTarget(BaseComponent):
+
+    channel = "bench-timers"
+
+    def __init__(self, *args, **kwargs):
+        super(TimerTarget, self).__init__(*args, **kwargs)
+        self.fired = 0
+
+    @handler("bench_timer")
+    def _on_bench_timer(self):
+        self.fired += 1
+
+
+class bench_stall(Event):
+    """
+    Blocks the loop for the given time.
+    """
+
+
+class Staller(BaseComponent):
+
+    channel = "bench-stall"
+
+    def __init__(self, *args, **kwargs):
+        super(Staller, self).__init__(*args, **kwargs)
+        self.resumed = None
+
+    @handler("bench_stall")
+    def _on_bench_stall(self, duration):
+        time.sleep(duration)
+        self.resumed = time.time()
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def run_loop(manager, duration):
+    """
+    Runs the manager's event loop for the given duration and returns
+    the CPU time used.
+    """
+    manager.start()
+    started = cpu_time()
+    time.sleep(duration)
+    used = cpu_time() - started
+    manager.stop()
+    return used
+
+
+def measure_wheel(args, intervals):
+    manager = Manager()
+    wheel = TimerWheel().register(manager)
+    fired = [0]
+    def callback():
+        fired[0] += 1
+    started = time.time()
+    for i, interval in enumerate(intervals):
+        wheel.schedule(i, interval, callback, periodic=True)
+    scheduled = time.time() - started
+    used = run_loop(manager, args.duration)
+    started = time.time()
+    for i in range(len(intervals)):
+        wheel.cancel(i)
+    cancelled = time.time() - started
+    return { "entries": len(intervals),
+             "schedule_per_second": len(intervals) / scheduled,
+             "cancel_per_second": len(intervals) / cancelled,
+             "fired": fired[0],
+             "expected": sum([int(args.duration / interval)
+                              for interval in intervals]),
+             "cpu_per_second": used / args.duration }
+
+
+def measure_bricks(args, intervals):
+    manager = Manager()
+    target = TimerTarget().register(manager)
+    started = time.time()
+    timers = []
+    for interval in intervals:
+        evt = bench_timer()
+        evt.channels = (TimerTarget.channel,)
+        timers.append(Timer(interval, evt, persist=True).register(manager))
+    scheduled = time.time() - started
+    used = run_loop(manager, args.duration)
+    started = time.time()
+    for timer in timers:
+        timer.unregister()
+    manager.flush()
+    cancelled = time.time() - started
+    return { "entries": len(intervals),
+             "schedule_per_second": len(intervals) / scheduled,
+             "cancel_per_second": len(intervals) / cancelled,
+             "fired": target.fired,
+             "expected": sum([int(args.duration / interval)
+                              for interval in intervals]),
+             "cpu_per_second": used / args.duration }
+
+
+def measure_stall(args):
+    """
+    Blocks the loop for the given time and counts how often periodic
+    callbacks are invoked when the wheel catches up.
+    """
+    manager = Manager()
+    wheel = TimerWheel().register(manager)
+    staller = Staller().register(manager)
+    invocations = dict()
+    def callback(interval):
+        invocations[interval].append(time.time())
+    for interval in (0.1, 1):
+        invocations[interval] = []
+        wheel.schedule(interval, interval, callback, (interval,),
+                       periodic=True)
+    manager.start()
+    time.sleep(0.55)
+    manager.fire(bench_stall(args.stall), Staller.channel)
+    time.sleep(args.stall + 0.5)
+    manager.stop()
+    # Invocations when the wheel catches up
+    return dict([(str(interval), 
+                  len([fired for fired in invocations[interval]
+                       if staller.resumed <= fired 
+                       < staller.resumed + 0.02]))
+                 for interval in invocations])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--entries", type=int, default=50000,
+                        help="number of periodic callbacks in the wheel")
+    parser.add_argument("--bricks-timers", type=int, default=1000,
+                        help="number of circuits_bricks timers"
+                        " (0 to skip)")
+    parser.add_argument("--intervals", default="1,2,5,10",
+                        help="comma separated intervals in seconds")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="duration of each measurement in seconds")
+    parser.add_argument("--stall", type=float, default=5,
+                        help="duration of the stall in seconds")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+    choices = [float(interval) for interval in args.intervals.split(",")]
+    random.seed(0)
+
+    result = { "timestamp": time.time(),
+               "parameters": dict(vars(args)),
+               "results": {
+                   "idle_cpu_per_second": 
+                       run_loop(Manager(), args.duration) / args.duration,
+                   "wheel": measure_wheel
+                       (args, [random.choice(choices)
+                               for _ in range(args.entries)]) } }
+    result["results"]["after_stall"] = measure_stall(args)
+    if args.bricks_timers:
+        result["results"]["bricks"] = measure_bricks \
+            (args, [random.choice(choices) 
+                    for _ in range(args.bricks_timers)])
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+import os
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import multiprocessing
+
+from benchutils import SyntheticPortlet, SyntheticTemplatePortlet, \
+    Client, run_clients, latency_stats, emit
+from circuits import Manager
+from circuits_minpor import Portal
+from circuits_minpor.portal.sessions import SqliteSessionStore
+from circuits_minpor.portal.workers import run_workers, listen
+
+DESCRIPTION = """
+Measures the full page render throughput of a portal that runs in
+several worker processes sharing an SQLite session store, for each
+of the given numbers of workers. The results are written as JSON.
+"""
+
+
+def serve(sock, workers, args, store_file):
+    def setup(server):
+        manager = Manager()
+        server.register(manager)
+        Portal(server, title="Benchmark Portal",
+               session_store=SqliteSessionStore(store_file)) \
+            .register(manager)
+        for _ in range(args.portlets):
+            SyntheticPortlet(rows=args.rows).register(manager)
+        for _ in range(args.template_portlets):
+            SyntheticTemplatePortlet(rows=args.rows).register(manager)
+        return manager
+    run_workers(setup, sock, workers)
+
+
+def drive(port, sessions, duration):
+    """
+    Runs in a client process, renders pages with the given number
+    of sessions.
+    """
+    clients = [Client(port) for _ in range(sessions)]
+    for client in clients:
+        client.get("/")
+    return run_clients \
+        (clients, lambda c: c.get("/")[0] == 200, duration)
+
+
+def measure(workers, args):
+    store_dir = tempfile.mkdtemp()
+    sock = listen(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = os.fork()
+    if server == 0:
+        try:
+            serve(sock, workers, args, os.path.join(store_dir, "sessions"))
+        finally:
+            os._exit(0)
+    sock.close()
+    try:
+        time.sleep(1)
+        pool = multiprocessing.Pool(args.client_processes)
+        per_process = max(1, args.sessions // args.client_processes)
+        results = [pool.apply_async(drive, (port, per_process,
+                                            args.duration))
+                   for _ in range(args.client_processes)]
+        latencies = []
+        errors = 0
+        for result in results:
+            process_latencies, process_errors = result.get()
+            latencies.extend(process_latencies)
+            errors += process_errors
+        pool.close()
+        pool.join()
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+        shutil.rmtree(store_dir, ignore_errors=True)
+    result = latency_stats(latencies, args.duration)
+    result["errors"] = errors
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--workers", default="1,2,4",
+                        help="comma separated numbers of workers to measure")
+    parser.add_argument("--portlets", type=int, default=6,
+                        help="number of plain synthetic portlets")
+    parser.add_argument("--template-portlets", type=int, default=6,
+                        help="number of template based synthetic portlets")
+    parser.add_argument("--rows", type=int, default=200,
+                        help="table rows rendered by each portlet")
+    parser.add_argument("--sessions", type=int, default=16,
+                        help="number of concurrent client sessions")
+    parser.add_argument("--client-processes", type=int, default=4,
+                        help="number of processes running the clients")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="duration of each measurement in seconds")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON result to")
+    args = parser.parse_args()
+
+    result = { "timestamp": time.time(),
+               "parameters": dict(vars(args)),
+               "cpus": multiprocessing.cpu_count(),
+               "results": dict() }
+    for workers in [int(count) for count in args.workers.split(",")]:
+        result["results"][str(workers)] = measure(workers, args)
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from collections import deque
+import time
+
+
+class AdmissionControl(object):
+    """
+    Limits the number of portal pages that are rendered concurrently.
+    Requests that cannot be admitted immediately are put in a bounded
+    wait queue and admitted in the order of their arrival. Requests
+    that don't fit in the wait queue are rejected.
+
+    All methods are meant to be invoked from the circuits main loop
+    only, no locking is done.
+
+    :param max_active: the maximum number of concurrent renders or
+        ``None`` for no limit.
+    :param max_queued: the maximum number of requests that wait
+        for admission.
+    :param retry_after: the time in seconds that rejected clients
+        are asked to wait before retrying.
+    """
+
+    def __init__(self, max_active=None, max_queued=0, retry_after=5):
+        self._max_active = max_active
+        self._max_queued = max_queued
+        self._retry_after = retry_after
+        self._active = 0
+        self._queue = deque()
+        self._next_ticket = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._max_queue_depth = 0
+
+    @property
+    def retry_after(self):
+        return self._retry_after
+
+    def enter(self):
+        """
+        Requests admission. Returns a ticket or ``None`` if the
+        request is rejected. The request may proceed as soon as
+        :meth:`admitted` returns ``True`` for the ticket. The ticket
+        must be returned with :meth:`leave` when done.
+        """
+        self._next_ticket += 1
+        ticket = self._next_ticket
+        if self._max_active is None \
+            or (not self._queue and self._active < self._max_active):
+            self._active += 1
+            self._admitted += 1
+            return ticket
+        if len(self._queue) >= self._max_queued:
+            self._rejected += 1
+            return None
+        self._queue.append(ticket)
+        self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+        return ticket
+
+    def admitted(self, ticket):
+        """
+        Returns ``True`` if the request with the given ticket may proceed.
+        """
+        if not self._queue or self._queue[0] != ticket:
+            return ticket not in self._queue
+        if self._active >= self._max_active:
+            return False
+        self._queue.popleft()
+        self._active += 1
+        self._admitted += 1
+        return True
+
+    def leave(self, ticket):
+        """
+        Returns the ticket obtained from :meth:`enter`.
+        """
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            return
+        self._active -= 1
+
+    def metrics(self):
+        """
+        Returns a dict with the current number of active renders,
+        the current queue depth and counters for admitted and
+        rejected requests.
+        """
+        return { "active": self._active,
+                 "queued": len(self._queue),
+                 "max_active": self._max_active,
+                 "max_queued": self._max_queued,
+                 "max_queue_depth": self._max_queue_depth,
+                 "admitted": self._admitted,
+                 "rejected": self._rejected }
+
+
+class EventRateLimit(object):
+    """
+    Limits the rate of the events that a client sends over the event
+    exchange. Every session has its own bucket (see :meth:`bucket`)
+    that holds up to *burst* tokens and is refilled with *rate* tokens
+    per second. An event is accepted if a token can be taken from the
+    bucket, else it is dropped.
+
+    Like :class:`AdmissionControl`, the methods are meant to be 
+    invoked from the circuits main loop only.
+
+    :param rate: the number of events per second that a client may
+        send in the long run or ``None`` for no limit.
+    :param burst: the number of events that a client may send at
+        once, defaults to one second's worth (at least one).
+    """
+
+    class _Bucket(object):
+
+        __slots__ = ("tokens", "updated")
+
+        def __init__(self, tokens, updated):
+            self.tokens = tokens
+            self.updated = updated
+
+    def __init__(self, rate=None, burst=None):
+        self._rate = rate
+        self._burst = burst if burst is not None else max(1, rate or 0)
+        self._accepted = 0
+        self._dropped = 0
+
+    @property
+    def enabled(self):
+        return self._rate is not None
+
+    def bucket(self):
+        """
+        Returns a new, full bucket for a session.
+        """
+        return self._Bucket(self._burst, time.time())
+
+    def admit(self, bucket):
+        """
+        Takes a token from the bucket. Returns ``False`` if the
+        event must be dropped.
+        """
+        if self._rate is None:
+            self._accepted += 1
+            return True
+        now = time.time()
+        bucket.tokens = min(self._burst, bucket.tokens
+                            + (now - bucket.updated) * self._rate)
+        bucket.updated = now
+        if bucket.tokens < 1:
+            self._dropped += 1
+            return False
+        bucket.tokens -= 1
+        self._accepted += 1
+        return True
+
+    def count_dropped(self, count=1):
+        """
+        Counts events that have been dropped for other reasons.
+        """
+        self._dropped += count
+
+    def metrics(self):
+        """
+        Returns a dict with the configured limits and counters for
+        accepted and dropped events.
+        """
+        return { "rate": self._rate,
+                 "burst": self._burst,
+                 "accepted": self._accepted,
+                 "dropped": self._dropped }
@@ -0,0 +1,169 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Lock
+from hashlib import sha1
+import rbtranslations
+import inspect
+import json
+import os
+
+
+class AssetBundles(object):
+    """
+    Combines the assets declared by the portlets (see 
+    :class:`circuits_minpor.Portlet.Asset`) in a JavaScript and a CSS
+    bundle. The assets of a portlet class are included only once, 
+    no matter how many instances of the class there are. Client side
+    templates are added to the JavaScript bundle.
+
+    The bundles are named after a fingerprint of their content, so 
+    they can be cached by the browser forever. They are rebuilt 
+    when the set of portlets changes (see :meth:`invalidate`).
+    """
+
+    ContentTypes = { "js": "application/javascript; charset=utf-8",
+                     "css": "text/css; charset=utf-8" }
+
+    def __init__(self):
+        self._bundles = None
+        self._lock = Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._bundles = None
+
+    def _build(self, portlets):
+        parts = { "js": [], "css": [] }
+        classes = set()
+        for portlet in portlets:
+            if portlet.__class__ in classes:
+                continue
+            classes.add(portlet.__class__)
+            class_dir = os.path.dirname(inspect.getfile(portlet.__class__))
+            for asset in portlet.description().assets:
+                path = os.path.join(class_dir, asset.path)
+                with open(path, "rb") as f:
+                    data = f.read()
+                if asset.kind == "template":
+                    parts["js"].append \
+                        ("CirMinPor.defineTemplate(%s, %s);\n"
+                         % (json.dumps(asset.name), 
+                            json.dumps(data.decode("utf-8"))))
+                else:
+                    parts[asset.kind].append(data + "\n")
+        bundles = dict()
+        for kind, data in parts.items():
+            if not data:
+                continue
+            data = "".join(data)
+            bundles[kind] = (sha1(data).hexdigest()[:16] + "." + kind, data)
+        return bundles
+
+    def _current(self, portlets):
+        with self._lock:
+            if self._bundles is None:
+                self._bundles = self._build(portlets)
+            return self._bundles
+
+    def names(self, portlets):
+        """
+        Returns the file names of the bundles for the given portlets,
+        the CSS bundle (if any) first.
+        """
+        bundles = self._current(portlets)
+        return [bundles[kind][0] for kind in ("css", "js") 
+                if kind in bundles]
+
+    def get(self, portlets, name):
+        """
+        Returns the content type and the data of the bundle with the 
+        given name or ``None`` if there is no such bundle (anymore).
+        """
+        for kind, (bundle_name, data) in self._current(portlets).items():
+            if bundle_name == name:
+                return self.ContentTypes[kind], data
+        return None
+
+
+class LocalizationScripts(object):
+    """
+    Generates a script per locale that provides the client side
+    strings and the date formats of the portal. Like the asset
+    bundles, the scripts are named after a fingerprint of their 
+    content.
+
+    :param templates_dir: the directories with the portal's 
+        localization resources.
+    """
+
+    ContentType = "application/javascript; charset=utf-8"
+    # Keys of the strings used by functions.js
+    Strings = ("WebSocketsUnavailable",)
+    # Used as JavaScript literals by date_format.js
+    DateFormats = ("shortMonths", "longMonths", "shortDays", "longDays",
+                   "shortDate", "longDate", "shortTime", "longTime",
+                   "shortDateTime", "longDateTime")
+
+    def __init__(self, templates_dir):
+        self._templates_dir = templates_dir
+        self._scripts = dict()
+        self._lock = Lock()
+
+    def _build(self, locale):
+        translation = rbtranslations.translation \
+            ("l10n", self._templates_dir, [locale], "en")
+        lines = ["CirMinPor._strings = %s;\n" % json.dumps \
+                 (dict([(key, translation.ugettext(key)) 
+                        for key in self.Strings]), sort_keys=True)]
+        for key in self.DateFormats:
+            lines.append("Date.replaceChars.%s = %s;\n" 
+                         % (key, translation.ugettext("date_format_" + key)))
+        data = u"".join(lines).encode("utf-8")
+        return "l10n-%s-%s.js" % (locale, sha1(data).hexdigest()[:16]), data
+
+    def _script(self, locale):
+        with self._lock:
+            script = self._scripts.get(locale)
+            if script is None:
+                script = self._scripts[locale] = self._build(locale)
+            return script
+
+    def name(self, locale):
+        """
+        Returns the file name of the script for the given locale.
+        """
+        return self._script(locale)[0]
+
+    def get(self, name, locales):
+        """
+        Returns the content type and the data of the script with
+        the given name or ``None`` if there is no such script. 
+        *locales* are the locales supported by the portal.
+        """
+        if not name.startswith("l10n-"):
+            return None
+        locale = name[5:].split("-")[0]
+        if locale not in locales:
+            return None
+        script_name, data = self._script(locale)
+        if script_name != name:
+            return None
+        return self.ContentType, data
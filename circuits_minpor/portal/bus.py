@@ -0,0 +1,258 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from circuits.core.events import Event
+from abc import ABCMeta, abstractmethod
+from threading import Thread, Lock
+from Queue import Queue, Full
+import socket
+import errno
+import json
+import time
+import os
+
+
+class bus_message(Event):
+    """
+    Fired (on the portal view's channel) when a message has been
+    received from another process.
+
+    :param message: the message (a list).
+    """
+
+
+class PortalBus(object):
+    """
+    The base class for buses that connect the processes of a portal
+    that runs in several worker processes (see
+    :func:`circuits_minpor.portal.workers.run_workers`). Messages are
+    lists that can be serialized as JSON. They are either sent to
+    a specific worker or broadcast to all other workers.
+
+    A bus is started in every worker process with a function that is
+    invoked (from a thread of the bus) for every message received.
+    """
+
+    __metaclass__ = ABCMeta
+
+    @property
+    def worker(self):
+        """
+        The id of the worker process that the bus has been started in.
+        """
+        return getattr(self, "_worker", None)
+
+    @abstractmethod
+    def start(self, deliver):
+        """
+        Starts the bus in the current process. *deliver* is invoked
+        with every message received.
+        """
+
+    @abstractmethod
+    def stop(self):
+        """
+        Stops the bus.
+        """
+
+    @abstractmethod
+    def publish(self, worker, message):
+        """
+        Sends the message to the given worker. Returns ``False`` if
+        the message could not be sent.
+        """
+
+    @abstractmethod
+    def broadcast(self, message):
+        """
+        Sends the message to all other workers.
+        """
+
+
+class UnixSocketBus(PortalBus):
+    """
+    A bus for processes on the same host. Every worker binds a Unix
+    domain datagram socket, named after its process id, in the given
+    directory. Messages are queued and sent by a thread of their own, 
+    so that sending never blocks the caller. Messages that exceed 
+    *max_size*, that don't fit in the queue or that cannot be sent
+    within *send_timeout* seconds (because the receiver doesn't keep up)
+    are dropped and counted (see :attr:`dropped`). :meth:`publish` 
+    therefore cannot confirm the delivery, but it returns ``False``
+    if the receiving worker has terminated, so that the caller
+    can fall back to a broadcast.
+
+    :param directory: the directory for the sockets.
+    :param max_size: the maximum size of a serialized message.
+    :param queue_size: the maximum number of queued messages.
+    :param send_timeout: the time in seconds that the sending thread
+        waits for a receiver to accept a message.
+    """
+
+    Suffix = ".sock"
+
+    def __init__(self, directory, max_size=65536, queue_size=10000,
+                 send_timeout=1):
+        self._directory = directory
+        self._max_size = max_size
+        self._queue_size = queue_size
+        self._send_timeout = send_timeout
+        self._sock = None
+        self._outgoing = None
+        self._worker = None
+        self._peers = []
+        self._peers_updated = 0
+        self._dropped = 0
+        self._lock = Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def _path(self, worker):
+        return os.path.join(self._directory, worker + self.Suffix)
+
+    def start(self, deliver):
+        self._worker = str(os.getpid())
+        path = self._path(self._worker)
+        if os.path.exists(path):
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        self._sock = sock
+        receiver = Thread(target=self._receive, args=(sock, deliver),
+                          name="bus-receiver-" + self._worker)
+        receiver.daemon = True
+        receiver.start()
+        self._outgoing = Queue(self._queue_size)
+        sender = Thread(target=self._send_queued, args=(self._outgoing,),
+                        name="bus-sender-" + self._worker)
+        sender.daemon = True
+        sender.start()
+
+    def stop(self):
+        sock, self._sock = self._sock, None
+        if sock is None:
+            return
+        self._outgoing.put(None)
+        try:
+            os.remove(self._path(self._worker))
+        except OSError:
+            pass
+        sock.close()
+
+    def _receive(self, sock, deliver):
+        while True:
+            try:
+                data = sock.recv(self._max_size)
+            except socket.error:
+                return
+            if self._sock is not sock:
+                return
+            deliver(json.loads(data))
+
+    def _peer_workers(self):
+        # Rescanning the directory for every broadcast is too expensive
+        now = time.time()
+        if now - self._peers_updated > 1:
+            self._peers = [name[:-len(self.Suffix)]
+                           for name in os.listdir(self._directory)
+                           if name.endswith(self.Suffix)
+                           and name[:-len(self.Suffix)] != self._worker]
+            self._peers_updated = now
+        return self._peers
+
+    def _send(self, worker, data):
+        if self._sock is None:
+            return False
+        try:
+            self._outgoing.put_nowait((worker, data))
+            return True
+        except Full:
+            self._count_dropped()
+            return False
+
+    def _send_queued(self, outgoing):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.settimeout(self._send_timeout)
+        while True:
+            item = outgoing.get()
+            if item is None:
+                break
+            worker, data = item
+            try:
+                sock.sendto(data, self._path(worker))
+            except socket.timeout:
+                self._count_dropped()
+            except socket.error as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # Worker has terminated
+                    try:
+                        os.remove(self._path(worker))
+                    except OSError:
+                        pass
+                    self._peers_updated = 0
+                self._count_dropped()
+        sock.close()
+
+    def _count_dropped(self):
+        with self._lock:
+            self._dropped += 1
+
+    def _alive(self, worker):
+        """
+        Checks that the worker's socket exists and that its process
+        is running, which is as much as :meth:`publish` can find out
+        without waiting for the message to be sent.
+        """
+        if not os.path.exists(self._path(worker)):
+            return False
+        try:
+            os.kill(int(worker), 0)
+        except ValueError:
+            return False
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                return True
+            # Worker has terminated without removing its socket
+            try:
+                os.remove(self._path(worker))
+            except OSError:
+                pass
+            self._peers_updated = 0
+            return False
+        return True
+
+    def publish(self, worker, message):
+        data = json.dumps(message, separators=(",", ":"))
+        if len(data) > self._max_size or not self._alive(worker):
+            self._count_dropped()
+            return False
+        return self._send(worker, data)
+
+    def broadcast(self, message):
+        data = json.dumps(message, separators=(",", ":"))
+        if len(data) > self._max_size:
+            self._count_dropped()
+            return
+        for worker in self._peer_workers():
+            self._send(worker, data)
@@ -0,0 +1,140 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Lock
+import struct
+import zlib
+
+# The final (empty) block that terminates a deflate stream
+_FINAL_BLOCK = "\x03\x00"
+_GZIP_HEADER = "\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+_ZLIB_HEADER = "\x78\x9c"
+
+
+class PageCompression(object):
+    """
+    Compresses portal pages for clients that accept a "gzip" or
+    "deflate" content coding. A page is compressed as a sequence
+    of parts. Every part is compressed on its own and flushed
+    with ``Z_SYNC_FLUSH``, which makes the compressed parts
+    independent of each other. The compressed parts can therefore
+    simply be concatenated, and parts that are the same in many
+    pages (see :class:`~circuits_minpor.portal.shellcache.ShellCache`)
+    need to be compressed only once.
+
+    :param level: the compression level (1-9), ``None`` or 0
+        disable compression.
+    :param min_size: the minimum size of a page in bytes for
+        it to be compressed.
+    """
+
+    def __init__(self, level=6, min_size=1024):
+        self._level = level
+        self._min_size = min_size
+        self._pages = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._reused = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return bool(self._level)
+
+    def encoding(self, request):
+        """
+        Returns the content coding to be used for the response to
+        the given request or ``None`` if the response is to be sent
+        as it is. "gzip" is preferred if the client accepts both.
+        """
+        if not self.enabled:
+            return None
+        accepted = set()
+        for element in request.headers.elements("Accept-Encoding"):
+            if element.qvalue <= 0:
+                continue
+            value = element.value.lower()
+            if value == "x-gzip" or value == "*":
+                value = "gzip"
+            accepted.add(value)
+        for encoding in ("gzip", "deflate"):
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def deflate(self, data):
+        """
+        Compresses the data as a part of a page (raw deflate,
+        terminated with a sync flush).
+        """
+        compressor = zlib.compressobj \
+            (self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def compress(self, encoding, parts):
+        """
+        Returns the page made up of the given parts, compressed
+        with the given content coding, or ``None`` if the page
+        is too small to be compressed.
+
+        :param encoding: "gzip" or "deflate".
+        :param parts: a list of tuples with the data of a part
+            and its compressed form, as returned by :meth:`deflate`,
+            or ``None`` if it has yet to be compressed.
+        """
+        size = sum([len(data) for data, _ in parts])
+        if size < self._min_size:
+            return None
+        gzip = (encoding == "gzip")
+        check = zlib.crc32("") if gzip else zlib.adler32("")
+        compressed = [_GZIP_HEADER if gzip else _ZLIB_HEADER]
+        reused = 0
+        for data, deflated in parts:
+            if deflated is None:
+                deflated = self.deflate(data)
+            else:
+                reused += 1
+            compressed.append(deflated)
+            check = zlib.crc32(data, check) if gzip \
+                else zlib.adler32(data, check)
+        compressed.append(_FINAL_BLOCK)
+        if gzip:
+            compressed.append(struct.pack("<II", check & 0xffffffff,
+                                          size & 0xffffffff))
+        else:
+            compressed.append(struct.pack(">I", check & 0xffffffff))
+        body = "".join(compressed)
+        with self._lock:
+            self._pages += 1
+            self._bytes_in += size
+            self._bytes_out += len(body)
+            self._reused += reused
+        return body
+
+    def metrics(self):
+        """
+        Returns a dict with the number of compressed pages, their
+        sizes before and after compression and the number of
+        parts that had been compressed before.
+        """
+        return { "pages": self._pages,
+                 "bytes_in": self._bytes_in,
+                 "bytes_out": self._bytes_out,
+                 "reused_parts": self._reused }
@@ -0,0 +1,128 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from difflib import SequenceMatcher
+import re
+
+_token_pattern = re.compile(r"(<[^>]*>)")
+
+
+def tokenize(content):
+    """
+    Splits HTML content into tags and the text between them. The client
+    splits the content in the same way (using the same regular expression
+    with a capturing group), so token counts are the same on both sides.
+    """
+    return _token_pattern.split(content)
+
+
+def diff(old, new, max_tokens=4000):
+    """
+    Returns the operations that transform the tokens *old* into the 
+    tokens *new*. An operation is either a positive number (the number
+    of tokens to keep), a negative number (the number of tokens to skip)
+    or a string (text to insert). Returns ``None`` if the difference
+    cannot be computed with reasonable effort (more than *max_tokens*
+    changed tokens with different structure).
+
+    As content is usually updated by re-rendering the same template
+    with some different values, the tokens are compared position
+    by position if their number is unchanged. Else, a common prefix
+    and suffix are removed and the remaining tokens are compared
+    using :class:`difflib.SequenceMatcher`.
+    """
+    ops = []
+    def keep(count):
+        if count <= 0:
+            return
+        if ops and isinstance(ops[-1], int) and ops[-1] > 0:
+            ops[-1] += count
+        else:
+            ops.append(count)
+    def skip(count):
+        if count <= 0:
+            return
+        if ops and isinstance(ops[-1], int) and ops[-1] < 0:
+            ops[-1] -= count
+        else:
+            ops.append(-count)
+    def insert(tokens):
+        text = "".join(tokens)
+        if not text:
+            return
+        if ops and isinstance(ops[-1], basestring) and ops[-1]:
+            ops[-1] += text
+        else:
+            ops.append(text)
+    if len(old) == len(new):
+        idx = 0
+        while idx < len(old):
+            start = idx
+            while idx < len(old) and old[idx] == new[idx]:
+                idx += 1
+            keep(idx - start)
+            start = idx
+            while idx < len(old) and old[idx] != new[idx]:
+                idx += 1
+            if idx > start:
+                skip(idx - start)
+                insert(new[start:idx])
+        return ops
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix \
+        and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+    if len(old_middle) + len(new_middle) > max_tokens:
+        return None
+    keep(prefix)
+    matcher = SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            keep(i2 - i1)
+            continue
+        skip(i2 - i1)
+        if j2 > j1:
+            insert(new_middle[j1:j2])
+    keep(suffix)
+    return ops
+
+
+def apply(old, ops):
+    """
+    Applies the operations returned by :func:`diff` to the tokens *old* 
+    and returns the new content. This is what the client does.
+    """
+    result = []
+    idx = 0
+    for op in ops:
+        if isinstance(op, basestring):
+            result.append(op)
+        elif op > 0:
+            result.extend(old[idx:idx + op])
+            idx += op
+        else:
+            idx -= op
+    return "".join(result)
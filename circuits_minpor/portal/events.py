@@ -57,7 +57,8 @@ class portal_update(Event):
     An event that forwards information (as "event") to the client (browser).
     :param portlet: the portlet where the change occured or None if
         the change affects the complete portal.
-    :param session: the session.
+    :param session: the session or ``None`` to send the information
+        to all connected clients.
     :param name: a name that further classifies the information ("event name").
     :param *args: more information to be sent.
     
@@ -70,13 +71,54 @@ class portal_message(Event):
     This event can be used to add a message to the portal's top
     message display.
     
-    :param session: the session.
+    :param session: the session or ``None`` to display the message
+        for all connected clients.
     :param message: the message to display.
     :type message: string
     :param class: (optional) a CSS class to be used for the message display.
     :type class: string
     """
 
+class portal_content_update(Event):
+    """
+    An event that replaces the content of a portlet displayed by the
+    client (browser) with new content (HTML). After the first update,
+    only the difference to the content sent before is transmitted.
+    Portlets that display large, mostly unchanged content (such as
+    tables) should use this instead of sending the content with a 
+    :class:`portal_update`.
+
+    :param portlet: the portlet
+    :param session: the session or ``None`` to send the content
+        to all connected clients.
+    :param content: the new content.
+    """
+
+class portlet_async_render(Event):
+    """
+    Sent to a portlet that supports asynchronous rendering (see
+    :meth:`circuits_minpor.Portlet.async_render`) to obtain its content.
+    The content is the value of the event.
+
+    :param portal: the portal facade
+    :param mime_type: the mime type to generate
+    :param mode: the render mode
+    :param window_state: the window state
+    :param locales: the locales to use for localizing strings
+    :param url_generator_factory: the factory for the portlet's
+        URL generator
+    :param invocation_id: a value that is different for each portlet
+        rendered during the rendering of a portal page
+    """
+
+    complete = True
+    failure = True
+
+class portal_rendered(Event):
+    """
+    Fired when a portal page has been rendered. 
+    """
+
 class portlet_resource(Event):
     """request(Event) -> request Event
 
@@ -0,0 +1,151 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Lock
+import bisect
+import time
+
+
+class Histogram(object):
+    """
+    A histogram of durations (in seconds) with fixed, roughly
+    logarithmically spaced bucket bounds.
+    """
+
+    BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+              0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._buckets = [0] * (len(self.BOUNDS) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+
+    def observe(self, value):
+        self._buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self._count += 1
+        self._sum += value
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def quantile(self, q):
+        """
+        Returns an estimate (the upper bound of the bucket) of the
+        given quantile.
+        """
+        if self._count == 0:
+            return None
+        rank = q * self._count
+        seen = 0
+        for idx, count in enumerate(self._buckets):
+            seen += count
+            if seen >= rank and count > 0:
+                if idx < len(self.BOUNDS):
+                    return min(self.BOUNDS[idx], self._max)
+                return self._max
+        return self._max
+
+    def snapshot(self):
+        buckets = []
+        for idx, count in enumerate(self._buckets):
+            bound = self.BOUNDS[idx] if idx < len(self.BOUNDS) else "+Inf"
+            buckets.append([bound, count])
+        return { "count": self._count,
+                 "sum": self._sum,
+                 "min": self._min,
+                 "max": self._max,
+                 "p50": self.quantile(0.5),
+                 "p99": self.quantile(0.99),
+                 "buckets": buckets }
+
+
+class Metrics(object):
+    """
+    A registry for the portal's instrumentation data. Data is
+    recorded as histograms of durations or as counters, both
+    identified by a metric name and a key (usually a portlet handle).
+
+    Instrumented code is expected to check :attr:`enabled` before
+    taking any measurements, thus keeping the overhead negligible
+    if the instrumentation is disabled.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = dict()
+        self._counters = dict()
+        self._lock = Lock()
+
+    def observe(self, name, key, value):
+        """
+        Adds the duration *value* to the histogram *name*/*key*.
+        """
+        with self._lock:
+            histograms = self._histograms.setdefault(name, dict())
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def count(self, name, key, amount=1):
+        """
+        Adds *amount* to the counter *name*/*key*.
+        """
+        with self._lock:
+            counters = self._counters.setdefault(name, dict())
+            counters[key] = counters.get(key, 0) + amount
+
+    def timer(self):
+        """
+        Returns the current time if enabled, else ``None``. Used
+        together with :meth:`observe_since`.
+        """
+        return time.time() if self.enabled else None
+
+    def observe_since(self, name, key, start):
+        """
+        Records the time elapsed since *start* as obtained from
+        :meth:`timer`. Does nothing if *start* is ``None``.
+        """
+        if start is not None:
+            self.observe(name, key, time.time() - start)
+
+    def snapshot(self):
+        """
+        Returns the recorded data as a dict that can be serialized
+        using JSON.
+        """
+        with self._lock:
+            return { "enabled": self.enabled,
+                     "histograms": dict(
+                        [(name, dict([(key, hist.snapshot())
+                                      for key, hist in hists.items()]))
+                         for name, hists in self._histograms.items()]),
+                     "counters": dict(
+                        [(name, dict(counters))
+                         for name, counters in self._counters.items()]) }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
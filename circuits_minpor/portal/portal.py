@@ -28,6 +28,7 @@ from circuits_bricks.web.misc import LanguagePreferences, ThemeSelection
 import rbtranslations
 from circuits_minpor.portal.portalview import PortalView
 from circuits_minpor.portal.events import portlet_added, portlet_removed
+from circuits_minpor.portal.timerwheel import TimerWheel
 from os.path import dirname
 
 
@@ -52,7 +53,17 @@ class Portal(BaseComponent):
     _title = None
 
     def __init__(self, server=None, path="/", 
-                 title=None, templates_dir=None, **kwargs):
+                 title=None, templates_dir=None, render_timeout=None,
+                 breaker_threshold=5, breaker_cooldown=30, max_renders=None,
+                 max_queued_renders=0, retry_after=5, metrics=False,
+                 profiling_token=None, tracing=False, trace_buffer=1000,
+                 trace_file=None, record_file=None, record_bodies=False,
+                 record_secrets=None, session_store=None,
+                 bus=None, render_processes=None, max_sessions=None,
+                 max_solo_tabs=None, replay_buffer=100, resume_window=60,
+                 heartbeat_interval=30, idle_timeout=None,
+                 client_event_rate=None, client_event_burst=None,
+                 compression_level=6, compression_min_size=1024, **kwargs):
         """
         :param server: the component that handles the basic connection
                        and protocol management. If not provided, the
@@ -80,6 +91,183 @@ class Portal(BaseComponent):
                               for in this directory, then in the portal's
                               built-in default directory.
         :type templates_dir: string
+        
+        :param render_timeout: the maximum time in seconds that
+                               a portlet may take to render its content.
+                               If exceeded, an error message is
+                               displayed instead of the portlet's
+                               content. Defaults to no limit.
+        :type render_timeout: float
+        
+        :param breaker_threshold: the number of consecutive render
+                                  failures or timeouts after which
+                                  a portlet isn't invoked any more
+                                  for the cooldown period.
+        :type breaker_threshold: int
+        
+        :param breaker_cooldown: the cooldown period in seconds.
+        :type breaker_cooldown: float
+        
+        :param max_renders: the maximum number of portal pages that
+                            are rendered concurrently. Defaults to
+                            no limit. Requests for portal resources
+                            and the event exchange are not limited.
+        :type max_renders: int
+        
+        :param max_queued_renders: the maximum number of page requests
+                                   that wait for being rendered if
+                                   *max_renders* has been reached. Any
+                                   further requests are answered with 
+                                   "503 Service Unavailable".
+        :type max_queued_renders: int
+        
+        :param retry_after: the value (in seconds) of the "Retry-After"
+                            header sent with a 503 response.
+        :type retry_after: int
+        
+        :param metrics: if ``True``, instrumentation data is recorded
+                        and made available as JSON under the
+                        portal's path with "/portal-metrics" appended.
+                        See also :attr:`metrics`.
+        :type metrics: bool
+        
+        :param profiling_token: enables on-demand profiling if set. 
+                                A page request that carries the token 
+                                as value of an "X-Portal-Profile" header
+                                or that invokes the portal action 
+                                "profile" with the token as parameter
+                                "profile_token" is rendered with
+                                :mod:`cProfile` enabled. The portal
+                                action "profile-loop" (with parameters
+                                "profile_token" and "seconds") samples
+                                the stack of the main loop for the 
+                                given time. The id of the result is
+                                returned in the "X-Portal-Profile-Id"
+                                response header, the result can be
+                                downloaded from the portal's path with
+                                "/portal-profiles/{id}" appended
+                                (again with the token as header or
+                                parameter).
+        :type profiling_token: string
+        
+        :param tracing: if ``True``, the processing of requests and 
+                        client messages is traced (see :attr:`tracer`).
+        :type tracing: bool
+        
+        :param trace_buffer: the number of spans kept in memory.
+        :type trace_buffer: int
+        
+        :param trace_file: if set, finished spans are appended to
+                           the file with the given name as JSON 
+                           objects (one per line).
+        :type trace_file: string
+        
+        :param record_file: if set, the requests directed at the
+                            portal and the messages from the clients
+                            are recorded in the file with the given
+                            name (see :attr:`recorder`). Request bodies
+                            (e.g. form posts) and the arguments of 
+                            events from the clients are left out 
+                            unless *record_bodies* is ``True``.
+        :type record_file: string
+        
+        :param record_bodies: if ``True``, request bodies and the
+                              arguments of events from the clients
+                              are recorded as well. These may include
+                              passwords and personal data.
+        :type record_bodies: bool
+        
+        :param record_secrets: the names of parameters that are
+                               removed from recorded queries and 
+                               form posts (in addition to the 
+                               profiling token).
+        :type record_secrets: list
+        
+        :param session_store: if set, the session data is kept in the
+                              given store (see 
+                              :mod:`circuits_minpor.portal.sessions`).
+                              This is required if the portal runs in 
+                              several processes (see
+                              :func:`circuits_minpor.portal.workers.run_workers`).
+                              The data is saved when a response has
+                              been sent and when an event from the
+                              client (and all events caused by it)
+                              has been handled.
+        :type session_store: 
+            :class:`~circuits_minpor.portal.sessions.SessionStore`
+        
+        :param bus: if the portal runs in several processes, the bus
+                    that forwards portal updates to the process that
+                    holds the client's event exchange connection.
+        :type bus: :class:`~circuits_minpor.portal.bus.PortalBus`
+        
+        :param render_processes: if set, portlets that support it
+                                 (see
+                                 :meth:`~circuits_minpor.Portlet.pool_render_input`)
+                                 are rendered by a pool with the given 
+                                 number of processes.
+        :type render_processes: int
+        
+        :param max_sessions: if set, the maximum number of sessions
+                             kept in memory. When the limit is reached,
+                             the least recently used sessions without
+                             an event exchange connection are evicted
+                             (see :meth:`session_metrics`).
+        :type max_sessions: int
+        
+        :param max_solo_tabs: if set, the maximum number of tabs with
+                              a single portlet that a session may have
+                              open (at least 1). If another such tab
+                              is opened, the oldest one is closed.
+        :type max_solo_tabs: int
+        
+        :param replay_buffer: the number of messages to a client that
+                              are kept for being sent again if the
+                              client loses its event exchange connection
+                              and reconnects.
+        :type replay_buffer: int
+        
+        :param resume_window: the time in seconds after the loss of
+                              a client's event exchange connection during
+                              which messages to the client are kept
+                              for when it reconnects.
+        :type resume_window: float
+        
+        :param heartbeat_interval: the time in seconds after which
+                                   a heartbeat is sent to a client's
+                                   silent event exchange connection.
+                                   ``None`` disables heartbeats.
+        :type heartbeat_interval: float
+        
+        :param idle_timeout: the time in seconds after which a silent
+                             event exchange connection is considered
+                             dead and closed. Defaults to three
+                             heartbeat intervals.
+        :type idle_timeout: float
+        
+        :param client_event_rate: the number of events per second that
+                                  a client may send over the event
+                                  exchange in the long run. Events
+                                  exceeding the rate are dropped
+                                  and counted. ``None`` means no limit.
+                                  The portal's own control messages
+                                  are not limited.
+        :type client_event_rate: float
+        
+        :param client_event_burst: the number of events that a client
+                                   may send at once. Defaults to one 
+                                   second's worth of events.
+        :type client_event_burst: int
+        
+        :param compression_level: the level (1-9) used to compress
+                                  portal pages for clients that accept
+                                  a "gzip" or "deflate" content coding.
+                                  ``None`` or 0 disable compression.
+        :type compression_level: int
+        
+        :param compression_min_size: the minimum size of a portal page
+                                     in bytes for it to be compressed.
+        :type compression_min_size: int
         """
         super(Portal, self).__init__(**kwargs)
         self._path = path or ""
@@ -96,9 +284,40 @@ class Portal(BaseComponent):
             self._templates_dir = []
         self._templates_dir \
             += [os.path.join(dirname(dirname(__file__)), "templates")]
+        self._render_timeout = render_timeout
+        self._breaker_threshold = breaker_threshold
+        self._breaker_cooldown = breaker_cooldown
+        self._max_renders = max_renders
+        self._max_queued_renders = max_queued_renders
+        self._retry_after = retry_after
+        self._metrics_enabled = metrics
+        self._profiling_token = profiling_token
+        self._tracing = tracing
+        self._trace_buffer = trace_buffer
+        self._trace_file = trace_file
+        self._record_file = record_file
+        self._record_bodies = record_bodies
+        self._record_secrets = record_secrets
+        self._session_store = session_store
+        self._bus = bus
+        self._render_processes = render_processes
+        self._max_sessions = max_sessions
+        if max_solo_tabs is not None and max_solo_tabs < 1:
+            raise ValueError("max_solo_tabs must be at least 1")
+        self._max_solo_tabs = max_solo_tabs
+        self._replay_buffer = replay_buffer
+        self._resume_window = resume_window
+        self._heartbeat_interval = heartbeat_interval
+        self._idle_timeout = idle_timeout
+        self._client_event_rate = client_event_rate
+        self._client_event_burst = client_event_burst
+        self._compression_level = compression_level
+        self._compression_min_size = compression_min_size
+        self._timers = TimerWheel(channel = self.channel).register(self)
         LanguagePreferences(channel = server.channel).register(server)
         ThemeSelection(channel = server.channel).register(server)
         view = PortalView(self, channel = server.channel).register(server)
+        self._view = view
         self._url_generator_factory = view.url_generator_factory
         self._supported_locales = []
         for locale in rbtranslations.available_translations\
@@ -128,6 +347,7 @@ class Portal(BaseComponent):
             return
         if c in self._portlets:
             self._portlets.remove(c)
+            self._timers.cancel_portlet(c)
             self.fire(portlet_removed(self, c), c)
 
     @property
@@ -146,6 +366,105 @@ class Portal(BaseComponent):
     def supported_locales(self):
         return getattr(self, "_supported_locales", [])
 
+    @property
+    def timers(self):
+        """
+        The :class:`~circuits_minpor.portal.timerwheel.TimerWheel`
+        that portlets use to schedule periodic or delayed work.
+        """
+        return self._timers
+
+    @property
+    def metrics(self):
+        """
+        The :class:`~circuits_minpor.portal.metrics.Metrics` that
+        record render latencies per portlet ("portlet_render"),
+        template processing times ("template"), page render times
+        ("page_render", "request"), the time spent waiting for 
+        admission ("admission_wait"), action event round-trip times
+        ("action_round_trip") and the number of event exchange
+        messages per portlet ("ws_in", "ws_out"). Recording can be
+        switched on or off at runtime by setting the metrics'
+        ``enabled`` attribute.
+        """
+        return self._view.metrics
+
+    @property
+    def tracer(self):
+        """
+        The :class:`~circuits_minpor.portal.tracing.Tracer` that
+        records the processing steps ("spans") of HTTP requests
+        ("request", "admission", "action", "render_page", "template",
+        "portlet_render") and client messages ("client_message", 
+        "client_event", "portal_update"). Spans of the same request or
+        message share a trace id, which is also returned to the
+        client in the "X-Portal-Trace-Id" response header.
+        """
+        return self._view.tracer
+
+    @property
+    def recorder(self):
+        """
+        The :class:`~circuits_minpor.portal.recording.TrafficRecorder`
+        that records the traffic directed at the portal for being
+        replayed later (see ``benchmarks/replay.py``). A recording 
+        can be started and stopped at runtime.
+        """
+        return self._view.recorder
+
+    def breaker_states(self):
+        """
+        Returns the state of the circuit breakers that guard the
+        rendering of the portlets as a dict that maps portlet handles
+        to dicts with the breaker's state ("closed", "open" or
+        "half-open") and its failure counters.
+        """
+        return self._view.render_guard.states()
+
+    def admission_metrics(self):
+        """
+        Returns a dict with the number of currently active page renders,
+        the number of page requests waiting for being rendered and
+        counters for admitted and rejected page requests.
+        """
+        return self._view.admission.metrics()
+
+    def session_metrics(self, memory=False):
+        """
+        Returns a dict with the number of sessions kept in memory,
+        the maximum number of sessions and the number of sessions
+        evicted so far. If *memory* is ``True``, the dict also 
+        contains the (estimated) number of bytes used by the
+        sessions ("bytes"), which is expensive to compute.
+        """
+        return self._view.session_metrics(memory)
+
+    def connection_metrics(self):
+        """
+        Returns a dict with the numbers of open event exchange 
+        connections by transport ("websocket", "stream") and the 
+        number of connections closed because they were idle 
+        ("reaped").
+        """
+        return self._view.connection_metrics()
+
+    def subscribers(self, portlet):
+        """
+        Returns the number of clients that currently display the 
+        given portlet. Portlets that produce updates on their own
+        may use this to stop working while nobody is watching.
+        """
+        return self._view.subscribers(portlet.description().handle)
+
+    def displays(self, session, portlet):
+        """
+        Returns ``True`` if the client of the given session currently
+        displays the given portlet. Portlets that produce updates for
+        a specific session may use this to stop working while the
+        session's client isn't watching.
+        """
+        return self._view.displays(session, portlet.description().handle)
+
     def portlet_by_handle(self, portlet_handle):
         for portlet in self._portlets:
             portlet_desc = portlet.description()
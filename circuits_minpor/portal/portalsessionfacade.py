@@ -18,7 +18,8 @@
 
 .. moduleauthor:: mnl
 """
-from circuits_minpor.portal.events import portal_update, portal_message
+from circuits_minpor.portal.events import portal_update, portal_message,\
+    portal_content_update
 from circuits_bricks.web.misc import ThemeSelection
 
 class PortalSessionFacade(object):
@@ -34,13 +35,13 @@ class PortalSessionFacade(object):
     forwarded to the portal (instead of the portal view), i.e. that
     don't really require the session information. 
     """
+
+    __slots__ = ("_session", "_portal_view", "_portal")
         
     def __init__(self, portal_view, session):
         self._session = session
         self._portal_view = portal_view
         self._portal = portal_view.portal
-        self._theme = ThemeSelection.selected(session)
-        self._tabs = portal_view.tab_manager(session).tabs
 
     @property
     def portal_view(self):
@@ -64,20 +65,34 @@ class PortalSessionFacade(object):
 
     @property
     def theme(self):
-        return self._theme
+        return ThemeSelection.selected(self._session)
 
     @property
     def tabs(self):
-        return self._tabs
+        # Not cached, the session's tab manager may have been
+        # replaced by a restored one
+        return self._portal_view.tab_manager(self._session).tabs
 
     @property
     def portlets(self):
         return self._portal.portlets
 
+    @property
+    def render_pool(self):
+        return self._portal_view.render_pool
+
+    def minimized(self, portlet):
+        return self._portal_view.tab_manager(self._session) \
+            .is_minimized(portlet)
+
     def update(self, portlet, *args, **kwargs):
         portlet.fire(portal_update(portlet, self._session, *args, **kwargs), \
                      self._portal.channel)
 
+    def update_content(self, portlet, content):
+        portlet.fire(portal_content_update(portlet, self._session, content),
+                     self._portal.channel)
+
     def message(self, portlet, *args, **kwargs):
         portlet.fire(portal_message(self._session, *args, \
                                  **kwargs), self._portal.channel)
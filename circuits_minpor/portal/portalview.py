@@ -22,7 +22,7 @@ from circuits.core.components import BaseComponent
 from circuits_minpor.portlet import Portlet
 import urllib
 import tenjin
-from circuits_bricks.web.sessions import Sessions
+from circuits_minpor.portal.sessions import PortalSessions
 from circuits_minpor.utils.dispatcher import WebSocketsDispatcherPlus
 from circuits.core.handlers import handler
 from circuits.web.utils import parse_qs, parse_body
@@ -30,17 +30,41 @@ import os
 from circuits.web import tools
 from circuits_bricks.web.misc import ThemeSelection, LanguagePreferences
 from circuits_minpor.portal.events import portal_client_connect,\
-    portal_client_disconnect, portlet_resource
+    portal_client_disconnect, portlet_resource, portlet_async_render,\
+    portal_rendered
 from circuits_bricks.app.logger import log
 import logging
 import sys
-from threading import Thread, Semaphore
+from threading import Thread, Semaphore, Lock, Event as ThreadEvent
 import rbtranslations
 from circuits_minpor.utils.misc import serve_tenjin
 import json
 from circuits.io.events import write
 from circuits_minpor.portal.portalsessionfacade import PortalSessionFacade
 from os.path import dirname, join
+from circuits_minpor.portal.renderguard import RenderGuard, RenderFailed,\
+    CircuitBreaker
+from circuits_minpor.portal.admission import AdmissionControl,\
+    EventRateLimit
+from circuits_minpor.portal.metrics import Metrics
+from circuits_minpor.portal.profiling import ProfileStore, RequestProfile,\
+    LoopSampler
+from circuits_minpor.portal.tracing import Tracer
+from circuits_minpor.portal.recording import TrafficRecorder
+from circuits_minpor.portal.bus import bus_message
+from circuits_minpor.portal.renderpool import RenderPool
+from circuits_minpor.portal.replay import ReplayBuffer
+from circuits_minpor.portal import delta
+from circuits_minpor.portal.assets import AssetBundles, \
+    LocalizationScripts
+from circuits_minpor.portal.shellcache import ShellCache
+from circuits_minpor.portal.compression import PageCompression
+from collections import OrderedDict
+from itertools import islice
+import time
+import hmac
+import thread
+from circuits.web.errors import httperror
 
 class PortalView(BaseComponent):
     """
@@ -58,6 +82,11 @@ class PortalView(BaseComponent):
     """
     
     _waiting_for_event_complete = False    
+    # While asynchronous portlet renders are running, the main loop 
+    # must process tasks more often than it does by default
+    AsyncPollInterval = 0.005
+    # Maximum number of events in a batch from the client
+    MaxBatchedEvents = 100
     # The cache of events that portlets accept from the client.  
     _accepted_events = None 
 
@@ -71,13 +100,65 @@ class PortalView(BaseComponent):
         self._portal_resource_dir = join(dirname(dirname(__file__)), "static")
         self._theme_resource = self.prefix + "/theme-resource/"
         self._portlet_resource = self.prefix + "/portlet-resource/"
+        self._bundle_resource = self.prefix + "/portal-bundle/"
+        self._bundles = AssetBundles()
+        self._l10n_scripts = LocalizationScripts(portal._templates_dir)
+        self._shells = ShellCache()
+        self._compression = PageCompression(portal._compression_level,
+                                            portal._compression_min_size)
+        self._metrics_resource = self.prefix + "/portal-metrics"
+        self._profiles_resource = self.prefix + "/portal-profiles"
         self._ugFactory = UGFactory(self.prefix)
-        Sessions(channel = self.channel, path=portal.path,
-                 name=self.channel + ".portal_session").register(self)
+        self._render_counts = dict()
+        self._render_counts_lock = Lock()
+        self._render_guard = RenderGuard(portal._render_timeout,
+                                         portal._breaker_threshold,
+                                         portal._breaker_cooldown)
+        self._admission = AdmissionControl(portal._max_renders,
+                                           portal._max_queued_renders,
+                                           portal._retry_after)
+        self._event_rate = EventRateLimit(portal._client_event_rate,
+                                          portal._client_event_burst)
+        self._metrics = Metrics(portal._metrics_enabled)
+        self._profiling_token = portal._profiling_token
+        self._profiles = ProfileStore()
+        self._tracer = Tracer(portal._tracing, portal._trace_buffer,
+                              portal._trace_file)
+        self._recorder = TrafficRecorder(portal._record_file,
+                                         bodies=portal._record_bodies,
+                                         secrets=portal._record_secrets)
+        self._bus = portal._bus
+        self._render_pool = RenderPool(portal._render_processes) \
+            if portal._render_processes else None
+        self._connected = dict()
+        self._owners = dict()
+        self._subscribers = dict()
+        self._remote_subscribers = dict()
+        # Recently disconnected sessions that may resume
+        self._detached = OrderedDict()
+        self._async_renders = 0
+        self._async_renders_lock = Lock()
+        self._sessions = PortalSessions \
+            (portal._session_store,
+             [self.__class__.__name__ + ".client_connection",
+              self.__class__.__name__ + ".facade",
+              self.__class__.__name__ + ".trace_id",
+              self.__class__.__name__ + ".subscriptions",
+              self.__class__.__name__ + ".replay",
+              self.__class__.__name__ + ".contents",
+              self.__class__.__name__ + ".event_bucket",
+              TrafficRecorder.__name__ + ".session"],
+             portal._max_sessions,
+             lambda session: self.client_connection(session) is None,
+             channel = self.channel, path=portal.path,
+             name=self.channel + ".portal_session").register(self)
         self._event_exchange_channel = self._portal.channel + "-eventExchange"
-        WebSocketsDispatcherPlus(self.prefix + "/eventExchange", 
-                channel=self.channel, wschannel=self._event_exchange_channel) \
-                .register(self)
+        self._event_exchange = WebSocketsDispatcherPlus \
+            (self.prefix + "/eventExchange", channel=self.channel, 
+             wschannel=self._event_exchange_channel,
+             heartbeat_interval=self._portal._heartbeat_interval,
+             idle_timeout=self._portal._idle_timeout,
+             timers=self._portal.timers).register(self)
                 
         # Handle web socket connects from client
         @handler("connect", channel=self._event_exchange_channel)
@@ -85,6 +166,12 @@ class PortalView(BaseComponent):
             session = kwargs.get("session")
             if session:
                 session[self.__class__.__name__ + ".client_connection"] = sock
+                self._recorder.ws_open \
+                    (session, self.prefix + "/eventExchange")
+                self._client_attached(session)
+                query = kwargs.get("query", {})
+                if "epoch" in query:
+                    self._resume(session, query["epoch"], query.get("seq"))
             self.fire(portal_client_connect(session), self._portal.channel)
         self.addHandler(_on_ws_connect)
         
@@ -94,6 +181,8 @@ class PortalView(BaseComponent):
             session = kwargs.get("session")
             if self.client_connection(session) == sock:
                 session[self.__class__.__name__ + ".client_connection"] = None
+                self._recorder.ws_close(session)
+                self._client_detached(session)
             self.fire(portal_client_disconnect(session, sock), \
                       self._portal.channel)
         self.addHandler(_on_ws_disconnect)
@@ -101,22 +190,56 @@ class PortalView(BaseComponent):
         # Handle a message from the client
         @handler("read", channel=self._event_exchange_channel)
         def _on_ws_read(self, socket, data, **kwargs):
+            self._recorder.ws_message(kwargs.get("session"), data)
             self._on_message_from_client(kwargs.get("session"), data)
         self.addHandler(_on_ws_read)
 
+        # Handle the completion of events from the client
+        self._client_event_channel = self.channel + "-clientEvent"
+        @handler(channel=self._client_event_channel)
+        def _on_client_event_complete(self, e, value):
+            # Changes made by the handlers must be visible to all workers
+            session = e.kwargs.get("session")
+            sid = session.get(PortalSessions.SessionIdKey) \
+                if session is not None else None
+            if sid is not None and self._sessions.store is not None:
+                self._sessions.save(sid, session)
+        self.addHandler(_on_client_event_complete)
+
         # Handle a portal update event for the portal
         @handler("portal_update", channel=self._portal.channel)
-        def _on_portal_update_handler(self, portlet, session, name, *args):
+        def _on_portal_update_handler(self, event, portlet, session, 
+                                      name, *args):
+            span = self._tracer.start \
+                ("portal_update", getattr(event, "trace_id", None)
+                 or self.active_trace(session), update=name)
             self._on_portal_update(portlet, session, name, *args)
+            self._tracer.finish(span)
         self.addHandler(_on_portal_update_handler)
         
         # Handle a portal message event for the portal
         @handler("portal_message", channel=self._portal.channel)
-        def _on_portal_message(self, session, message, clazz=""):
+        def _on_portal_message(self, event, session, message, clazz=""):
+            span = self._tracer.start \
+                ("portal_update", getattr(event, "trace_id", None)
+                 or self.active_trace(session), update="portal_message")
             self._on_portal_update \
                 (None, session, "portal_message", message, clazz)
+            self._tracer.finish(span)
         self.addHandler(_on_portal_message)
 
+        # Handle a content update for the portal
+        @handler("portal_content_update", channel=self._portal.channel)
+        def _on_portal_content_update(self, event, portlet, session, 
+                                      content):
+            handle = portlet.description().handle
+            span = self._tracer.start \
+                ("portal_update", getattr(event, "trace_id", None)
+                 or self.active_trace(session), update="portal_content")
+            self._send_content(session, handle, content)
+            self._tracer.finish(span)
+        self.addHandler(_on_portal_content_update)
+
     @property
     def prefix(self):
         return self._portal_prefix
@@ -128,25 +251,77 @@ class PortalView(BaseComponent):
             session[self.__class__.__name__ + ".facade"] = facade
         return facade
         
+    @handler("started", channel="*")
+    def _on_started(self, component):
+        """
+        Starts the bus and the render pool in the process that runs 
+        the portal.
+        """
+        if self._render_pool is not None:
+            self._render_pool.start()
+        if self._bus is not None:
+            self._bus.start(lambda message: 
+                            self.fire(bus_message(message), self.channel))
+
+    @handler("stopped", channel="*")
+    def _on_stopped(self, component):
+        if self._bus is not None:
+            self._bus.stop()
+        if self._render_pool is not None:
+            self._render_pool.close()
+        self._tracer.close()
+        self._recorder.stop()
+
+    @handler("portlet_async_render_complete", 
+             "portlet_async_render_failure", channel="*")
+    def _on_async_render_done(self, e, value):
+        """
+        Signals the completion of an asynchronous portlet render to
+        the waiting render thread. If the render fails before it
+        has become a task, both the failure and the complete event
+        are fired, only the first one counts.
+        """
+        done = getattr(e, "done", None)
+        if done is None:
+            return
+        with self._async_renders_lock:
+            if done.is_set():
+                return
+            self._async_renders -= 1
+            done.set()
+
+    def _async_render_started(self):
+        with self._async_renders_lock:
+            self._async_renders += 1
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        if self._async_renders:
+            event.reduce_time_left(self.AsyncPollInterval)
+
     @handler("registered", channel="*")
     def _on_registered(self, c, m):
         """
-        Flushes the accepted events cache if the set of known portlets
-        changes.
+        Flushes the accepted events cache, the asset bundles and the
+        cached page segments if the set of known portlets changes.
         """
         if not isinstance(c, Portlet):
             return
         self._accepted_events = None
+        self._bundles.invalidate()
+        self._shells.invalidate()
 
     @handler("unregistered")
     def _on_unregistered(self, c, m):
         """
-        Flushes the accepted events cache if the set of known portlets
-        changes.
+        Flushes the accepted events cache, the asset bundles and the
+        cached page segments if the set of known portlets changes.
         """
         if not isinstance(c, Portlet):
             return
         self._accepted_events = None
+        self._bundles.invalidate()
+        self._shells.invalidate()
 
     @property
     def portal(self):
@@ -156,8 +331,49 @@ class PortalView(BaseComponent):
     def url_generator_factory(self):
         return getattr(self, "_ugFactory", None)
 
+    @property
+    def render_guard(self):
+        return getattr(self, "_render_guard", None)
+
+    @property
+    def admission(self):
+        return getattr(self, "_admission", None)
+
+    @property
+    def metrics(self):
+        return getattr(self, "_metrics", None)
+
+    def metrics_report(self):
+        """
+        Returns all instrumentation data (recorded metrics, admission
+        control state, circuit breaker states and render counts)
+        as a dict that can be serialized using JSON.
+        """
+        report = self._metrics.snapshot()
+        report["admission"] = self._admission.metrics()
+        report["breakers"] = self._render_guard.states()
+        report["render_counts"] = self.render_counts()
+        report["sessions"] = self.session_metrics()
+        report["connections"] = self.connection_metrics()
+        report["client_events"] = self._event_rate.metrics()
+        report["timers"] = self._portal.timers.metrics()
+        report["shells"] = self._shells.metrics()
+        report["compression"] = self._compression.metrics()
+        return report
+
+    def session_metrics(self, memory=False):
+        metrics = { "count": self._sessions.count,
+                    "max": self._sessions.max_sessions,
+                    "evicted": self._sessions.evicted }
+        if memory:
+            metrics["bytes"] = self._sessions.memory_usage()
+        return metrics
+
+    def connection_metrics(self):
+        return self._event_exchange.connections
+
     def tab_manager(self, session):
-        return TabManager.get(session)
+        return TabManager.get(session).resolve(self._portal)
 
     def configuring(self, session):
         return session.get("_configuring", None)
@@ -165,6 +381,182 @@ class PortalView(BaseComponent):
     def client_connection(self, session):
         return session.get(self.__class__.__name__ + ".client_connection")
 
+    def replay_buffer(self, session):
+        """
+        Returns the :class:`~.replay.ReplayBuffer` for the messages
+        sent to the client of the session.
+        """
+        key = self.__class__.__name__ + ".replay"
+        buffer = session.get(key)
+        if buffer is None:
+            buffer = session.setdefault \
+                (key, ReplayBuffer(self._portal._replay_buffer))
+        return buffer
+
+    def _resume(self, session, epoch, seq):
+        """
+        Sends the messages that the client has missed while it was
+        disconnected. If they are no longer available, the client is
+        asked to reload the page. A client with an unknown epoch (e.g.
+        from another worker process) continues with the current 
+        sequence number.
+        """
+        buffer = self.replay_buffer(session)
+        try:
+            missed = buffer.since(epoch, int(seq))
+        except (TypeError, ValueError):
+            missed = None
+        if missed is None:
+            if epoch == buffer.epoch:
+                msg = json.dumps(["portal", "reload"])
+            else:
+                msg = json.dumps(["portal", "resync", 
+                                  buffer.epoch, buffer.seq])
+            self.fire(write(self.client_connection(session), msg), \
+                      self._event_exchange_channel)
+            return
+        if self._metrics.enabled:
+            self._metrics.count("ws_replayed", None, len(missed))
+        for msg in missed:
+            self.fire(write(self.client_connection(session), msg), \
+                      self._event_exchange_channel)
+
+    def subscriptions(self, session):
+        """
+        Returns the handles of the portlets that the client of the 
+        session displays or ``None`` if the client hasn't declared
+        them (yet).
+        """
+        return session.get(self.__class__.__name__ + ".subscriptions")
+
+    def subscribers(self, handle):
+        """
+        Returns the number of clients that display the portlet with
+        the given handle. If the portal runs in several processes,
+        the clients connected to the other processes are included.
+        """
+        return self._subscribers.get(handle, 0) \
+            + sum([counts.get(handle, 0) 
+                   for counts in self._remote_subscribers.values()])
+
+    def _subscribe(self, session, handles):
+        """
+        Replaces the portlets that the client of the session displays.
+        """
+        known = set([portlet.description().handle 
+                     for portlet in self._portal.portlets])
+        new = frozenset([handle for handle in handles if handle in known])
+        old = self.subscriptions(session) or frozenset()
+        if new == old and self.subscriptions(session) is not None:
+            return
+        for handle in old - new:
+            count = self._subscribers.get(handle, 0) - 1
+            if count > 0:
+                self._subscribers[handle] = count
+            else:
+                self._subscribers.pop(handle, None)
+        for handle in new - old:
+            self._subscribers[handle] = self._subscribers.get(handle, 0) + 1
+        session[self.__class__.__name__ + ".subscriptions"] = new
+        if self._bus is not None:
+            self._bus.broadcast(["subscribers", self._bus.worker,
+                                 self._subscribers])
+
+    def _unsubscribe(self, session):
+        if self.subscriptions(session) is None:
+            return
+        self._subscribe(session, ())
+        session[self.__class__.__name__ + ".subscriptions"] = None
+
+    def displays(self, session, handle):
+        """
+        Returns ``True`` if the client of the session displays the
+        portlet with the given handle. A client that is connected 
+        to another process or that hasn't declared the portlets that
+        it displays (yet) is assumed to display all portlets.
+        """
+        subscriptions = self.subscriptions(session)
+        if subscriptions is not None:
+            return handle in subscriptions
+        if self.client_connection(session) is not None:
+            return True
+        return session.get(PortalSessions.SessionIdKey) in self._owners
+
+    def _is_subscribed(self, session, handle):
+        if handle == "portal":
+            return True
+        subscriptions = self.subscriptions(session)
+        return subscriptions is None or handle in subscriptions
+
+    def render_counts(self):
+        """
+        Returns a dict that maps the handles of the portlets to
+        a tuple with the number of times that the portlet has been
+        rendered as part of a portal page and the number of times
+        that rendering has been skipped because the portlet was
+        minimized or not on the selected tab. Unlike
+        :attr:`~circuits_minpor.Portlet.render_count`, a render
+        is counted only if its result is used by the page.
+        """
+        with self._render_counts_lock:
+            return dict(self._render_counts)
+
+    def _count_render(self, portlet, rendered):
+        handle = portlet.description().handle
+        with self._render_counts_lock:
+            counts = self._render_counts.get(handle, (0, 0))
+            if rendered:
+                counts = (counts[0] + 1, counts[1])
+            else:
+                counts = (counts[0], counts[1] + 1)
+            self._render_counts[handle] = counts
+
+    @property
+    def profiles(self):
+        return getattr(self, "_profiles", None)
+
+    @property
+    def tracer(self):
+        return getattr(self, "_tracer", None)
+
+    @property
+    def recorder(self):
+        return getattr(self, "_recorder", None)
+
+    @property
+    def render_pool(self):
+        return getattr(self, "_render_pool", None)
+
+    def active_trace(self, session):
+        """
+        Returns the id of the trace started by the most recent
+        event from the client that is still being processed. Used to 
+        associate portal updates with the trace of the client event 
+        that caused them.
+        """
+        if session is None:
+            return None
+        return session.get(self.__class__.__name__ + ".trace_id")
+
+    def _profiling_authorized(self, request, kwargs):
+        """
+        Checks if the request carries the profiling token, either as
+        value of the "X-Portal-Profile" header or as query parameter
+        "profile_token".
+        """
+        if not self._profiling_token:
+            return False
+        token = request.headers.get("X-Portal-Profile") \
+            or kwargs.get("profile_token")
+        if not isinstance(token, basestring):
+            return False
+        expected = self._profiling_token
+        if isinstance(token, unicode):
+            token = token.encode("utf-8")
+        if isinstance(expected, unicode):
+            expected = expected.encode("utf-8")
+        return hmac.compare_digest(token, expected)
+
     def _is_portal_request(self, request):
         return request.path == self.prefix \
             or (request.path.startswith(self.prefix + "/") \
@@ -181,11 +573,34 @@ class PortalView(BaseComponent):
 
         if peer_cert:
             event.peer_cert = peer_cert
+        if not request.path.startswith(self._metrics_resource) \
+            and not request.path.startswith(self._profiles_resource):
+            self._recorder.http(request)
+        event.trace_id = self._tracer.new_trace()
+        if event.trace_id is not None:
+            event.trace_span = self._tracer.start \
+                ("request", event.trace_id, path=request.path)
+            response.headers["X-Portal-Trace-Id"] = event.trace_id
             
         # Decode query parameters and body
         event.kwargs = parse_qs(request.qs)
         parse_body(request, response, event.kwargs)
         session = request.session
+        # Is this a request for the instrumentation data?
+        if request.path == self._metrics_resource and self._metrics.enabled:
+            event.stop()
+            response.headers["Content-Type"] = "application/json"
+            response.headers["Cache-Control"] = "no-cache"
+            return json.dumps(self.metrics_report())
+        # Is this a request for profiling results?
+        if request.path.startswith(self._profiles_resource) \
+            and self._profiling_token:
+            event.stop()
+            if not self._profiling_authorized(request, event.kwargs):
+                return httperror(request, response, 403)
+            return self._serve_profile \
+                (request, response, 
+                 request.path[len(self._profiles_resource):].strip("/"))
         # Is this a portal portal request?
         if request.path.startswith(self._portal_resource):
             res = os.path.join(os.path.join\
@@ -195,6 +610,21 @@ class PortalView(BaseComponent):
                 event.stop()
                 return tools.serve_file(request, response, res)
             return
+        # Is this a request for a bundle of portlet assets?
+        if request.path.startswith(self._bundle_resource):
+            event.stop()
+            name = request.path[len(self._bundle_resource):]
+            bundle = self._bundles.get(self._portal.portlets, name) \
+                or self._l10n_scripts.get \
+                    (name, [locale for locale, _ 
+                            in self._portal.supported_locales])
+            if bundle is None:
+                return httperror(request, response, 404)
+            response.headers["Content-Type"] = bundle[0]
+            # The name changes with the content
+            response.headers["Cache-Control"] \
+                = "public, max-age=31536000, immutable"
+            return bundle[1]
         # Is this a portal theme resource request?
         if request.path.startswith(self._theme_resource):
             for directory in self._portal._templates_dir:
@@ -217,6 +647,25 @@ class PortalView(BaseComponent):
                 return self.fire (portlet_resource(*event.args, 
                                                    **event.kwargs), segs[0])
 
+    def _serve_profile(self, request, response, profile_id):
+        response.headers["Cache-Control"] = "no-cache"
+        if not profile_id:
+            response.headers["Content-Type"] = "application/json"
+            return json.dumps(self._profiles.list())
+        entry = self._profiles.get(profile_id)
+        if entry is None:
+            return httperror(request, response, 404)
+        data, info = entry
+        if info["kind"] == "loop":
+            response.headers["Content-Type"] = "text/plain"
+            name = profile_id + ".txt"
+        else:
+            response.headers["Content-Type"] = "application/octet-stream"
+            name = profile_id + ".prof"
+        response.headers["Content-Disposition"] \
+            = 'attachment; filename="%s"' % name
+        return data
+
     @handler("request", priority=0.79)
     def _on_request_2(self, event, request, response, peer_cert=None):
         """
@@ -240,60 +689,110 @@ class PortalView(BaseComponent):
         if not self._is_portal_request(request):
             return
 
-        session = request.session
-        
-        path_segs = urllib.unquote \
-            (request.path[len(self.prefix)+1:]).split("/")
-        portlet = None
-        if path_segs[0] != '':
-            if path_segs[0] == "portal":
-                # Perform requested portal actions
-                self._perform_portal_actions \
-                    (request, response, path_segs, event.kwargs)
-            else:
-                portlet = self._portal.portlet_by_handle(path_segs[0])
-                if portlet != None:
-                    del path_segs[0]
+        # Limit concurrent renders (sheds load when overloaded)
+        started = self._metrics.timer()
+        request_span = getattr(event, "trace_span", None)
+        span = self._tracer.start \
+            ("admission", event.trace_id, request_span)
+        ticket = self._admission.enter()
+        if ticket is None:
+            self._tracer.finish(span, rejected=True)
+            self._tracer.finish(request_span, status=503)
+            event.stop()
+            response.headers["Retry-After"] \
+                = str(self._admission.retry_after)
+            yield httperror(request, response, 503)
+            return
+        try:
+            while not self._admission.admitted(ticket):
+                yield None
+            self._metrics.observe_since("admission_wait", None, started)
+            self._tracer.finish(span)
 
+            session = request.session
+            
+            path_segs = urllib.unquote \
+                (request.path[len(self.prefix)+1:]).split("/")
+            # Profile this request?
+            profile = None
+            if self._profiling_authorized(request, event.kwargs) \
+                and (request.headers.get("X-Portal-Profile")
+                     or path_segs[0:2] == ["portal", "profile"]):
+                profile = RequestProfile(request.path)
+            event.portal_profile = profile
+            portlet = None
+            if path_segs[0] != '':
+                if path_segs[0] == "portal":
+                    # Perform requested portal actions
+                    self._perform_portal_actions \
+                        (request, response, path_segs, event.kwargs)
+                else:
+                    portlet = self._portal.portlet_by_handle(path_segs[0])
+                    if portlet != None:
+                        del path_segs[0]
 
-        if portlet != None:
-            # Perform requested portlet state changes
-            self._perform_portlet_state_changes(session, portlet, path_segs)
-            # Get requested events
-            if len(path_segs) >= 4 and path_segs[0] == "event":
-                evt = None
-                event_num = int(path_segs[1])
-                if event_num >= session.get("_expected_event", 0):
-                    session["_expected_event"] += 1 
-                    evt = self._create_event_from_request \
-                        (session, path_segs[2], [], 
-                         getattr(event, "kwargs", {}), path_segs[3])
-                del path_segs[0:4]
+
+            if portlet != None:
+                # Perform requested portlet state changes
+                self._perform_portlet_state_changes \
+                    (session, portlet, path_segs)
+                # Get requested events
+                if len(path_segs) >= 4 and path_segs[0] == "event":
+                    evt = None
+                    event_num = int(path_segs[1])
+                    if event_num >= session.get("_expected_event", 0):
+                        session["_expected_event"] += 1 
+                        evt = self._create_event_from_request \
+                            (session, path_segs[2], [], 
+                             getattr(event, "kwargs", {}), path_segs[3])
+                    del path_segs[0:4]
                 
-                if evt:
-                    evt.complete = True
-                    self._waiting_for = evt
-                    @handler("%s_complete" % evt.name, channel=evt.channels[0])
-                    def _on_complete(self, e, value):
-                        if id(self._waiting_for) == id(e):
-                            self._waiting_for = None
-                    complete_handler = self.addHandler(_on_complete)
-                    self.fireEvent(evt)
-                    while self._waiting_for:
-                        yield None
-                    self.removeHandler(complete_handler)
+                    if evt:
+                        evt.trace_id = event.trace_id
+                        span = self._tracer.start \
+                            ("action", event.trace_id, request_span,
+                             event=evt.name, channel=evt.channels[0])
+                        evt.complete = True
+                        self._waiting_for = evt
+                        @handler("%s_complete" % evt.name, 
+                                 channel=evt.channels[0])
+                        def _on_complete(self, e, value):
+                            if id(self._waiting_for) == id(e):
+                                self._waiting_for = None
+                        complete_handler = self.addHandler(_on_complete)
+                        fired = self._metrics.timer()
+                        self.fireEvent(evt)
+                        while self._waiting_for:
+                            yield None
+                        self.removeHandler(complete_handler)
+                        self._metrics.observe_since \
+                            ("action_round_trip", evt.name, fired)
+                        self._tracer.finish(span)
     
-        # We'll handle this request
-        event.stop()
-        # Render portal
-        event.portal_response = None
-        # See _render_portal_template for an explanation
-        # why we need another thread here. Pass any information
-        # that is thread local as addition parameters
-        RenderThread(self, event, request, response).start()
-        while not event.portal_response:
-            yield None
-        yield event.portal_response
+            # We'll handle this request
+            event.stop()
+            # Render portal
+            event.portal_response = None
+            # See _render_portal_template for an explanation
+            # why we need another thread here. Pass any information
+            # that is thread local as addition parameters
+            rendering = self._metrics.timer()
+            event.render_span = self._tracer.start \
+                ("render_page", event.trace_id, request_span)
+            RenderThread(self, event, request, response).start()
+            while not event.portal_response:
+                yield None
+            self._metrics.observe_since("page_render", None, rendering)
+            self._metrics.observe_since("request", None, started)
+            self._tracer.finish(event.render_span)
+            self._tracer.finish(request_span)
+            if profile is not None:
+                profile_id = self._profiles.reserve()
+                self._profiles.put(profile_id, *profile.result())
+                response.headers["X-Portal-Profile-Id"] = profile_id
+            yield event.portal_response
+        finally:
+            self._admission.leave(ticket)
 
     @handler("request", priority=0.78)
     def _on_request_3(self, event, request, response, peer_cert=None):
@@ -319,6 +818,20 @@ class PortalView(BaseComponent):
             self.tab_manager(request.session).close_tab(int(kwargs.get("tab")))
         elif action == "finish-editing":
             self.tab_manager(request.session).configure(None)
+        elif action == "profile-loop" \
+            and self._profiling_authorized(request, kwargs):
+            # Sample the main loop (i.e. this thread)
+            try:
+                seconds = float(kwargs.get("seconds", 10))
+            except (TypeError, ValueError):
+                seconds = 10
+            if not seconds > 0:
+                # Negative, zero or NaN
+                seconds = 10
+            sampler = LoopSampler(self._profiles, thread.get_ident(),
+                                  min(seconds, 300))
+            sampler.start()
+            response.headers["X-Portal-Profile-Id"] = sampler.id
 
     def _perform_portlet_state_changes(self, session, portlet, path_segs):
         if len(path_segs) < 2 or path_segs[0] == "event":
@@ -332,8 +845,12 @@ class PortalView(BaseComponent):
             tab_manager.configure(None)
         if mode == "edit":
             tab_manager.configure(portlet)
-        if window_state == "solo":
-            tab_manager.add_solo(portlet)
+        if window_state == Portlet.WindowState.Solo:
+            tab_manager.add_solo(portlet, self._portal._max_solo_tabs)
+        elif window_state == Portlet.WindowState.Minimized:
+            tab_manager.minimize(portlet)
+        elif window_state == Portlet.WindowState.Normal:
+            tab_manager.restore(portlet)
 
     def _create_event_from_request \
             (self, session, evt_class, args, kwargs, channel):
@@ -373,46 +890,364 @@ class PortalView(BaseComponent):
         return chans == None or channel in chans
                 
     
+    def _client_attached(self, session):
+        sid = session.get(PortalSessions.SessionIdKey)
+        self._connected[sid] = session
+        if self._detached.pop(sid, None) is not None:
+            self._portal.timers.cancel((self.channel + ".detached", sid))
+        self._purge_detached()
+        if self._bus is not None:
+            self._bus.broadcast(["attach", sid, self._bus.worker])
+
+    def _client_detached(self, session):
+        self._unsubscribe(session)
+        sid = session.get(PortalSessions.SessionIdKey)
+        self._connected.pop(sid, None)
+        # Keep collecting the messages for the session for a while
+        self._detached.pop(sid, None)
+        self._detached[sid] = (session, time.time())
+        self._portal.timers.schedule \
+            ((self.channel + ".detached", sid), self._portal._resume_window,
+             self._detached.pop, args=(sid, None))
+        self._purge_detached()
+        if self._bus is not None:
+            self._bus.broadcast(["detach", sid, self._bus.worker])
+
+    def _purge_detached(self):
+        expired = time.time() - self._portal._resume_window
+        while self._detached \
+            and self._detached.itervalues().next()[1] < expired:
+            self._detached.popitem(last=False)
+
+    def _local_session(self, sid):
+        """
+        Returns the session with the given id if its client is 
+        connected to this process or was connected recently.
+        """
+        session = self._connected.get(sid)
+        if session is None:
+            session = self._detached.get(sid, (None,))[0]
+        return session
+
+    def _send_to_client(self, session, msg, handle="portal"):
+        """
+        Sends the message to the client of the given session. If the 
+        client is connected to another worker process, the message is
+        forwarded using the bus. If *session* is ``None``, the 
+        message is sent to all clients. Messages from portlets that the
+        client doesn't display are dropped. Messages for clients that
+        have recently lost their connection are kept for being sent
+        when they reconnect.
+        """
+        if session is None:
+            self._purge_detached()
+            for connected in self._connected.values():
+                self._write_to_client(connected, msg, handle)
+            for detached, _ in self._detached.values():
+                self._write_to_client(detached, msg, handle)
+            if self._bus is not None:
+                self._bus.broadcast(["all", msg, handle])
+            return
+        if self.client_connection(session) is not None \
+            or session.get(PortalSessions.SessionIdKey) in self._detached:
+            self._write_to_client(session, msg, handle)
+            return
+        if self._bus is None:
+            return
+        sid = session.get(PortalSessions.SessionIdKey)
+        owner = self._owners.get(sid)
+        if owner is None or not self._bus.publish \
+            (owner, ["update", sid, msg, handle]):
+            # Owner unknown (e.g. worker restarted), try all
+            self._bus.broadcast(["update", sid, msg, handle])
+
+    def _send_content(self, session, handle, content):
+        """
+        Sends the portlet content to the client of the given session 
+        or to all clients if *session* is ``None``. Like 
+        :meth:`_send_to_client`, but the difference to the previously
+        sent content is computed by the process that holds the client's
+        connection, because it knows what the client has received.
+        """
+        if session is None:
+            self._purge_detached()
+            for connected in self._connected.values():
+                self._write_content(connected, handle, content)
+            for detached, _ in self._detached.values():
+                self._write_content(detached, handle, content)
+            if self._bus is not None:
+                self._bus.broadcast(["content", None, handle, content])
+            return
+        if self.client_connection(session) is not None \
+            or session.get(PortalSessions.SessionIdKey) in self._detached:
+            self._write_content(session, handle, content)
+            return
+        if self._bus is None:
+            return
+        sid = session.get(PortalSessions.SessionIdKey)
+        owner = self._owners.get(sid)
+        if owner is None or not self._bus.publish \
+            (owner, ["content", sid, handle, content]):
+            self._bus.broadcast(["content", sid, handle, content])
+
+    def _write_content(self, session, handle, content):
+        """
+        Sends the content as "portal_content" message with a version,
+        the version of the content that the difference is based on 
+        and the difference (see :func:`.delta.diff`). If the
+        difference isn't smaller than the content, the content is
+        sent with ``None`` as base version.
+        """
+        if not self._is_subscribed(session, handle):
+            if self._metrics.enabled:
+                self._metrics.count("ws_unsubscribed", handle)
+            return
+        contents = session.get(self.__class__.__name__ + ".contents")
+        if contents is None:
+            contents = session.setdefault \
+                (self.__class__.__name__ + ".contents", dict())
+        version, previous = contents.get(handle, (0, None))
+        msg = None
+        if previous is not None:
+            ops = delta.diff(delta.tokenize(previous), 
+                             delta.tokenize(content))
+            if ops is not None:
+                msg = json.dumps([handle, "portal_content", version + 1,
+                                  version, ops], separators=(",", ":"))
+                if len(msg) >= len(content):
+                    msg = None
+        if msg is None:
+            msg = json.dumps([handle, "portal_content", version + 1,
+                              None, content], separators=(",", ":"))
+        contents[handle] = (version + 1, content)
+        if self._metrics.enabled:
+            self._metrics.count("content_bytes", handle, len(content))
+            self._metrics.count("content_bytes_sent", handle, len(msg))
+        self._write_to_client(session, msg, handle)
+
+    def _resend_content(self, session, handle):
+        """
+        Sends the complete current content of the portlet, because
+        the client doesn't have the version that the difference
+        was based on.
+        """
+        contents = session.get(self.__class__.__name__ + ".contents") or {}
+        if handle not in contents:
+            return
+        version, content = contents[handle]
+        self._write_to_client(session, json.dumps \
+            ([handle, "portal_content", version, None, content], 
+             separators=(",", ":")), handle)
+
+    def _write_to_client(self, session, msg, handle="portal"):
+        if not self._is_subscribed(session, handle):
+            if self._metrics.enabled:
+                self._metrics.count("ws_unsubscribed", handle)
+            return
+        msg = self.replay_buffer(session).add(msg)
+        connection = self.client_connection(session)
+        if connection is not None:
+            self.fire(write(connection, msg), self._event_exchange_channel)
+
+    @handler("bus_message")
+    def _on_bus_message(self, message):
+        kind = message[0]
+        if kind == "update":
+            session = self._local_session(message[1])
+            if session is not None:
+                self._write_to_client(session, message[2], message[3])
+        elif kind == "all":
+            self._purge_detached()
+            for session in self._connected.values():
+                self._write_to_client(session, message[1], message[2])
+            for session, _ in self._detached.values():
+                self._write_to_client(session, message[1], message[2])
+        elif kind == "attach":
+            self._owners[message[1]] = message[2]
+        elif kind == "detach":
+            if self._owners.get(message[1]) == message[2]:
+                del self._owners[message[1]]
+        elif kind == "content":
+            if message[1] is None:
+                self._purge_detached()
+                for session in self._connected.values():
+                    self._write_content(session, message[2], message[3])
+                for session, _ in self._detached.values():
+                    self._write_content(session, message[2], message[3])
+            else:
+                session = self._local_session(message[1])
+                if session is not None:
+                    self._write_content(session, message[2], message[3])
+        elif kind == "subscribers":
+            self._remote_subscribers[message[1]] = message[2]
+
     # Attached as handler to portal channel in __init__
     def _on_portal_update(self, portlet, session, name, *args):
         if portlet is None:
             handle = "portal"
         else:
             handle = portlet.description().handle
+        if session is not None and self.client_connection(session) \
+            and not self._is_subscribed(session, handle):
+            # Not displayed, don't even bother to serialize
+            if self._metrics.enabled:
+                self._metrics.count("ws_unsubscribed", handle)
+            return
         data = [ handle, name ]
         for arg in args:
             data.append(arg)
         msg = json.dumps(data)
-        self.fire(write(self.client_connection(session), msg), \
-                  self._event_exchange_channel)
+        if self._metrics.enabled:
+            self._metrics.count("ws_out", handle)
+            self._metrics.count("ws_out_bytes", handle, len(msg))
+        self._send_to_client(session, msg, handle)
                 
     # Attached as handler to portal channel in __init__
     def _on_message_from_client(self, session, data):
         evt_data = json.loads(data)
         handle = evt_data[0]
+        if self._metrics.enabled:
+            self._metrics.count("ws_in", handle)
+            self._metrics.count("ws_in_bytes", handle, len(data))
+        if handle == "portal" and evt_data[1] == "batch":
+            # [ "portal", "batch", [[handle, name, args], ...], env ]
+            if not isinstance(evt_data[2], list):
+                return
+            events = evt_data[2]
+            if len(events) > self.MaxBatchedEvents:
+                self._drop_client_events(events[self.MaxBatchedEvents:])
+                events = events[:self.MaxBatchedEvents]
+            for event in events:
+                if isinstance(event, list) and len(event) == 3:
+                    self._on_event_from_client \
+                        (session, event[0], event[1], event[2], evt_data[3])
+            return
+        self._on_event_from_client \
+            (session, handle, evt_data[1], evt_data[2], evt_data[3])
+
+    def _drop_client_events(self, events):
+        self._event_rate.count_dropped(len(events))
+        if self._metrics.enabled:
+            for event in events:
+                if isinstance(event, list) and event:
+                    self._metrics.count("ws_in_dropped", event[0])
+
+    def _admit_client_event(self, session, handle):
+        """
+        Applies the rate limit of the session's client. Returns 
+        ``False`` (and counts the event as dropped) if the event
+        must be dropped.
+        """
+        if not self._event_rate.enabled or session is None:
+            return True
+        key = self.__class__.__name__ + ".event_bucket"
+        bucket = session.get(key)
+        if bucket is None:
+            bucket = session.setdefault(key, self._event_rate.bucket())
+        if self._event_rate.admit(bucket):
+            return True
+        if self._metrics.enabled:
+            self._metrics.count("ws_in_dropped", handle)
+        return False
+
+    def _on_event_from_client(self, session, handle, name, args, env):
         # be a bit suspicious
         if handle == "portal":
-            handle = self.channel
+            if session is None or not isinstance(args, list):
+                return
+            if name == "subscribe":
+                self._subscribe(session, args)
+            elif name == "content_full" and args:
+                self._resend_content(session, args[0])
+            return
+        # The rate limit applies to events for the portlets only
+        if not self._admit_client_event(session, handle):
             return
-        args = evt_data[2]
+        if session is not None and self._sessions.store is not None:
+            # Pick up changes made by other workers
+            sid = session.get(PortalSessions.SessionIdKey)
+            if sid is not None:
+                session = self._sessions.load(sid)
         if not isinstance(args, list):
             args = [args]
+        trace_id = self._tracer.new_trace()
+        span = self._tracer.start("client_message", trace_id, handle=handle)
         evt = self._create_event_from_request \
-            (session, evt_data[1], args, evt_data[3], handle)
+            (session, name, args, env, handle)
+        if evt is not None:
+            evt.complete = True
+            evt.complete_channels = (self._client_event_channel,)
+            if trace_id is not None:
+                self._trace_client_event(session, evt, trace_id, span)
         self.fire(evt)
+        self._tracer.finish(span)
+
+    def _trace_client_event(self, session, evt, trace_id, parent):
+        """
+        Makes the event from the client carry the trace id and records
+        the time until the event has been handled. While the event
+        is being handled, its trace is the session's active trace
+        (see :meth:`active_trace`).
+        """
+        evt.trace_id = trace_id
+        session[self.__class__.__name__ + ".trace_id"] = trace_id
+        span = self._tracer.start("client_event", trace_id, parent,
+                                  event=evt.name, channel=evt.channels[0])
+        @handler("%s_complete" % evt.name, channel=evt.complete_channels[0])
+        def _on_complete(self, e, value):
+            if e is not evt:
+                return
+            self.removeHandler(complete_handler)
+            self._tracer.finish(span)
+            if self.active_trace(session) == trace_id:
+                session[self.__class__.__name__ + ".trace_id"] = None
+        complete_handler = self.addHandler(_on_complete)
 
 
 class TabManager(object):
+    """
+    Keeps the tabs of a session. Tab managers (and their tabs) exist
+    once per session, so they use slots to keep the per session
+    memory small. The tabs are kept in an ordered dict by their
+    ids, the dashboard tab has id 0.
+    """
+
+    __slots__ = ("_session", "_next_tab_id", "_tabs", "_solo_tabs", "_selected", "_configuring", "_minimized",
+                 "_unresolved")
+
+    # The indexes are derived from the tabs and not stored
+    _Indexes = ("_solo_tabs", "_selected")
 
     class _TabInfo(object):
         
-        def __init__(self, renderer, selected = False, closeable=False,
-                     portlet=None):
+        __slots__ = ("_id", "_content_renderer", "_selected", 
+                     "_closeable", "_portlet")
+
+        def __init__(self, tab_id, renderer, selected = False, 
+                     closeable=False, portlet=None):
+            self._id = tab_id
             self._content_renderer = renderer
             self._selected = selected
             self._closeable = closeable
             self._portlet = portlet
     
+        def __getstate__(self):
+            # Portlets are stored by their handles
+            state = dict([(name, getattr(self, name)) 
+                          for name in self.__slots__])
+            if self._portlet is not None \
+                and not isinstance(self._portlet, basestring):
+                state["_portlet"] = self._portlet.description().handle
+            return state
+
+        def __setstate__(self, state):
+            for name, value in state.items():
+                setattr(self, name, value)
+
+        @property
+        def id(self):
+            return self._id
+
         @property
         def label(self):
             return self._label
@@ -439,59 +1274,170 @@ class TabManager(object):
         if mgr is None:
             mgr = TabManager(session)
             session[cls.__class__.__name__ + ".tabs"] = mgr
+        mgr._session = session
         return mgr
 
     def __init__(self, session, *args, **kwargs):
         self._session = session
-        self._tabs = [self._TabInfo("_dashboard", selected=True)]
+        self._next_tab_id = 1
+        self._tabs = OrderedDict()
+        self._tabs[0] = self._TabInfo(0, "_dashboard", selected=True)
         self._configuring = None
+        self._minimized = set()
+        self._unresolved = False
+        self._index_tabs()
+
+    def __getstate__(self):
+        # The session is not stored with the tab manager and
+        # portlets are stored by their handles (see resolve)
+        state = dict([(name, getattr(self, name)) 
+                      for name in self.__slots__
+                      if name not in self._Indexes])
+        state["_session"] = None
+        if self._configuring is not None \
+            and not isinstance(self._configuring, basestring):
+            state["_configuring"] = self._configuring.description().handle
+        state["_unresolved"] = True
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            if name not in self._Indexes:
+                setattr(self, name, value)
+        if isinstance(self._tabs, list):
+            # Stored by a version that kept the tabs in a list
+            self._tabs = OrderedDict([(tab.id, tab) for tab in self._tabs])
+        self._index_tabs()
+
+    @staticmethod
+    def _handle(portlet):
+        if isinstance(portlet, basestring):
+            return portlet
+        return portlet.description().handle
+
+    def _index_tabs(self):
+        """
+        (Re-)builds the index of the solo tabs by portlet handle
+        and looks up the selected tab.
+        """
+        self._solo_tabs = dict()
+        self._selected = None
+        for tab in self._tabs.itervalues():
+            if tab._portlet is not None:
+                self._solo_tabs[self._handle(tab._portlet)] = tab
+            if tab._selected:
+                if self._selected is None:
+                    self._selected = tab
+                else:
+                    tab._selected = False
+        if self._selected is None:
+            self._selected = self._tabs[0]
+            self._selected._selected = True
+
+    def resolve(self, portal):
+        """
+        Replaces the portlet handles of a restored tab manager with
+        the portlets. Tabs of portlets that no longer exist are removed.
+        """
+        if not self._unresolved:
+            return self
+        self._unresolved = False
+        for tab in self._tabs.values():
+            if isinstance(tab._portlet, basestring):
+                tab._portlet = portal.portlet_by_handle(tab._portlet)
+                if tab._portlet is None:
+                    del self._tabs[tab.id]
+        self._index_tabs()
+        if isinstance(self._configuring, basestring):
+            self._configuring = portal.portlet_by_handle(self._configuring)
+        return self
 
     @property
     def tabs(self):
-        return self._tabs
+        return self._tabs.values()
+
+    @property
+    def selected_tab(self):
+        return self._selected
 
     def select_tab(self, tab_id):
-        found = False
-        for tab in self._tabs:
-            tab._selected = (id(tab) == tab_id)
-            found = found or tab._selected
-        if not found:
-            self._tabs[0]._selected = True
+        tab = self._tabs.get(tab_id, self._tabs[0])
+        self._selected._selected = False
+        tab._selected = True
+        self._selected = tab
 
     def find_tab(self, tab_id):
-        found = filter(lambda x: id(x) == tab_id, self._tabs)
-        if len(found) > 0:
-            return found[0]
-        return None
+        return self._tabs.get(tab_id)
+
+    def find_solo(self, portlet):
+        """
+        Returns the solo tab of the given portlet or ``None``.
+        """
+        return self._solo_tabs.get(self._handle(portlet))
 
     def close_tab(self, tab_id):
-        closed = self.find_tab(tab_id)
-        if closed is None:
+        closed = self._tabs.get(tab_id)
+        if closed is None or tab_id == 0:
             return
-        closed_idx = self._tabs.index(closed)
-        del self._tabs[closed_idx]
+        following = None
         if closed._selected:
-            if len(self._tabs) > closed_idx:
-                self._tabs[closed_idx]._selected = True
-            else:
-                self._tabs[0]._selected = True
+            # The following tab becomes the selected tab, this is 
+            # the only case that requires looking at the other tabs
+            tab_ids = self._tabs.iterkeys()
+            for other_id in tab_ids:
+                if other_id == tab_id:
+                    following = next(tab_ids, 0)
+                    break
+        del self._tabs[tab_id]
+        self._solo_tabs.pop(self._handle(closed._portlet), None)
+        if closed._selected:
+            closed._selected = False
+            self.select_tab(following)
 
-    def add_solo(self, portlet):
-        solo_tabs = filter(lambda x: x.portlet == portlet, self._tabs)
-        if len(solo_tabs) > 0:
-            self.select_tab(id(solo_tabs[0]))
+    def add_solo(self, portlet, max_solo_tabs=None):
+        """
+        Selects the solo tab of the given portlet, adding it if
+        it doesn't exist yet. If adding the tab would exceed 
+        *max_solo_tabs*, the oldest solo tab is closed.
+        """
+        solo_tab = self.find_solo(portlet)
+        if solo_tab is not None:
+            self.select_tab(solo_tab.id)
             return
-        tab = self._TabInfo("_solo", closeable=True, portlet=portlet)
-        self._tabs.append(tab)
-        self.select_tab(id(tab))
+        if max_solo_tabs is not None:
+            while len(self._tabs) > 1 \
+                and len(self._tabs) - 1 >= max_solo_tabs:
+                self.close_tab(next(islice(self._tabs.iterkeys(), 1, None)))
+        tab = self._TabInfo(self._next_tab_id, "_solo", 
+                            closeable=True, portlet=portlet)
+        self._next_tab_id += 1
+        self._tabs[tab.id] = tab
+        self._solo_tabs[self._handle(portlet)] = tab
+        self.select_tab(tab.id)
 
     def configure(self, portlet):
         self._configuring = portlet
 
+    def minimize(self, portlet):
+        """
+        Minimize the given portlet on the dashboard. A minimized portlet
+        is displayed with its title only, its content isn't rendered.
+        """
+        self._minimized.add(portlet.description().handle)
+
+    def restore(self, portlet):
+        self._minimized.discard(portlet.description().handle)
+
+    def is_minimized(self, portlet):
+        return portlet.description().handle in self._minimized
+
     @property
     def configuring(self):
         return self._configuring
 
+# Python 2 pickles nested classes by their simple name
+_TabInfo = TabManager._TabInfo
+
     
 class UGFactory(Portlet.UrlGeneratorFactory):
     
@@ -565,22 +1511,142 @@ class RenderThread(Thread):
             response.headers["Content-Language"] \
                 = self._translation.language.replace("_", "-")
         self._portal = PortalSessionFacade(self._view, self._request.session)
+        self._tab_manager = view.tab_manager(request.session)
         self._portlet_counter = 0
+        self._rendered = set()
+        self._metrics = view.metrics
+        self._portlets_time = 0.0
+        self._tracer = view.tracer
+        self._render_span = getattr(req_evt, "render_span", None)
+        self._async_renders = dict()
+        self._shell_segments = []
+
+    def _start_async_renders(self):
+        """
+        Starts the asynchronous renders of the portlets that
+        (presumably) will be rendered with default parameters,
+        so that they run concurrently.
+        """
+        tab = self._tab_manager.selected_tab
+        if tab is self._tab_manager.tabs[0]:
+            window_state = Portlet.WindowState.Normal
+            portlets = [portlet for portlet in self._view._portal.portlets
+                        if not self._tab_manager.is_minimized(portlet)
+                        and portlet != self._tab_manager.configuring]
+        else:
+            window_state = Portlet.WindowState.Solo
+            portlets = [tab.portlet]
+        for portlet in portlets:
+            if portlet is None or portlet.async_render is None:
+                continue
+            handle = portlet.description().handle
+            if self._view._render_guard.breaker(handle).state \
+                == CircuitBreaker.Open:
+                continue
+            self._portlet_counter += 1
+            key = (portlet, "text/html", Portlet.RenderMode.View,
+                   window_state, tuple(self._locales))
+            self._async_renders[key] = self._start_async_render \
+                (portlet, "text/html", Portlet.RenderMode.View,
+                 window_state, self._locales, self._portlet_counter)
+
+    def _start_async_render(self, portlet, mime_type, mode, window_state,
+                            locales, invocation_id, **kwargs):
+        evt = portlet_async_render \
+            (self._portal, mime_type, mode, window_state, locales,
+             self._view._ugFactory, invocation_id, **kwargs)
+        evt.done = ThreadEvent()
+        self._view._async_render_started()
+        self._view.fire(evt, portlet.channel)
+        return evt
+
+    def _await_async_render(self, evt):
+        evt.done.wait()
+        if evt.value.errors:
+            raise RuntimeError(str(evt.value.value[1]))
+        return evt.value.value
 
     def run(self):
-        
+        profile = getattr(self._req_evt, "portal_profile", None)
+        if profile is None:
+            self._render()
+        else:
+            profile.runcall(self._render)
+
+    def _render(self):
+        profile = getattr(self._req_evt, "portal_profile", None)
+        # Messages sent after this point are replayed when the
+        # client connects
+        replay = self._view.replay_buffer(self._request.session)
+        replay_position = (replay.epoch, replay.seq)
+        # The page has the current contents of the portlets
+        self._request.session.pop \
+            (self._view.__class__.__name__ + ".contents", None)
+        self._start_async_renders()
+
         def render(portlet, mime_type="text/html", 
                    mode=Portlet.RenderMode.View, 
                    window_state=Portlet.WindowState.Normal, 
                    locales=[], **kwargs):
             """
             The render portlet function made available to the template 
-            engine. It calls the portlet's render method.
+            engine. It calls the portlet's render method unless the
+            portlet is minimized.
             """
-            self._portlet_counter += 1
-            return portlet.render(self._portal, mime_type, mode, window_state, \
-                 locales, self._view._ugFactory, self._portlet_counter,
-                 **kwargs);
+            if window_state == Portlet.WindowState.Normal \
+                and self._tab_manager.is_minimized(portlet):
+                return ""
+            self._rendered.add(portlet)
+            self._view._count_render(portlet, True)
+            handle = portlet.description().handle
+            if portlet.async_render is not None:
+                evt = None
+                if not kwargs:
+                    evt = self._async_renders.pop \
+                        ((portlet, mime_type, mode, window_state,
+                          tuple(locales)), None)
+                if evt is None:
+                    self._portlet_counter += 1
+                    evt = self._start_async_render \
+                        (portlet, mime_type, mode, window_state, locales,
+                         self._portlet_counter, **kwargs)
+                render_func = lambda: self._await_async_render(evt)
+            else:
+                self._portlet_counter += 1
+                invocation_id = self._portlet_counter
+                render_func = lambda: \
+                    portlet.render(self._portal, mime_type, mode, 
+                                   window_state, locales, 
+                                   self._view._ugFactory, invocation_id,
+                                   **kwargs)
+            if profile is not None:
+                profiled_started = time.time()
+                if self._view._render_guard.timeout is not None:
+                    # Rendered in a thread of its own, profile there
+                    unprofiled = render_func
+                    render_func = lambda: profile.runcall(unprofiled)
+            started = self._metrics.timer()
+            span = self._tracer.start("portlet_render", 
+                getattr(self._req_evt, "trace_id", None), 
+                self._render_span, handle=handle)
+            try:
+                return self._view._render_guard.render(handle, render_func)
+            except RenderFailed as error:
+                self._view.fire(log(logging.ERROR, "Rendering portlet "
+                                    + handle + " failed: " + str(error)))
+                return "<div class=\"portlet-msg-error\">" \
+                    + tenjin.helpers.escape \
+                        (self._translation.ugettext("PortletUnavailable")) \
+                    + "</div>"
+            finally:
+                if started is not None:
+                    duration = time.time() - started
+                    self._portlets_time += duration
+                    self._metrics.observe("portlet_render", handle, duration)
+                if profile is not None:
+                    profile.portlet_time \
+                        (handle, time.time() - profiled_started)
+                self._tracer.finish(span)
         # Render the template.
         def portal_action_url(action, **kwargs):
             return (self._view.prefix
@@ -590,15 +1656,99 @@ class RenderThread(Thread):
             return (self._view.prefix
                     + "/" + portlet_handle + "/" + mode + "/" + window)
                     
-        self._req_evt.portal_response = serve_tenjin \
+        started = self._metrics.timer()
+        span = self._tracer.start("template", 
+            getattr(self._req_evt, "trace_id", None), self._render_span)
+        def shell(name):
+            # The segment depends on the template (which is reloaded
+            # if changed), the locales and the theme only
+            template = self._view._engine.get_template(name)
+            key = (name, template.filename, template.timestamp,
+                   tuple(self._locales), self._translation.language,
+                   ThemeSelection.selected(self._request.session))
+            def render_segment():
+                globs = tenjin.helpers.__dict__.copy()
+                globs.update(globexts)
+                return self._view._engine.render(name, {}, globals=globs)
+            segment = self._view._shells.get(key, render_segment)
+            self._shell_segments.append((key, segment))
+            return segment
+        globexts = { "portal": self._portal,
+                     "preferred_locales": self._locales,
+                     "_": self._translation.ugettext,
+                     "portal_action_url": portal_action_url,
+                     "portlet_state_url": portlet_state_url,
+                     "resource_url": 
+                     (lambda x: self._view.prefix + "/" + x),
+                     "l10n_url": 
+                     (lambda: self._view._bundle_resource 
+                      + self._view._l10n_scripts.name
+                      (self._translation.language or "en")),
+                     "bundle_urls":
+                     (lambda: [self._view._bundle_resource + name
+                               for name in self._view._bundles.names
+                               (self._portal.portlets)]),
+                     "render": render,
+                     "replay_position": replay_position,
+                     "rendered_portlets": 
+                     (lambda: [portlet.description().handle 
+                               for portlet in self._rendered]),
+                     "shell": shell }
+        portal_response = serve_tenjin \
             (self._view._engine, self._request, self._response,
-             "portal.pyhtml", {}, type="text/html", 
-             globexts = { "portal": self._portal,
-                          "preferred_locales": self._locales,
-                          "_": self._translation.ugettext,
-                          "portal_action_url": portal_action_url,
-                          "portlet_state_url": portlet_state_url,
-                          "resource_url": 
-                          (lambda x: self._view.prefix + "/" + x),
-                          "render": render})
+             "portal.pyhtml", {}, type="text/html", globexts = globexts)
+        if portal_response is self._response:
+            self._compress()
+        self._tracer.finish(span)
+        if started is not None:
+            # Time spent in the template itself, without the portlets
+            self._metrics.observe("template", None, 
+                time.time() - started - self._portlets_time)
+        # Everything not rendered has been skipped
+        for portlet in self._view._portal.portlets:
+            if portlet not in self._rendered:
+                self._view._count_render(portlet, False)
+        self._req_evt.portal_response = portal_response
+        # Wakes up the main loop
+        self._view.fire(portal_rendered())
+
+    def _compress(self):
+        """
+        Compresses the rendered page if the client accepts it. The 
+        cached segments of the page are compressed only once.
+        """
+        compression = self._view._compression
+        if not compression.enabled:
+            return
+        self._response.headers["Vary"] = "Accept-Encoding"
+        encoding = compression.encoding(self._request)
+        if encoding is None:
+            return
+        charset = self._response.encoding
+        def encoded(data):
+            return data.encode(charset) if isinstance(data, unicode) else data
+        body = self._response.body
+        if not isinstance(body, list):
+            body = [body]
+        body = "".join([encoded(data) for data in body])
+        parts = []
+        pos = 0
+        for key, segment in self._shell_segments:
+            segment = encoded(segment)
+            start = body.find(segment, pos) if segment else -1
+            if start < 0:
+                continue
+            if start > pos:
+                parts.append((body[pos:start], None))
+            deflated = self._view._shells.compressed \
+                (key, lambda data: compression.deflate(encoded(data)))
+            parts.append((segment, deflated))
+            pos = start + len(segment)
+        if pos < len(body):
+            parts.append((body[pos:], None))
+        compressed = compression.compress(encoding, parts)
+        if compressed is None:
+            return
+        self._response.headers["Content-Encoding"] = encoding
+        self._response.body = compressed
 
@@ -0,0 +1,169 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Thread, Lock
+from collections import OrderedDict
+import cProfile
+import marshal
+import pstats
+import sys
+import time
+import uuid
+
+
+class RequestProfile(object):
+    """
+    Collects the profiling data for a single portal render. As
+    :mod:`cProfile` only profiles the thread that it has been enabled
+    in, every thread involved in the render contributes a profile
+    of its own. The profiles are merged when the result is stored.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._started = time.time()
+        self._profiles = []
+        self._portlets = dict()
+        self._lock = Lock()
+
+    def runcall(self, func, *args, **kwargs):
+        """
+        Invoke *func* with a profiler enabled for the current thread.
+        """
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._profiles.append(profile)
+
+    def portlet_time(self, handle, duration):
+        with self._lock:
+            self._portlets[handle] = self._portlets.get(handle, 0) + duration
+
+    def result(self):
+        """
+        Returns the merged profiling data (in the format written by
+        :meth:`pstats.Stats.dump_stats`) and a dict with 
+        additional information about the render.
+        """
+        with self._lock:
+            stats = None
+            for profile in self._profiles:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            info = { "kind": "request",
+                     "path": self._path,
+                     "started": self._started,
+                     "duration": time.time() - self._started,
+                     "portlets": dict(self._portlets) }
+        data = marshal.dumps(stats.stats) if stats else marshal.dumps({})
+        return data, info
+
+
+class LoopSampler(Thread):
+    """
+    Samples the stack of the thread with the given *ident* (usually
+    the thread that runs the circuits main loop) every *interval*
+    seconds for *duration* seconds. The result is a text with one
+    line per distinct stack in the "collapsed stack" format used
+    by flame graph tools (frames separated by semicolons, followed
+    by the number of samples).
+    """
+
+    def __init__(self, store, ident, duration, interval=0.005):
+        super(LoopSampler, self).__init__(name="loop-sampler")
+        self.daemon = True
+        self._store = store
+        self._ident = ident
+        self._duration = duration
+        self._interval = interval
+        self._id = store.reserve()
+
+    @property
+    def id(self):
+        return self._id
+
+    def run(self):
+        started = time.time()
+        stacks = dict()
+        samples = 0
+        while time.time() - started < self._duration:
+            frame = sys._current_frames().get(self._ident)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, code.co_filename,
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+            time.sleep(self._interval)
+        data = "".join(["%s %d\n" % (key, count) 
+                        for key, count in sorted(stacks.items())])
+        self._store.put(self._id, data, 
+                        { "kind": "loop", "started": started,
+                          "duration": time.time() - started,
+                          "samples": samples })
+
+
+class ProfileStore(object):
+    """
+    Keeps the most recent *max_entries* profiling results for
+    download.
+    """
+
+    def __init__(self, max_entries=20):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def reserve(self):
+        """
+        Returns a new id for a result that will be available later.
+        """
+        return uuid.uuid4().hex
+
+    def put(self, profile_id, data, info):
+        with self._lock:
+            self._entries[profile_id] = (data, info)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, profile_id):
+        """
+        Returns the data and info stored for the given id or ``None``.
+        """
+        with self._lock:
+            return self._entries.get(profile_id)
+
+    def list(self):
+        """
+        Returns a dict that maps the ids of the available results
+        to their infos.
+        """
+        with self._lock:
+            return dict([(profile_id, info) for profile_id, (_, info)
+                         in self._entries.items()])
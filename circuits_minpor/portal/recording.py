@@ -0,0 +1,278 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Lock, Thread
+from Queue import Queue, Full, Empty
+import gzip
+import json
+import time
+import os
+import urllib
+import urlparse
+
+# Query parameters that are never recorded
+SECRET_PARAMS = ("profile_token",)
+
+
+class TrafficRecorder(object):
+    """
+    Records the HTTP requests directed at the portal and the messages
+    received from the clients through the event exchange. The records
+    are written as gzip compressed JSON arrays (one per line) to the
+    given file. The first line holds a dict with the file format
+    version and the start time of the recording. Every subsequent
+    record starts with the time in milliseconds since the start of
+    the recording and a small number that identifies the session.
+    The remaining fields depend on the kind of the record:
+
+    ``[time, session, "http", method, path, query, language,
+    content type, body]``
+       An HTTP request. The content type and body are ``null``
+       for requests without a body. The body is ``null`` as well
+       unless the recording of bodies has been enabled.
+
+    ``[time, session, "open", path]``
+       The client has connected to the event exchange with the given
+       path.
+
+    ``[time, session, "ws", message]``
+       A message from the client received through the event exchange.
+       Unless the recording of bodies has been enabled, the arguments
+       of the events sent to portlets are removed from the message.
+
+    ``[time, session, "close"]``
+       The client has disconnected from the event exchange.
+
+    As bodies and event arguments may contain passwords or personal
+    data, they are recorded only if *bodies* is ``True``. Parameters
+    with the names in :data:`SECRET_PARAMS` or *secrets* are removed 
+    from queries and from form data in any case.
+
+    The file is written by a thread of its own, so that recording
+    never waits for the compression or the disk. Records that don't
+    fit in the writer's queue are dropped (see :attr:`dropped`), as
+    are records in processes other than the one that started the 
+    recording.
+
+    :param filename: the name of the file to write the records to.
+    :param flush_interval: the maximum time in seconds that records
+        are kept in the buffer before being written to the file.
+    :param bodies: if ``True``, the bodies of requests and the
+        arguments of events from clients are recorded.
+    :param secrets: the names of additional parameters that are 
+        never recorded.
+    """
+
+    Version = 1
+
+    # The maximum number of records waiting to be written to the file
+    MaxQueued = 10000
+
+    def __init__(self, filename=None, flush_interval=1, bodies=False,
+                 secrets=()):
+        self._filename = filename
+        self._flush_interval = flush_interval
+        self._bodies = bodies
+        self._secrets = set(SECRET_PARAMS) | set(secrets or ())
+        self._queue = None
+        self._writer = None
+        self._writer_pid = None
+        self._started = None
+        self._sessions = 0
+        self._records = 0
+        self._dropped = 0
+        self._lock = Lock()
+        if filename:
+            self.start()
+
+    @property
+    def recording(self):
+        return self._writer is not None
+
+    @property
+    def records(self):
+        """
+        The number of records written since the recording was started.
+        """
+        return self._records
+
+    @property
+    def dropped(self):
+        """
+        The number of records that could not be written to the file.
+        """
+        return self._dropped
+
+    def start(self, filename=None):
+        """
+        Starts a new recording, closing a recording that is in progress.
+        """
+        self.stop()
+        with self._lock:
+            self._filename = filename or self._filename
+            out = gzip.open(self._filename, "wb")
+            self._started = time.time()
+            self._sessions = 0
+            self._records = 0
+            self._dropped = 0
+            self._queue = Queue(self.MaxQueued)
+            self._queue.put({ "version": self.Version,
+                              "started": self._started })
+            self._writer = Thread(target=self._write_queued,
+                                  args=(self._queue, out), 
+                                  name="traffic-recorder")
+            self._writer.daemon = True
+            self._writer.start()
+            self._writer_pid = os.getpid()
+
+    def stop(self):
+        """
+        Stops the recording, writes the records that are still
+        queued and closes the file.
+        """
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is None or self._writer_pid != os.getpid():
+                return
+            self._queue.put(None)
+        writer.join()
+
+    def _session_number(self, session):
+        if session is None:
+            return None
+        number = session.get(self.__class__.__name__ + ".session")
+        if number is None:
+            self._sessions += 1
+            number = self._sessions
+            session[self.__class__.__name__ + ".session"] = number
+        return number
+
+    def _write_queued(self, queue, out):
+        last_flush = time.time()
+        with out:
+            while True:
+                try:
+                    record = queue.get(timeout=self._flush_interval)
+                except Empty:
+                    out.flush()
+                    last_flush = time.time()
+                    continue
+                if record is None:
+                    break
+                out.write(json.dumps(record, separators=(",", ":")) + "\n")
+                now = time.time()
+                if now - last_flush >= self._flush_interval:
+                    out.flush()
+                    last_flush = now
+
+    def _record(self, session, kind, *fields):
+        with self._lock:
+            if self._writer is None:
+                return
+            if self._writer_pid != os.getpid():
+                self._dropped += 1
+                return
+            try:
+                self._queue.put_nowait \
+                    ([int((time.time() - self._started) * 1000),
+                      self._session_number(session), kind] + list(fields))
+                self._records += 1
+            except Full:
+                self._dropped += 1
+
+    def http(self, request):
+        """
+        Records the given HTTP request. Must be invoked before the
+        request's body has been read.
+        """
+        if self._writer is None:
+            return
+        body = request.body.getvalue() if request.body else ""
+        content_type = request.headers.get("Content-Type") if body else None
+        if not self._bodies:
+            body = None
+        elif content_type and content_type.split(";")[0].strip() \
+            == "application/x-www-form-urlencoded":
+            body = self._redact(body)
+        self._record(request.session, "http", request.method,
+                     request.path, self._redact(request.qs or ""),
+                     request.headers.get("Accept-Language"),
+                     content_type, body.decode("latin-1") if body else None)
+
+    def _redact(self, query):
+        if not query:
+            return query
+        return urllib.urlencode \
+            ([(name, value) for name, value 
+              in urlparse.parse_qsl(query, keep_blank_values=True)
+              if name not in self._secrets])
+
+    def _strip_arguments(self, data):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(message, list) or len(message) < 3:
+            return data
+        if message[0] == "portal":
+            if message[1] != "batch":
+                # The portal's own messages carry no user data
+                return data
+            message[2] = [event[:2] + [[]] for event in message[2]
+                          if isinstance(event, list)]
+        else:
+            message[2] = []
+        return json.dumps(message, separators=(",", ":"))
+
+    def ws_open(self, session, path):
+        self._record(session, "open", path)
+
+    def ws_message(self, session, data):
+        if self._writer is None:
+            return
+        if isinstance(data, str):
+            data = data.decode("utf-8", "replace")
+        if not self._bodies:
+            data = self._strip_arguments(data)
+            if data is None:
+                return
+        self._record(session, "ws", data)
+
+    def ws_close(self, session):
+        self._record(session, "close")
+
+
+def read_recording(filename):
+    """
+    Reads a recording made by :class:`TrafficRecorder`. Returns the
+    header (a dict) and the list of records.
+    """
+    with gzip.open(filename, "rb") as recording:
+        lines = iter(recording)
+        header = json.loads(next(lines))
+        if header.get("version") != TrafficRecorder.Version:
+            raise ValueError("Unsupported recording version: %s"
+                             % header.get("version"))
+        records = []
+        for line in lines:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return header, records
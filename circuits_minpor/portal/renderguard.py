@@ -0,0 +1,274 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Thread, Lock, Event
+from Queue import Queue
+import sys
+import time
+import traceback
+
+
+class RenderFailed(Exception):
+    """
+    Raised by :meth:`RenderGuard.render` if the portlet could not
+    provide its content. The message describes the reason.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for a single portlet. The breaker is "closed"
+    as long as the portlet renders successfully. After *threshold*
+    consecutive failures (or timeouts), the breaker "opens" and
+    no attempt to render the portlet is made for *cooldown* seconds.
+    After the cooldown period, the breaker is "half-open", i.e. a
+    single attempt to render the portlet is made. If it succeeds,
+    the breaker closes, else it opens again.
+
+    Renders that have timed out but are still running occupy a
+    render worker. They count as failures and, in addition, keep
+    the breaker from becoming half-open until they have finished.
+    No new attempt is made while *threshold* of them are running.
+    """
+
+    Closed = "closed"
+    Open = "open"
+    HalfOpen = "half-open"
+
+    def __init__(self, threshold=5, cooldown=30):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._state = self.Closed
+        self._failures = 0
+        self._total_failures = 0
+        self._timeouts = 0
+        self._hung = 0
+        self._opened_at = None
+        self._last_error = None
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._update()
+            return self._state
+
+    def _update(self):
+        if self._state == self.Open and self._hung == 0 \
+            and time.time() - self._opened_at >= self._cooldown:
+            self._state = self.HalfOpen
+
+    def allow(self):
+        """
+        Returns ``True`` if an attempt to render the portlet may be made.
+        """
+        with self._lock:
+            self._update()
+            if self._state == self.Open or self._hung >= self._threshold:
+                return False
+            if self._state == self.HalfOpen:
+                # Only one trial, block others until result is known
+                self._state = self.Open
+                self._opened_at = time.time()
+            return True
+
+    def success(self):
+        with self._lock:
+            self._state = self.Closed
+            self._failures = 0
+
+    def failure(self, reason, timeout=False):
+        with self._lock:
+            self._failures += 1
+            self._total_failures += 1
+            if timeout:
+                self._timeouts += 1
+            self._last_error = reason
+            if self._failures >= self._threshold:
+                self._state = self.Open
+                self._opened_at = time.time()
+
+    def hung(self):
+        """
+        Invoked when a render has timed out but is still running.
+        """
+        with self._lock:
+            self._hung += 1
+
+    def hung_finished(self):
+        """
+        Invoked when a render that has timed out has finished.
+        """
+        with self._lock:
+            self._hung -= 1
+
+    def info(self):
+        """
+        Returns a dict with the breaker's current state and counters.
+        """
+        with self._lock:
+            self._update()
+            return { "state": self._state,
+                     "consecutive_failures": self._failures,
+                     "failures": self._total_failures,
+                     "timeouts": self._timeouts,
+                     "hung": self._hung,
+                     "opened_at": self._opened_at,
+                     "last_error": self._last_error }
+
+
+class _RenderJob(object):
+
+    def __init__(self, breaker, render_func):
+        self.breaker = breaker
+        self.render_func = render_func
+        self.outcome = None
+        self.started = False
+        self.abandoned = False
+        self.done = Event()
+
+
+class RenderGuard(object):
+    """
+    Isolates the rendering of the portal page from failing or hanging
+    portlets. Each portlet's render invocation is guarded by the
+    portlet's :class:`CircuitBreaker` and (optionally) by a deadline.
+
+    :param timeout: the maximum time in seconds that a portlet may
+        take to render its content or ``None`` for no limit. If a limit
+        is set, the portlet is rendered by a worker thread.
+    :param threshold: the number of consecutive failures that opens
+        a portlet's circuit breaker.
+    :param cooldown: the time in seconds that a portlet's breaker
+        stays open.
+    :param max_workers: the maximum number of worker threads. Renders
+        wait (within their time limit) for a worker to become idle.
+    """
+
+    def __init__(self, timeout=None, threshold=5, cooldown=30, 
+                 max_workers=16):
+        self._timeout = timeout
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._max_workers = max_workers
+        self._breakers = dict()
+        self._jobs = Queue()
+        self._workers = 0
+        self._idle = 0
+        self._lock = Lock()
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def breaker(self, handle):
+        with self._lock:
+            breaker = self._breakers.get(handle)
+            if breaker is None:
+                breaker = CircuitBreaker(self._threshold, self._cooldown)
+                self._breakers[handle] = breaker
+            return breaker
+
+    def states(self):
+        """
+        Returns a dict that maps portlet handles to the information
+        provided by their breakers (see :meth:`CircuitBreaker.info`).
+        """
+        with self._lock:
+            breakers = dict(self._breakers)
+        return dict([(handle, breaker.info())
+                     for handle, breaker in breakers.items()])
+
+    def render(self, handle, render_func):
+        """
+        Invokes *render_func* and returns its result. Raises
+        :class:`RenderFailed` if the breaker for the portlet with the
+        given *handle* is open or if *render_func* raises an exception
+        or doesn't complete in time.
+        """
+        breaker = self.breaker(handle)
+        if not breaker.allow():
+            raise RenderFailed("Circuit breaker open")
+        if self._timeout is None:
+            try:
+                result = render_func()
+            except Exception:
+                reason = self._format_error(sys.exc_info())
+                breaker.failure(reason)
+                raise RenderFailed(reason)
+            breaker.success()
+            return result
+        # Render with deadline
+        job = _RenderJob(breaker, render_func)
+        self._submit(job)
+        if not job.done.wait(self._timeout):
+            with self._lock:
+                if not job.done.is_set():
+                    job.abandoned = True
+                    if job.started:
+                        breaker.hung()
+            if job.abandoned:
+                if not job.started:
+                    # Not the portlet's fault, don't count as failure
+                    raise RenderFailed("No render worker available within"
+                                       " %ss" % self._timeout)
+                reason = "Timeout after %ss" % self._timeout
+                breaker.failure(reason, timeout=True)
+                raise RenderFailed(reason)
+        ok, result = job.outcome
+        if not ok:
+            breaker.failure(result)
+            raise RenderFailed(result)
+        breaker.success()
+        return result
+
+    def _submit(self, job):
+        with self._lock:
+            if self._idle == 0 and self._workers < self._max_workers:
+                self._workers += 1
+                self._idle += 1
+                worker = Thread(target=self._work, 
+                                name="render-%d" % self._workers)
+                worker.daemon = True
+                worker.start()
+        self._jobs.put(job)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            with self._lock:
+                if job.abandoned:
+                    continue
+                job.started = True
+                self._idle -= 1
+            try:
+                outcome = (True, job.render_func())
+            except Exception:
+                outcome = (False, self._format_error(sys.exc_info()))
+            with self._lock:
+                self._idle += 1
+                job.outcome = outcome
+                job.done.set()
+            if job.abandoned:
+                job.breaker.hung_finished()
+
+    def _format_error(self, exc_info):
+        etype, evalue, etraceback = exc_info
+        return "".join(traceback.format_exception_only(etype, evalue)).strip()
@@ -0,0 +1,91 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Lock
+import multiprocessing
+import sys
+import os
+
+
+def _render_pooled(module_name, class_name, render_input):
+    """
+    Invoked in a process of the pool. The portlet class is looked up
+    by name, because classes (and their methods) cannot be pickled.
+    """
+    clazz = getattr(sys.modules[module_name], class_name)
+    return clazz.pool_render(render_input)
+
+
+class RenderPool(object):
+    """
+    A pool of processes that render portlets which support rendering
+    in another process (see
+    :meth:`circuits_minpor.Portlet.pool_render_input`). Rendering
+    CPU intensive portlets in other processes prevents them from
+    slowing down all other renders (because of the global interpreter
+    lock).
+
+    The processes are created by :meth:`start`, which must be 
+    invoked before any threads that render portlets exist (forking
+    a process while other threads hold locks may deadlock the 
+    children). The portal's view starts the pool when the portal
+    is started, i.e. again in every worker process that runs the
+    portal. Until the pool has been started in the current process, 
+    portlets are rendered in the calling thread.
+
+    :param processes: the number of processes, defaults to the
+        number of CPUs.
+    """
+
+    def __init__(self, processes=None):
+        self._processes = processes
+        self._pool = None
+        self._pid = None
+        self._lock = Lock()
+
+    def start(self):
+        """
+        Creates the processes of the pool unless they have already
+        been created by the current process.
+        """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                # A pool inherited from the parent cannot be used
+                self._pool = multiprocessing.Pool(self._processes)
+                self._pid = os.getpid()
+
+    def render(self, clazz, render_input):
+        """
+        Renders a portlet of the given class with the given input
+        in a process of the pool and returns the result.
+        """
+        with self._lock:
+            pool = self._pool if self._pid == os.getpid() else None
+        if pool is None:
+            return clazz.pool_render(render_input)
+        return pool.apply(_render_pooled, (clazz.__module__, 
+                                           clazz.__name__, render_input))
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+                self._pool.join()
+            self._pool = None
@@ -0,0 +1,89 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from collections import deque
+import binascii
+import os
+
+
+class ReplayBuffer(object):
+    """
+    Numbers the messages sent to the client of a session and keeps
+    the most recent ones, so that a client that reconnects after losing
+    its event exchange connection can be sent the messages that it
+    has missed.
+
+    Sequence numbers are only meaningful together with the buffer's
+    epoch, which is chosen randomly when the buffer is created. A client
+    that presents the epoch of another buffer (e.g. of another worker
+    process) cannot be resumed.
+
+    A buffer exists once per session, so it uses slots and creates
+    the message queue only when the first message is added.
+
+    :param size: the maximum number of messages kept.
+    """
+
+    __slots__ = ("_epoch", "_seq", "_size", "_messages")
+
+    def __init__(self, size):
+        self._epoch = binascii.hexlify(os.urandom(4))
+        self._seq = 0
+        self._size = size
+        self._messages = None
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    @property
+    def seq(self):
+        """
+        The sequence number of the last message added.
+        """
+        return self._seq
+
+    def add(self, msg):
+        """
+        Adds the message (a JSON array) and returns it with the 
+        sequence number inserted as first element.
+        """
+        self._seq += 1
+        msg = "[%d,%s" % (self._seq, msg[1:])
+        if self._size:
+            if self._messages is None:
+                self._messages = deque(maxlen=self._size)
+            self._messages.append(msg)
+        return msg
+
+    def since(self, epoch, seq):
+        """
+        Returns the messages added after the message with the given
+        sequence number. Returns ``None`` if the epoch doesn't match
+        or if some of the messages have already been dropped.
+        """
+        if epoch != self._epoch or seq > self._seq:
+            return None
+        missed = self._seq - seq
+        if missed == 0:
+            return []
+        if self._messages is None or missed > len(self._messages):
+            return None
+        return list(self._messages)[-missed:]
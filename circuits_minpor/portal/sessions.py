@@ -0,0 +1,400 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from circuits_bricks.web.sessions import Sessions
+from circuits.core.handlers import handler
+from circuits.core.manager import Manager
+from collections import OrderedDict
+from abc import ABCMeta, abstractmethod
+from threading import Lock
+from hashlib import sha1
+from uuid import uuid4
+import cPickle as pickle
+import sqlite3
+import types
+import time
+import sys
+import os
+
+
+class SessionStore(object):
+    """
+    The base class for session stores. A session store keeps the
+    serialized session data outside the process, so that several
+    processes can share the sessions. The data is stored together
+    with a version that changes every time the data is saved. This
+    allows processes to skip the deserialization of session data
+    that they already know.
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def load(self, sid, version=None):
+        """
+        Returns the version of the data stored for the session with the
+        given id and the data. If the stored version equals the given
+        version, ``None`` is returned as data. If there is no data for
+        the session, ``(None, None)`` is returned.
+        """
+
+    @abstractmethod
+    def save(self, sid, version, data):
+        """
+        Stores the data for the session with the given id.
+        """
+
+    @abstractmethod
+    def delete(self, sid):
+        """
+        Removes the data for the session with the given id.
+        """
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Stores the serialized session data in the memory of the
+    process. This store cannot be shared between processes, but it
+    can be used to verify that the sessions can be serialized.
+    """
+
+    def __init__(self):
+        self._data = dict()
+        self._lock = Lock()
+
+    def load(self, sid, version=None):
+        with self._lock:
+            stored_version, data = self._data.get(sid, (None, None))
+        if stored_version is not None and stored_version == version:
+            return stored_version, None
+        return stored_version, data
+
+    def save(self, sid, version, data):
+        with self._lock:
+            self._data[sid] = (version, data)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class FileSessionStore(SessionStore):
+    """
+    Stores the serialized session data in a directory, using
+    one file per session.
+
+    :param directory: the directory for the session files.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, sid):
+        return os.path.join(self._directory, sha1(sid).hexdigest())
+
+    def load(self, sid, version=None):
+        try:
+            with open(self._path(sid), "rb") as stored:
+                stored_version = stored.readline().rstrip("\n")
+                if stored_version == version:
+                    return stored_version, None
+                return stored_version, stored.read()
+        except IOError:
+            return None, None
+
+    def save(self, sid, version, data):
+        path = self._path(sid)
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, "wb") as stored:
+            stored.write(version + "\n")
+            stored.write(data)
+        os.rename(temp, path)
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Stores the serialized session data in an SQLite database.
+    Every process uses its own connection to the database.
+
+    :param filename: the name of the database file.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._connection = None
+        self._pid = None
+        self._lock = Lock()
+        self._connect().execute \
+            ("CREATE TABLE IF NOT EXISTS sessions "
+             "(sid TEXT PRIMARY KEY, version TEXT, data BLOB, updated REAL)")
+
+    def _connect(self):
+        # Connections must not be shared with forked processes
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect \
+                (self._filename, timeout=10, isolation_level=None,
+                 check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def load(self, sid, version=None):
+        with self._lock:
+            row = self._connect().execute \
+                ("SELECT version, CASE WHEN version = ? THEN NULL "
+                 "ELSE data END FROM sessions WHERE sid = ?",
+                 (version, sid)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], (str(row[1]) if row[1] is not None else None)
+
+    def save(self, sid, version, data):
+        with self._lock:
+            self._connect().execute \
+                ("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                 (sid, version, sqlite3.Binary(data), time.time()))
+
+    def delete(self, sid):
+        with self._lock:
+            self._connect().execute \
+                ("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+# Objects that are shared by the sessions and therefore not accounted
+# for in the memory usage of a session
+_SharedTypes = (Manager, type, types.ModuleType, types.FunctionType,
+                types.MethodType, types.BuiltinFunctionType)
+
+
+def _deep_size(obj, seen):
+    """
+    Returns the size of the object and of all objects reachable from it
+    that have not been seen before. Shared objects are not followed.
+    """
+    if id(obj) in seen or isinstance(obj, _SharedTypes):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += _deep_size(key, seen) + _deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += _deep_size(item, seen)
+    elif not isinstance(obj, basestring):
+        state = getattr(obj, "__dict__", None)
+        if state is not None:
+            size += _deep_size(state, seen)
+        for clazz in type(obj).__mro__:
+            for name in clazz.__dict__.get("__slots__", ()):
+                if hasattr(obj, name):
+                    size += _deep_size(getattr(obj, name), seen)
+    return size
+
+
+class PortalSessions(Sessions):
+    """
+    A :class:`circuits_bricks.web.sessions.Sessions` component that
+    optionally keeps the session data in a :class:`SessionStore`.
+
+    Without a store, the sessions are kept in the memory of the process
+    only. With a store, the data of a session is refreshed from the store
+    when a request is received and saved in the store before the response
+    is sent, so that the next request may be handled by another process.
+    Sessions changed by other means (e.g. by the handlers of events
+    from the event exchange) must be saved explicitly (see :meth:`save`).
+    Entries with the keys given as *transient* are never saved. They
+    remain with the session in the process that has added them.
+    Changes saved by other processes in the meantime are merged
+    when a session is saved (see :meth:`save`).
+
+    The session id is added to the session data with the key
+    :attr:`SessionIdKey`.
+
+    If *max_sessions* is set, the least recently used sessions are
+    evicted from the memory of the process when a new session would
+    exceed the limit. Sessions for which *evictable* returns ``False``
+    (e.g. because they have an event exchange connection) are kept. 
+    Without a store, the data of an evicted session is lost, i.e. 
+    the client gets a new session.
+
+    :param store: the session store or ``None``.
+    :param transient: the keys of session entries that are not saved.
+    :param max_sessions: the maximum number of sessions kept in memory.
+    :param evictable: a function that is invoked with the session data
+        and returns ``False`` if the session must not be evicted.
+    """
+
+    SessionIdKey = "PortalSessions.sid"
+
+    def __init__(self, store=None, transient=(), max_sessions=None,
+                 evictable=None, *args, **kwargs):
+        super(PortalSessions, self).__init__(*args, **kwargs)
+        self._store = store
+        self._transient = frozenset(transient)
+        self._versions = dict()
+        # Ordered by last use, least recently used first
+        self._data = OrderedDict()
+        self._max_sessions = max_sessions
+        self._evictable = evictable
+        self._evicted = 0
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def max_sessions(self):
+        return self._max_sessions
+
+    @property
+    def evicted(self):
+        """
+        The number of sessions evicted so far.
+        """
+        return self._evicted
+
+    @property
+    def count(self):
+        """
+        The number of sessions kept in memory.
+        """
+        return len(self._data)
+
+    def _evict(self):
+        """
+        Evicts the least recently used evictable sessions until there
+        is room for another session. Sessions that cannot be evicted 
+        are moved to the end, so that they aren't checked again
+        with the next eviction.
+        """
+        checked = 0
+        while len(self._data) >= self._max_sessions \
+            and checked < len(self._data):
+            sid, session = self._data.popitem(last=False)
+            if self._evictable is not None and not self._evictable(session):
+                self._data[sid] = session
+                checked += 1
+                continue
+            self._versions.pop(sid, None)
+            self._evicted += 1
+
+    def load(self, sid):
+        session = self._data.pop(sid, None)
+        if session is None:
+            if self._max_sessions:
+                self._evict()
+            session = dict()
+        self._data[sid] = session
+        session[self.SessionIdKey] = sid
+        if self._store is None:
+            return session
+        known_version = self._versions.get(sid, (None, None, None))[0]
+        version, data = self._store.load(sid, known_version)
+        if data is None:
+            return session
+        for key in session.keys():
+            if key not in self._transient:
+                del session[key]
+        session.update(pickle.loads(data))
+        self._versions[sid] = (version, sha1(data).digest(), data)
+        return session
+
+    def _serialize(self, session):
+        return pickle.dumps(dict([(key, value) 
+                                  for key, value in session.items()
+                                  if key not in self._transient]),
+                            pickle.HIGHEST_PROTOCOL)
+
+    def save(self, sid, session):
+        """
+        Saves the session in the store. If the session has been 
+        saved by another process since it was loaded, the changes 
+        are merged: entries changed by this process since the session
+        was loaded replace those in the store, the others are taken
+        from the store.
+        """
+        if self._store is None:
+            return
+        data = self._serialize(session)
+        digest = sha1(data).digest()
+        known_version, known_digest, base \
+            = self._versions.get(sid, (None, None, None))
+        if known_digest == digest:
+            return
+        _, stored = self._store.load(sid, known_version)
+        if stored is not None:
+            self._merge(session, base, stored)
+            data = self._serialize(session)
+            digest = sha1(data).digest()
+        version = uuid4().hex
+        self._store.save(sid, version, data)
+        self._versions[sid] = (version, digest, data)
+
+    def _merge(self, session, base, stored):
+        base = pickle.loads(base) if base is not None else dict()
+        stored = pickle.loads(stored)
+        for key in set(base.keys()) | set(stored.keys()):
+            if key in self._transient:
+                continue
+            if (key in session) != (key in base) \
+                or (key in session and 
+                    pickle.dumps(session[key], pickle.HIGHEST_PROTOCOL)
+                    != pickle.dumps(base[key], pickle.HIGHEST_PROTOCOL)):
+                # Changed by this process
+                continue
+            if key in stored:
+                session[key] = stored[key]
+            else:
+                session.pop(key, None)
+
+    def memory_usage(self, sid=None):
+        """
+        Returns the (estimated) number of bytes used by the data of 
+        the session with the given id or by all sessions kept in
+        memory if *sid* is ``None``. Objects shared by the sessions 
+        (such as components) are not included. As all data has to be
+        traversed, this should not be invoked too frequently.
+        """
+        seen = set()
+        if sid is not None:
+            if sid not in self._data:
+                return 0
+            return _deep_size(self._data[sid], seen) \
+                + _deep_size(self._versions.get(sid), seen)
+        return _deep_size(self._data, seen) \
+            + _deep_size(self._versions, seen)
+
+    @handler("response", priority=10)
+    def _on_response(self, response):
+        request = response.request
+        sid = getattr(request, "sid", None)
+        if sid is None or self._store is None \
+            or not request.path.startswith(self._path):
+            return
+        self.save(sid, request.session)
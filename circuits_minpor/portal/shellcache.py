@@ -0,0 +1,107 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class ShellCache(object):
+    """
+    Keeps rendered segments of the portal page that depend only on
+    the locales, the theme and the portal's configuration (the 
+    "shell"), so that they don't have to be rendered again for every
+    page. The key of a segment must include everything that the
+    segment depends on, including the version of its template. 
+    The least recently used segments are dropped if there are more 
+    than *max_entries*. :meth:`invalidate` drops all segments (e.g.
+    when the portal's configuration changes). A compressed form of
+    a segment can be kept along with it (see :meth:`compressed`).
+
+    :param max_entries: the maximum number of segments kept.
+    """
+
+    def __init__(self, max_entries=256):
+        self._max_entries = max_entries
+        self._segments = OrderedDict()
+        self._compressed = dict()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = Lock()
+
+    def get(self, key, render):
+        """
+        Returns the segment with the given key. If the segment isn't
+        cached, it is rendered by invoking *render* and added to the
+        cache.
+        """
+        with self._lock:
+            segment = self._segments.pop(key, None)
+            if segment is not None:
+                self._segments[key] = segment
+                self._hits += 1
+                return segment
+            self._misses += 1
+            generation = self._generation
+        # Rendering may take some time, don't block others
+        segment = render()
+        with self._lock:
+            if generation == self._generation:
+                self._segments[key] = segment
+                while len(self._segments) > self._max_entries:
+                    dropped, _ = self._segments.popitem(last=False)
+                    self._compressed.pop(dropped, None)
+        return segment
+
+    def compressed(self, key, compress):
+        """
+        Returns the compressed form of the cached segment with the 
+        given key. It is created by invoking *compress* with the
+        segment when requested for the first time. Returns ``None``
+        if the segment isn't cached (any more).
+        """
+        with self._lock:
+            if key not in self._segments:
+                return None
+            compressed = self._compressed.get(key)
+            if compressed is not None:
+                return compressed
+            segment = self._segments[key]
+            generation = self._generation
+        compressed = compress(segment)
+        with self._lock:
+            if generation == self._generation and key in self._segments:
+                self._compressed[key] = compressed
+        return compressed
+
+    def invalidate(self):
+        with self._lock:
+            self._segments.clear()
+            self._compressed.clear()
+            self._generation += 1
+
+    def metrics(self):
+        """
+        Returns a dict with the number of cached segments and the
+        numbers of hits and misses.
+        """
+        return { "entries": len(self._segments),
+                 "hits": self._hits,
+                 "misses": self._misses }
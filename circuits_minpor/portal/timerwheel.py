@@ -0,0 +1,267 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits_bricks.app.logger import log
+from circuits_minpor.portal.sessions import PortalSessions
+from threading import Lock
+import logging
+import time
+import sys
+
+
+class TimerWheel(BaseComponent):
+    """
+    A service that invokes callbacks after a delay or periodically,
+    provided by the portal (see :attr:`circuits_minpor.Portal.timers`)
+    for portlets that do work on a regular basis. Unlike 
+    :class:`circuits_bricks.core.timers.Timer`\ s, the scheduled 
+    callbacks are not components and adding or cancelling a callback
+    takes constant time, independent of the number of scheduled
+    callbacks.
+
+    The callbacks are kept in a hierarchical timing wheel. Time is
+    divided in ticks of *resolution* seconds. The first level of the
+    wheel has a slot for each of the next *slots* ticks, every higher
+    level has a slot for *slots* times the span of a slot of the 
+    level below. When the lower level has been passed, the callbacks
+    in the next slot of the higher level are distributed among the
+    slots of the lower level. 
+
+    Periodic callbacks with the same interval are aligned to multiples
+    of the interval, so that they are invoked in the same tick. If 
+    the main loop has been stalled, missed invocations of periodic
+    callbacks are skipped, i.e. a callback is invoked only once.
+    
+    The callbacks are invoked from the circuits main loop and must 
+    not block. They may be scheduled or cancelled from any thread.
+    Callbacks that have been scheduled for a session or a portlet
+    are cancelled automatically when the session's client disconnects
+    from the event exchange or the portlet is removed from the portal.
+
+    :param resolution: the duration of a tick in seconds.
+    :param slots: the number of slots per level.
+    :param levels: the number of levels. Callbacks that are due
+        after the span of all levels are re-scheduled when the
+        span has passed.
+    """
+
+    class _Entry(object):
+
+        __slots__ = ("key", "callback", "args", "interval", "expiry",
+                     "sid", "portlet", "slot")
+
+    def __init__(self, resolution=0.1, slots=64, levels=4, *args, **kwargs):
+        super(TimerWheel, self).__init__(*args, **kwargs)
+        self._resolution = resolution
+        self._slots = slots
+        self._levels = levels
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._wheel = [[dict() for _ in range(slots)] 
+                       for _ in range(levels)]
+        self._entries = dict()
+        self._by_session = dict()
+        self._by_portlet = dict()
+        self._started = time.time()
+        self._current = 0
+        self._fired = 0
+        self._lock = Lock()
+
+    @property
+    def count(self):
+        """
+        The number of scheduled callbacks.
+        """
+        return len(self._entries)
+
+    def _now(self):
+        return int((time.time() - self._started) / self._resolution)
+
+    def schedule(self, key, delay, callback, args=(), periodic=False,
+                 session=None, portlet=None):
+        """
+        Schedules the callback to be invoked with *args* after *delay*
+        seconds or, if *periodic* is ``True``, every *delay* seconds.
+        A callback already scheduled with the same *key* is replaced.
+
+        :param key: a hashable value that identifies the callback.
+        :param session: the session that the callback belongs to.
+        :param portlet: the portlet that the callback belongs to.
+        """
+        entry = self._Entry()
+        entry.key = key
+        entry.callback = callback
+        entry.args = args
+        ticks = max(1, int(round(delay / self._resolution)))
+        entry.interval = ticks if periodic else None
+        entry.sid = session.get(PortalSessions.SessionIdKey) \
+            if session is not None else None
+        entry.portlet = portlet
+        with self._lock:
+            self._remove(key)
+            if periodic:
+                entry.expiry = (self._current // ticks + 1) * ticks
+            else:
+                entry.expiry = self._current + ticks
+            self._entries[key] = entry
+            if entry.sid is not None:
+                self._by_session.setdefault(entry.sid, set()).add(key)
+            if portlet is not None:
+                self._by_portlet.setdefault(portlet, set()).add(key)
+            self._insert(entry)
+
+    def scheduled(self, key):
+        """
+        Returns ``True`` if a callback is scheduled with the given key.
+        """
+        return key in self._entries
+
+    def cancel(self, key):
+        """
+        Cancels the callback with the given key. Returns ``False``
+        if there is no such callback.
+        """
+        with self._lock:
+            return self._remove(key)
+
+    def cancel_session(self, session):
+        """
+        Cancels all callbacks scheduled for the session.
+        """
+        sid = session.get(PortalSessions.SessionIdKey)
+        with self._lock:
+            for key in list(self._by_session.get(sid, ())):
+                self._remove(key)
+
+    def cancel_portlet(self, portlet):
+        """
+        Cancels all callbacks scheduled for the portlet.
+        """
+        with self._lock:
+            for key in list(self._by_portlet.get(portlet, ())):
+                self._remove(key)
+
+    def _insert(self, entry):
+        delta = entry.expiry - self._current
+        for level in range(self._levels):
+            if delta < self._spans[level + 1]:
+                break
+        else:
+            # Beyond the wheel, put in the last slot reachable
+            level = self._levels - 1
+            delta = self._spans[self._levels] - 1
+        slot = self._wheel[level][((self._current + delta) 
+                                   // self._spans[level]) % self._slots]
+        slot[entry.key] = entry
+        entry.slot = slot
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        # The slot of a due entry has already been detached
+        entry.slot.pop(key, None)
+        if entry.sid is not None:
+            keys = self._by_session[entry.sid]
+            keys.discard(key)
+            if not keys:
+                del self._by_session[entry.sid]
+        if entry.portlet is not None:
+            keys = self._by_portlet[entry.portlet]
+            keys.discard(key)
+            if not keys:
+                del self._by_portlet[entry.portlet]
+        return True
+
+    def _advance(self, now):
+        """
+        Advances the wheel by one tick and returns the entries that
+        have become due. Periodic entries are re-scheduled after
+        the tick *now*, so that they are invoked only once when the
+        wheel catches up after the loop has been stalled.
+        """
+        self._current += 1
+        for level in range(1, self._levels):
+            if self._current % self._spans[level]:
+                break
+            index = (self._current // self._spans[level]) % self._slots
+            slot = self._wheel[level][index]
+            self._wheel[level][index] = dict()
+            for entry in slot.values():
+                self._insert(entry)
+        index = self._current % self._slots
+        slot = self._wheel[0][index]
+        if not slot:
+            return ()
+        self._wheel[0][index] = dict()
+        due = []
+        for entry in slot.values():
+            if entry.expiry > self._current:
+                # Was beyond the span of the wheel
+                self._insert(entry)
+                continue
+            if entry.interval is None:
+                self._remove(entry.key)
+            else:
+                entry.expiry += entry.interval
+                if entry.expiry <= now:
+                    # Skip the invocations that have been missed
+                    entry.expiry = (now // entry.interval + 1) \
+                        * entry.interval
+                self._insert(entry)
+            due.append(entry)
+        return due
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        now = self._now()
+        due = []
+        with self._lock:
+            if not self._entries:
+                self._current = max(self._current, now)
+                return
+            while self._current < now:
+                due.extend(self._advance(now))
+        for entry in due:
+            self._fired += 1
+            try:
+                entry.callback(*entry.args)
+            except Exception:
+                self.fire(log(logging.ERROR, "Timer callback %s failed: %s"
+                              % (entry.key, sys.exc_info()[1])))
+        if self._entries:
+            # A negative time would make the loop block (after a stall)
+            event.reduce_time_left \
+                (max(0, self._started + (self._current + 1) 
+                     * self._resolution - time.time()))
+
+    @handler("portal_client_disconnect")
+    def _on_client_disconnect(self, session, sock):
+        if session is not None:
+            self.cancel_session(session)
+
+    def metrics(self):
+        """
+        Returns a dict with the number of scheduled callbacks and 
+        the number of invocations so far.
+        """
+        return { "scheduled": len(self._entries),
+                 "fired": self._fired }
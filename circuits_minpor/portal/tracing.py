@@ -0,0 +1,203 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from threading import Lock, Thread
+from collections import deque
+from Queue import Queue, Full
+import json
+import os
+import time
+
+
+class Span(object):
+    """
+    A timed step in the processing of a request or client message.
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", 
+                 "start", "end", "attrs")
+
+    def __init__(self, trace_id, span_id, parent_id, name, attrs):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end = None
+        self.attrs = attrs
+
+    def as_dict(self):
+        return { "trace_id": self.trace_id,
+                 "span_id": self.span_id,
+                 "parent_id": self.parent_id,
+                 "name": self.name,
+                 "start": self.start,
+                 "duration": (self.end - self.start 
+                              if self.end is not None else None),
+                 "attrs": self.attrs }
+
+
+class Tracer(object):
+    """
+    A lightweight tracing facility. Every HTTP request and every
+    message from a client gets a trace id that is carried along
+    (as attribute ``trace_id``) by the events derived from it.
+    The steps of the processing are recorded as spans (see :class:`Span`).
+    Finished spans are kept in a ring buffer and optionally appended
+    to a file (one JSON object per line). The file is written by
+    a thread of its own, so that finishing a span never waits for 
+    the disk. Spans that don't fit in the writer's queue are dropped
+    (see :attr:`dropped`).
+
+    :param enabled: if ``False``, no spans are recorded.
+    :param buffer_size: the number of spans kept in memory.
+    :param filename: the name of the file to append the spans to.
+    """
+
+    # The maximum number of spans waiting to be written to the file
+    MaxQueued = 10000
+
+    def __init__(self, enabled=False, buffer_size=1000, filename=None):
+        self.enabled = enabled
+        self._spans = deque(maxlen=buffer_size)
+        self._filename = filename
+        self._queue = None
+        self._writer = None
+        self._writer_pid = None
+        self._dropped = 0
+        self._next_id = 0
+        self._prefix = "%x-" % os.getpid()
+        self._lock = Lock()
+
+    def _new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._prefix + "%x" % self._next_id
+
+    def new_trace(self):
+        """
+        Returns a new trace id or ``None`` if tracing is disabled.
+        """
+        if not self.enabled:
+            return None
+        return self._new_id()
+
+    def start(self, name, trace_id, parent=None, **attrs):
+        """
+        Starts a new span for the given trace. Returns ``None`` if
+        *trace_id* is ``None`` (i.e. tracing was disabled when
+        the trace would have been started).
+        """
+        if trace_id is None:
+            return None
+        return Span(trace_id, self._new_id(), 
+                    parent.span_id if parent is not None else None, 
+                    name, attrs)
+
+    def finish(self, span, **attrs):
+        """
+        Finishes the given span (may be ``None``) and records it.
+        """
+        if span is None:
+            return
+        span.end = time.time()
+        if attrs:
+            span.attrs.update(attrs)
+        record = span.as_dict()
+        with self._lock:
+            self._spans.append(record)
+            if self._filename:
+                self._write(record)
+
+    @property
+    def dropped(self):
+        """
+        The number of spans that could not be written to the file.
+        """
+        return self._dropped
+
+    def _write(self, record):
+        # Invoked with the lock held. The writer doesn't survive 
+        # forking a worker process, start a new one in the worker.
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._queue = Queue(self.MaxQueued)
+            self._writer = Thread(target=self._write_queued, 
+                                  args=(self._queue,), name="trace-writer")
+            self._writer.daemon = True
+            self._writer.start()
+            self._writer_pid = os.getpid()
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            self._dropped += 1
+
+    def _write_queued(self, queue):
+        with open(self._filename, "a") as out:
+            while True:
+                record = queue.get()
+                if record is None:
+                    break
+                out.write(json.dumps(record) + "\n")
+                # Spans arrive in bursts, flush when caught up
+                if queue.empty():
+                    out.flush()
+
+    def close(self):
+        """
+        Writes the spans that are still queued and closes the file.
+        """
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is None or self._writer_pid != os.getpid():
+                return
+            self._queue.put(None)
+        writer.join()
+
+    def spans(self, trace_id=None):
+        """
+        Returns the recorded spans (all or only those of the given
+        trace) as list of dicts.
+        """
+        with self._lock:
+            return [span for span in self._spans
+                    if trace_id is None or span["trace_id"] == trace_id]
+
+    def summary(self):
+        """
+        Returns a dict that maps the names of the spans to the number
+        of recorded spans, their total and their maximum duration.
+        """
+        result = dict()
+        for span in self.spans():
+            if span["duration"] is None:
+                continue
+            entry = result.setdefault(span["name"], 
+                                      { "count": 0, "total": 0.0, 
+                                        "max": 0.0 })
+            entry["count"] += 1
+            entry["total"] += span["duration"]
+            entry["max"] = max(entry["max"], span["duration"])
+        return result
+
+    def dump(self):
+        """
+        Returns the recorded spans as JSON.
+        """
+        return json.dumps(self.spans())
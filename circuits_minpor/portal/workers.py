@@ -0,0 +1,138 @@
+"""
+..
+   This file is part of the circuits minimal portal component.
+   Copyright (C) 2012-2015 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. moduleauthor:: mnl
+"""
+from circuits.core.components import BaseComponent
+from circuits.net.sockets import TCPServer
+from circuits.web.servers import BaseServer
+from circuits.web.http import HTTP
+import multiprocessing
+import signal
+import socket
+import errno
+import traceback
+import time
+import os
+
+
+class WorkerServer(BaseServer):
+    """
+    A :class:`circuits.web.servers.BaseServer` that accepts connections
+    on an existing listening socket. Several worker processes that
+    have inherited the socket from their parent can accept connections
+    on the same port this way.
+
+    :param sock: the listening socket.
+    """
+
+    def __init__(self, sock, encoding="utf-8", channel=BaseServer.channel,
+                 display_banner=False):
+        BaseComponent.__init__(self, channel=channel)
+        self._display_banner = display_banner
+        self.server = TCPServer(sock, channel=channel).register(self)
+        self.http = HTTP(self, encoding=encoding, channel=channel) \
+            .register(self)
+
+
+def listen(bind, backlog=128):
+    """
+    Creates a non-blocking socket that listens on the given address.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(bind)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def run_workers(setup, bind=("", 4444), workers=None):
+    """
+    Runs a portal in several processes that accept connections
+    on the same port. 
+
+    The calling process creates the listening socket and invokes 
+    *setup* with a :class:`WorkerServer` for this socket. *setup* must
+    create the portal and its portlets and return the component to run
+    (usually the root :class:`circuits.core.manager.Manager`). Creating
+    the components before forking the workers ensures that all workers
+    use the same portlet handles. The portal must use a session store
+    that is shared between the processes (see
+    :mod:`circuits_minpor.portal.sessions`).
+
+    The calling process then forks the workers, which run the component,
+    and waits for them to terminate. Workers that fail are restarted.
+    Sending SIGTERM or SIGINT to the calling process stops all workers.
+
+    :param setup: the function that creates the portal.
+    :param bind: the address to listen on.
+    :param workers: the number of worker processes, defaults to the
+        number of CPUs.
+    """
+    sock = bind if isinstance(bind, socket.socket) else listen(bind)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    root = setup(WorkerServer(sock))
+    children = dict()
+    stopping = []
+
+    def start(worker):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                root.run()
+            except SystemExit as e:
+                # The manager stops with SystemExit when signaled
+                status = e.code or 0
+            except BaseException:
+                status = 1
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        children[pid] = worker
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in range(workers):
+        start(worker)
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        worker = children.pop(pid, None)
+        if worker is not None and status != 0 and not stopping:
+            # Don't restart at full speed if a worker keeps failing
+            time.sleep(1)
+            start(worker)
+    sock.close()
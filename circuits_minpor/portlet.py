@@ -28,6 +28,7 @@ import os
 import rbtranslations
 import tenjin
 import inspect
+from threading import Lock
 
 class Portlet(BaseComponent):
     """
@@ -116,13 +117,57 @@ class Portlet(BaseComponent):
         def window_states(self):
             return self.states
 
+    class Asset(object):
+        """
+        Instances of this class declare a file with client side code
+        that the portlet's markup depends on. They are part of the
+        portlet's :class:`~.Description`. The portal combines the
+        assets of all portlet classes in bundles that are referenced
+        in the head of the portal page and cached by the browser, 
+        so that the markup of a portlet instance only has to 
+        invoke the code with the instance's ids.
+        """
+
+        def __init__(self, path, kind = None, name = None):
+            """
+            :param path: the path of the file. A relative path is 
+                relative to the directory of the portlet's class.
+            :type path: string
+            :param kind: one of "js", "css" or "template". Defaults
+                to "js" or "css" for files with these extensions
+                and "template" for all other files.
+            :type kind: string
+            :param name: the id of a template that is passed to
+                ``CirMinPor.tmpl``. Defaults to the file name without
+                extension. 
+            :type name: string
+            """
+            base, ext = os.path.splitext(os.path.basename(path))
+            self._path = path
+            self._kind = kind or \
+                (ext[1:] if ext in (".js", ".css") else "template")
+            self._name = name or base
+
+        @property
+        def path(self):
+            return self._path
+
+        @property
+        def kind(self):
+            return self._kind
+
+        @property
+        def name(self):
+            return self._name
+
     class Description(object):
         """
         Instances of this class are used by portlets to inform the
         portal about their capabilities. See :meth:`~.description`.
         """
         def __init__(self, handle, short_title, title = None,  
-                     markup_types=None, locale = "en-US", events = []):
+                     markup_types=None, locale = "en-US", events = [],
+                     assets = []):
             """
             :param handle: a unique id for the portlet.
             :type handle: string
@@ -135,6 +180,8 @@ class Portlet(BaseComponent):
                 :class:`~.MarkupType`. Defaults to
                 ``dict({"text/html": Portlet.MarkupType()}``
             :type markup_types: dict
+            :param assets: the client side code used by the markup.
+            :type assets: list of :class:`~.Asset`
             """
             self._handle = handle
             self._short_title = short_title
@@ -143,6 +190,7 @@ class Portlet(BaseComponent):
                 or dict({"text/html": Portlet.MarkupType()})
             self._locale = locale
             self._events = events
+            self._assets = assets
 
         @property
         def short_title(self):
@@ -168,6 +216,10 @@ class Portlet(BaseComponent):
         def events(self):
             return self._events
 
+        @property
+        def assets(self):
+            return self._assets
+
     class UrlGenerator(object):
         """
         This class defines the interface of an URL generator.
@@ -246,11 +298,24 @@ class Portlet(BaseComponent):
         self._translation_props_dir = os.path.dirname(class_file)
         self._key_language = key_language
         self._weight = weight
+        self._render_count = 0
+        self._render_count_lock = Lock()
 
     @property
     def weight(self):
         return getattr(self, "_weight", 0)
 
+    @property
+    def render_count(self):
+        """
+        The number of times that :meth:`.render` has been invoked.
+        This includes asynchronous renders (see :meth:`async_render`),
+        which are started speculatively when a portal page is
+        rendered and counted even if the page doesn't use their
+        result.
+        """
+        return getattr(self, "_render_count", 0)
+
     def translation(self, locales=[]):
         """
         Returns an instance of :class:`rbtranslations.Translation` that
@@ -281,12 +346,60 @@ class Portlet(BaseComponent):
         Render the portlet, i.e. return its contribution to the
         HTML content.
         """
+        with self._render_count_lock:
+            self._render_count += 1
         url_generator = url_generator_factory \
             .make_generator(self, portal.session)
+        render_input = self.pool_render_input \
+            (mime_type, mode, window_state, locales, url_generator, 
+             invocation_id, portal, **kwargs)
+        if render_input is not None:
+            pool = getattr(portal, "render_pool", None)
+            if pool is None:
+                content = self.pool_render(render_input)
+            else:
+                content = pool.render(self.__class__, render_input)
+            if content is not None:
+                return content
         return self.do_render(mime_type, mode, window_state, 
                               locales, url_generator, invocation_id,
                               portal, **kwargs)
 
+    def pool_render_input(self, mime_type, mode, window_state, locales, 
+                          url_generator, invocation_id, portal, **kwargs):
+        """
+        Portlets with CPU intensive rendering can have their content
+        rendered in another process (see the portal's 
+        *render_processes* parameter). Such portlets return 
+        all information required for rendering the content from 
+        this method. The information is passed to :meth:`pool_render`
+        in the other process and must therefore be picklable. URLs
+        must be obtained from the *url_generator* here, because the
+        other process has no access to the session.
+
+        The parameters are the same as for :meth:`do_render`. The
+        default implementation returns ``None``, which makes the
+        portlet being rendered by :meth:`do_render`.
+        """
+        return None
+
+    @classmethod
+    def pool_render(cls, render_input):
+        """
+        Returns the portlet's content using the information provided
+        by :meth:`pool_render_input`. The method is invoked in 
+        another process (or in the current process if no render 
+        processes have been configured for the portal). 
+        It is a class method, because the portlet instance isn't
+        available in the other process.
+
+        Portlets that return information from :meth:`pool_render_input`
+        must override this method. The default implementation returns
+        ``None``, which makes the portlet being rendered by 
+        :meth:`do_render` in the current process after all.
+        """
+        return None
+
     def do_render(self, mime_type, mode, window_state, locales, 
                    url_generator, invocation_id, portal, **kwargs):
         """
@@ -315,6 +428,39 @@ class Portlet(BaseComponent):
         return "<div class=\"portlet-msg-error\">" \
                 + "Portlet not implemented yet</div>"
 
+    async_render = None
+    """
+    Portlets that have to wait for other components (or I/O) while 
+    rendering their content can implement this method instead of
+    :meth:`do_render`. It is invoked with the same parameters
+    as :meth:`do_render` and must be a generator that is 
+    run as a coroutine by the circuits event loop. While waiting,
+    it yields the result of ``self.call(event)`` (to wait for the
+    event to be handled) or of :func:`circuits.core.manager.sleep`.
+    The content is provided by yielding it as last value.
+    
+    Portlets that render asynchronously don't block a thread while
+    waiting. When the portal page is rendered, the asynchronous 
+    renders of all portlets are started before the page template is
+    processed, so they run concurrently.
+    
+    (Actions don't need a special API, because the handlers for 
+    the events fired by actions may already be coroutines.) 
+    """
+
+    @handler("portlet_async_render")
+    def _on_portlet_async_render(self, portal, mime_type, mode, 
+                                 window_state, locales, 
+                                 url_generator_factory, invocation_id, 
+                                 **kwargs):
+        with self._render_count_lock:
+            self._render_count += 1
+        url_generator = url_generator_factory \
+            .make_generator(self, portal.session)
+        return self.async_render(mime_type, mode, window_state, 
+                                 locales, url_generator, invocation_id,
+                                 portal, **kwargs)
+
     @handler("portlet_resource")
     def _on_portlet_resource(self, request, response, **kwargs):
         return self.do_portlet_resource(request, response, **kwargs)
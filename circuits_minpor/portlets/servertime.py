@@ -19,7 +19,6 @@
 .. moduleauthor:: mnl
 """
 from circuits_minpor.portlet import TemplatePortlet, Portlet
-from circuits_bricks.core.timers import Timer
 from circuits.core.events import Event
 from circuits.core.handlers import handler
 import datetime
@@ -33,18 +32,22 @@ class ServerTimePortlet(TemplatePortlet):
     def __init__(self, *args, **kwargs):
         super(ServerTimePortlet, self) \
             .__init__("templates", "servertime", *args, **kwargs)
+        self._portal = None
         self._portal_channel = None
         self._time_channel = self.channel + "-time"
-        self._timer = None
 
     def description(self, locales=[]):
         return Portlet.Description\
             (self._handle, self.translation(locales) \
                 .ugettext("Server Time Portlet"),
-             events=[(on_off_changed, self.channel)])
+             events=[(on_off_changed, self.channel)],
+             assets=[Portlet.Asset("templates/servertime.js"),
+                     Portlet.Asset("templates/servertime_time.html",
+                                   name="ServerTimePortlet_time")])
 
     @handler("portlet_added")
     def _on_portlet_added(self, portal, portlet):
+        self._portal = portal
         self._portal_channel=portal.channel
         @handler("portal_client_connect", channel=portal.channel)
         def _on_ws_connect(self, session):
@@ -60,22 +63,24 @@ class ServerTimePortlet(TemplatePortlet):
 
     @property
     def updating(self):
-        return getattr(self, "_timer", None) is not None
+        return self._portal is not None \
+            and self._portal.timers.scheduled(self._time_channel)
 
     @handler("on_off_changed")
     def _on_off_changed(self, value, session=None, **kwargs):
-        if value and self._timer is None:
-            evt = Event.create("time_over", session)
-            evt.channels = (self.channel,)
-            self._timer = Timer(1, evt, persist=True).register(self)
+        if value and not self.updating:
+            self._portal.timers.schedule \
+                (self._time_channel, 1, self._on_time_over, (session,),
+                 periodic=True, portlet=self)
             locales = kwargs.get("locales", [])
             self.fire(portal_message \
                       (session, self.translation(locales) \
                        .ugettext("TimeUpdateOn")), self._portal_channel)
-        if not value and self._timer is not None:
-            self._timer.unregister()
-            self._timer = None
+        if not value and self.updating:
+            self._portal.timers.cancel(self._time_channel)
     
-    @handler("time_over")
     def _on_time_over(self, session):
+        # The session's client isn't watching
+        if not self._portal.displays(session, self):
+            return
         self._update_time(session)
@@ -0,0 +1,25 @@
+/**
+ * Initializes an instance of the server time portlet. "prefix" is
+ * the prefix of the ids of the instance's elements, "handle" the 
+ * portlet's handle.
+ */
+CirMinPor.ServerTimePortlet = function (prefix, handle) {
+    var help = document.getElementById(prefix + "help_button");
+    help.onclick = function () {
+        CirMinPor.addMessage(help.getAttribute("data-help"));
+    }
+
+    document.getElementById(prefix + "onoff").onclick = function () {
+        CirMinPor.sendEvent(handle, 
+                            "circuits_minpor.portlets.servertime.on_off_changed",
+                            [this.checked]);
+    }
+
+    CirMinPor.addEventExchangeHandler(handle, "new_time", function (args) {
+        var result = document.getElementById(prefix + "display");
+        var receivedTime = new Date(parseInt(args[0]));
+        var formattedTime = receivedTime.toString("FFFF");
+        result.innerHTML = CirMinPor.tmpl("ServerTimePortlet_time",
+                                          {time: formattedTime});
+    });
+};
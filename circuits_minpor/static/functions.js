@@ -38,37 +38,208 @@ wsUrl: function(path) {
  * function. 
  */
 (function() {
+	var exchangeUrl;
+	// The connection, a WebSocket or an EventSource
 	var ws;
+	// Server-sent events are used if WebSockets don't work
+	var transport = "ws";
+	var wsOpened = false;
+	// Messages to the server waiting to be posted
+	var outgoing = [];
+	var posting = false;
+	// Events collected for sending in a single message
+	var batched = [];
+	var flushPending = false;
+	// State of debounced and throttled events by handle and name
+	var debounced = {};
+	var throttled = {};
 	var eventHandlers = [];
+	var subscribed = [];
+	// The position in the sequence of messages from the server
+	var epoch;
+	var lastSeq = 0;
+	// Reconnect after 0.5s, doubling the delay up to 30s 
+	var retries = 0;
+	var reconnectDelay = 500;
+	var maxReconnectDelay = 30000;
+	// The content of portlets as version and text
+	var contents = {};
+
+	/*
+	 * Replaces the content of a portlet. If "base" is null, "data" is
+	 * the new content. Else, "data" holds the operations that create the
+	 * new content from the content with version "base": a positive
+	 * number keeps tokens, a negative number skips tokens and a string 
+	 * is inserted. Tokens are tags and the text between them.
+	 */
+	function updateContent(handle, version, base, data) {
+	    var text = data;
+	    if (base !== null) {
+	    	var current = contents[handle];
+	    	if (!current || current[0] != base) {
+	    		CirMinPor.sendEvent("portal", "content_full", [handle]);
+	    		return false;
+	    	}
+	    	var tokens = current[1].split(/(<[^>]*>)/);
+	    	var parts = [];
+	    	var pos = 0;
+	    	for (var i = 0; i < data.length; i++) {
+	    		var op = data[i];
+	    		if (typeof op == "string") {
+	    			parts.push(op);
+	    		} else if (op > 0) {
+	    			parts.push(tokens.slice(pos, pos + op).join(""));
+	    			pos += op;
+	    		} else {
+	    			pos -= op;
+	    		}
+	    	}
+	    	text = parts.join("");
+	    }
+	    contents[handle] = [version, text];
+	    var element = document.getElementById("portlet-content-" + handle);
+	    if (element) {
+	    	element.innerHTML = text;
+	    }
+	    return true;
+	}
+
+	function receive(evt) {
+	    data = JSON.parse(evt.data);
+	    if (typeof data[0] == "number") {
+	    	var seq = data.shift();
+	    	if (seq <= lastSeq) {
+	    		// Already received before reconnect
+	    		return;
+	    	}
+	    	lastSeq = seq;
+	    }
+	    channel = data[0];
+	    name = data[1];
+	    if (channel == "portal") {
+	    	if (name == "portal_message") {
+	    		CirMinPor.addMessage(data[2], data[3])
+	    	} else if (name == "resync") {
+	    		epoch = data[2];
+	    		lastSeq = data[3];
+	    	} else if (name == "reload") {
+	    		// Messages have been lost, start over
+	    		window.location.reload();
+	    	}
+	    	return;
+	    }
+	    if (name == "portal_content" 
+	        && !updateContent(channel, data[2], data[3], data[4])) {
+	    	return;
+	    }
+	    // alert(CirMinPor._eventHandlers);
+	    for (idx in eventHandlers) {
+	       handlerData = eventHandlers[idx];
+	       if ((handlerData[0] == "*" || handlerData[0] == channel)
+	           && (handlerData[1] == "*" || handlerData[1] == name)) {
+	          handlerData[2](data.slice(2));
+	       }
+	    }
+	}
+
+	function reconnect() {
+	    var delay = Math.min(reconnectDelay * Math.pow(2, retries), 
+	    		maxReconnectDelay);
+	    retries += 1;
+	    // Spread the reconnects of many clients (e.g. after a restart)
+	    setTimeout(connect, delay / 2 + Math.random() * delay / 2);
+	}
+
+	function opened() {
+	    retries = 0;
+	    CirMinPor.subscribe(subscribed);
+	    // Send what has been queued while disconnected
+	    flush();
+	}
+
+	function isOpen() {
+	    // readyState 1 means open for both transports
+	    return ws && ws.readyState == 1;
+	}
+
+	function connect() {
+	    var query = "?epoch=" + encodeURIComponent(epoch) + "&seq=" + lastSeq;
+	    if (transport == "sse") {
+	    	var source = new EventSource(exchangeUrl + "/stream" + query);
+	    	ws = source;
+	    	source.onopen = opened;
+	    	source.onmessage = receive;
+	    	source.onerror = function () {
+	    		// Reconnect with the current position
+	    		source.close();
+	    		reconnect();
+	    	};
+	    	return;
+	    }
+	    ws = new WebSocket(CirMinPor.wsUrl(exchangeUrl) + query);
+	    ws.onopen = function () {
+	        wsOpened = true;
+	        opened();
+	    };
+	    ws.onmessage = receive;
+	    ws.onclose = function () {
+	        if (!wsOpened && "EventSource" in window) {
+	        	// Never worked, probably blocked by a proxy
+	        	transport = "sse";
+	        }
+	        reconnect();
+	    };
+	}
+
+	function post() {
+	    if (posting || outgoing.length == 0) {
+	    	return;
+	    }
+	    posting = true;
+	    var batch = outgoing;
+	    outgoing = [];
+	    var req = new XMLHttpRequest();
+	    req.open("POST", exchangeUrl + "/post", true);
+	    req.setRequestHeader("Content-Type", "application/json");
+	    req.setRequestHeader("X-Portal-Event", "1");
+	    req.onreadystatechange = function () {
+	    	if (req.readyState == 4) {
+	    		posting = false;
+	    		if (req.status == 0 || req.status >= 500) {
+	    			// Connection lost, send again when reopened
+	    			outgoing = batch.concat(outgoing);
+	    			return;
+	    		}
+	    		// Send what has been queued in the meantime
+	    		post();
+	    	}
+	    };
+	    req.send(JSON.stringify(batch));
+	}
 
 	/**
 	 * An internal helper function invoked by the portal after the page
 	 * has loaded that opens the websocket connection for exchanging
-	 * events with the server.
+	 * events with the server. Parameter "displayed" holds the handles
+	 * of the portlets displayed on the page, "replayEpoch" and 
+	 * "replaySeq" the position in the sequence of messages from the
+	 * server when the page was rendered. If the connection is lost, 
+	 * it is reopened and the messages sent in the meantime are
+	 * received. If WebSockets are not available, server-sent events
+	 * are used to receive messages and messages are sent with 
+	 * HTTP POST requests.
 	 */
-	CirMinPor._openEventExchange = function (resourceUrl) {
-	  if ("WebSocket" in window && JSON) {
-	     // Let us open a web socket
-	     ws = new WebSocket(CirMinPor.wsUrl(resourceUrl));
-	     ws.onmessage = function (evt) {
-	        data = JSON.parse(evt.data);
-	        channel = data[0];
-	        name = data[1];
-	        if (channel == "portal") {
-	        	if (name == "portal_message") {
-	        		CirMinPor.addMessage(data[2], data[3])
-	        	}
-	        	return;
-	        }
-	        // alert(CirMinPor._eventHandlers);
-	        for (idx in eventHandlers) {
-	           handlerData = eventHandlers[idx];
-	           if ((handlerData[0] == "*" || handlerData[0] == channel)
-	               && (handlerData[1] == "*" || handlerData[1] == name)) {
-	              handlerData[2](data.slice(2));
-	           }
-	        }
-	     };
+	CirMinPor._openEventExchange = function (resourceUrl, displayed, 
+	                                         replayEpoch, replaySeq) {
+	  if (!("WebSocket" in window)) {
+	     transport = "sse";
+	  }
+	  if (JSON && ("WebSocket" in window || "EventSource" in window)) {
+	     exchangeUrl = resourceUrl;
+	     subscribed = displayed || [];
+	     epoch = replayEpoch;
+	     lastSeq = replaySeq || 0;
+	     connect();
 	  } else {
 	     CirMinPor.addMessage(CirMinPor._strings.WebSocketsUnavailable, "error");
 	  }
@@ -78,9 +249,102 @@ wsUrl: function(path) {
 	    eventHandlers.push([handle, name, func]);
 	}
 	
+	function flush() {
+	    flushPending = false;
+	    if (!isOpen()) {
+	    	// Kept until the connection has been (re)opened
+	    	return;
+	    }
+	    // Posts that have failed before
+	    post();
+	    if (batched.length == 0) {
+	    	return;
+	    }
+	    var env = { locales: CirMinPor._locales };
+	    var msg;
+	    if (batched.length == 1) {
+	    	msg = batched[0].concat([env]);
+	    } else {
+	    	msg = ["portal", "batch", batched, env];
+	    }
+	    batched = [];
+	    if (transport == "ws") {
+	    	ws.send(JSON.stringify(msg));
+	    	return;
+	    }
+	    // Messages queued while a post is pending are sent together
+	    outgoing.push(msg);
+	    post();
+	}
+
+	/**
+	 * Sends an event to the server. Events sent in the same turn
+	 * of the JavaScript event loop are sent together in one message.
+	 */
 	CirMinPor.sendEvent = function(handle, name, args) {
-		env = { locales: CirMinPor._locales }
-		ws.send(JSON.stringify([handle, name, args, env]));
+		batched.push([handle, name, args]);
+		if (!flushPending) {
+			flushPending = true;
+			setTimeout(flush, 0);
+		}
+	}
+
+	/**
+	 * Sends the event to the server when no further event with the
+	 * same handle and name has been sent for "wait" milliseconds. 
+	 * Only the arguments of the last invocation are sent. Useful
+	 * e.g. for input that is being typed.
+	 */
+	CirMinPor.sendEventDebounced = function(handle, name, args, wait) {
+		var key = handle + "/" + name;
+		var state = debounced[key];
+		if (state && state.timer) {
+			clearTimeout(state.timer);
+		}
+		debounced[key] = { timer: setTimeout(function () {
+			delete debounced[key];
+			CirMinPor.sendEvent(handle, name, args);
+		}, wait) };
+	}
+
+	/**
+	 * Sends the event to the server at most once every "interval" 
+	 * milliseconds for a given handle and name. Events sent in 
+	 * between are collapsed into one that is sent with the arguments
+	 * of the last invocation when the interval has passed. Useful 
+	 * e.g. for sliders.
+	 */
+	CirMinPor.sendEventThrottled = function(handle, name, args, interval) {
+		var key = handle + "/" + name;
+		var state = throttled[key];
+		if (state) {
+			state.args = args;
+			state.pending = true;
+			return;
+		}
+		CirMinPor.sendEvent(handle, name, args);
+		state = throttled[key] = { pending: false };
+		var expire = function () {
+			if (state.pending) {
+				state.pending = false;
+				CirMinPor.sendEvent(handle, name, state.args);
+				state.timer = setTimeout(expire, interval);
+				return;
+			}
+			delete throttled[key];
+		};
+		state.timer = setTimeout(expire, interval);
+	}
+
+	/**
+	 * Declares the handles of the portlets that are displayed. The
+	 * server sends only events from these portlets.
+	 */
+	CirMinPor.subscribe = function(handles) {
+		subscribed = handles;
+		if (isOpen()) {
+			CirMinPor.sendEvent("portal", "subscribe", handles);
+		}
 	}
 
 
@@ -162,4 +426,13 @@ wsUrl: function(path) {
     // Provide some basic currying to the user
     return data ? fn( data ) : fn;
   };
+
+  /**
+   * Defines a template that can be referred to by its id like a 
+   * template embedded in the page. Used for the templates declared
+   * as assets by the portlets.
+   */
+  CirMinPor.defineTemplate = function (id, str) {
+    cache[id] = CirMinPor.tmpl(str);
+  };
 })();
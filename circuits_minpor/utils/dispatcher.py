@@ -5,14 +5,46 @@ Created on 01.10.2015
 '''
 from circuits.web.websockets.dispatcher import WebSocketsDispatcher
 from circuits.core.handlers import handler
-from circuits.net.events import connect, disconnect
+from circuits.net.events import connect, disconnect, read, write, close
+from circuits.web.utils import parse_qs
+from circuits.web.errors import httperror
+import json
+import time
 
 class WebSocketsDispatcherPlus(WebSocketsDispatcher):
-    '''
-    classdocs
-    '''
+    """
+    A :class:`WebSocketsDispatcher` that adds the session of the 
+    request that opened the connection to the events fired for the
+    connection (as keyword argument "session").
 
-    def __init__(self, path=None, wschannel="wsserver", *args, **kwargs):
+    For clients that cannot use WebSockets (e.g. because a proxy
+    strips the upgrade), two alternative transports are provided.
+    Requests for *path* with "/stream" appended open a connection
+    using server-sent events. Messages written to such a connection 
+    are sent as events. Requests for *path* with "/post" appended 
+    carry a JSON array of messages from the client, which are
+    delivered as :class:`~.net.events.read` events just like messages
+    received over a WebSocket. The connections look like WebSocket
+    connections to the components that handle the events on
+    *wschannel*.
+
+    Connections that have been silent for *heartbeat_interval*
+    seconds are sent a heartbeat (a ping frame for WebSockets, 
+    a comment for server-sent events). Browsers answer pings
+    automatically, so a WebSocket that has been silent for 
+    *idle_timeout* seconds is considered dead and closed, which
+    fires the disconnect events. Clients using server-sent events
+    cannot answer, these connections are closed when writing the
+    heartbeat fails. The heartbeats are scheduled with the
+    given *timers*.
+    """
+
+    # Maximum number of messages in a post
+    MaxPostedMessages = 100
+
+    def __init__(self, path=None, wschannel="wsserver", 
+                 heartbeat_interval=None, idle_timeout=None, timers=None,
+                 *args, **kwargs):
         """
         :param path: the path to handle. Requests that start with this
             path are considered to be WebSocket Opening Handshakes.
@@ -21,34 +53,141 @@ class WebSocketsDispatcherPlus(WebSocketsDispatcher):
             events from the client will be delivered and where
             :class:`~.net.events.write` events to the client will be
             sent to.
+
+        :param heartbeat_interval: the time in seconds after which
+            a heartbeat is sent to a silent connection. No heartbeats
+            are sent if ``None``.
+
+        :param idle_timeout: the time in seconds after which a silent
+            WebSocket connection is closed. Defaults to three
+            heartbeat intervals.
+
+        :param timers: the timer wheel used to schedule the heartbeats
+            (see :class:`~circuits_minpor.portal.timerwheel.TimerWheel`).
+            Required if *heartbeat_interval* is set.
         """
 
         super(WebSocketsDispatcherPlus, self).__init__ \
             (path, wschannel, *args, **kwargs)
         self._sessions = dict()
+        self._streams = dict()
+        self._last_seen = dict()
+        self._reaped = 0
+        self._heartbeat_interval = heartbeat_interval
+        self._idle_timeout = idle_timeout
+        if heartbeat_interval and idle_timeout is None:
+            self._idle_timeout = 3 * heartbeat_interval
+        if heartbeat_interval:
+            timers.schedule((self.__class__.__name__ + ".heartbeat", path),
+                            heartbeat_interval, self._send_heartbeats,
+                            periodic=True)
+
         @handler("read", channel=wschannel, priority=100)
         def _on_read_handler(self, event, socket, data):
             if socket in self._sessions:
                 event.kwargs["session"] = self._sessions[socket]
         self.addHandler(_on_read_handler)
 
+        @handler("write", channel=wschannel)
+        def _on_stream_write(self, sock, data):
+            response = self._streams.get(sock)
+            if response is None:
+                return
+            if isinstance(data, unicode):
+                data = data.encode("utf-8")
+            self._write_stream(sock, response, "data: " + data + "\n\n")
+        self.addHandler(_on_stream_write)
+
+    @property
+    def connections(self):
+        """
+        The numbers of open connections by transport and the number
+        of connections closed because they were idle.
+        """
+        return { "websocket": len(self._codecs),
+                 "stream": len(self._streams),
+                 "reaped": self._reaped }
+
+    def _write_stream(self, sock, response, data):
+        if response.chunked:
+            data = "%x\r\n%s\r\n" % (len(data), data)
+        self.fire(write(sock, data))
+
+    @handler("read", priority=20)
+    def _on_raw_read(self, sock, data):
+        # Runs before the codec consumes the data (including pongs)
+        if sock in self._last_seen:
+            self._last_seen[sock] = time.time()
+
+    def _send_heartbeats(self):
+        now = time.time()
+        for sock, seen in self._last_seen.items():
+            if sock in self._codecs:
+                if now - seen > self._idle_timeout:
+                    # Don't wait for TCP to notice
+                    del self._last_seen[sock]
+                    self._reaped += 1
+                    self.fire(close(sock))
+                elif now - seen >= self._heartbeat_interval:
+                    self.fire(write(sock, "\x89\x00"))
+            elif sock in self._streams \
+                and now - seen >= self._heartbeat_interval:
+                # Comments are ignored by the client
+                self._last_seen[sock] = now
+                self._write_stream(sock, self._streams[sock], ":\n\n")
+
+    @handler("request", priority=0.9)
+    def _on_transport_request(self, event, request, response):
+        if request.path == self._path + "/stream":
+            event.stop()
+            response.headers["Content-Type"] = "text/event-stream"
+            response.headers["Cache-Control"] = "no-cache"
+            # Keep the connection open after the headers (the
+            # empty tuple avoids a "Content-Length: 0" header)
+            response.stream = True
+            response.body = ()
+            self._streams[request.sock] = response
+            return response
+        if request.path == self._path + "/post":
+            event.stop()
+            # Requires a CORS preflight for cross-origin requests
+            if request.method != "POST" \
+                or not request.headers.get("X-Portal-Event"):
+                return httperror(request, response, 400)
+            try:
+                messages = json.loads(request.body.read())
+            except ValueError:
+                return httperror(request, response, 400)
+            if not isinstance(messages, list):
+                return httperror(request, response, 400)
+            for message in messages[:self.MaxPostedMessages]:
+                evt = read(request.sock, json.dumps(message))
+                evt.kwargs["session"] = request.session
+                self.fire(evt, self._wschannel)
+            response.headers["Cache-Control"] = "no-cache"
+            return ""
+
     @handler("response_complete", override=True)
     def _on_response_complete(self, e, value):
         response = e.args[0]
         request = response.request
-        if request.sock in self._codecs:
+        if request.sock in self._codecs \
+            or self._streams.get(request.sock) is response:
             self._sessions[request.sock] = request.session
-        if request.sock in self._codecs:
+            self._last_seen[request.sock] = time.time()
             evt = connect(request.sock,*request.sock.getpeername())
             evt.kwargs["session"] = request.session 
+            evt.kwargs["query"] = parse_qs(request.qs)
             self.fire(evt, self._wschannel)
         
     @handler("disconnect", override=True)
     def _on_disconnect(self, sock):
-        if sock in self._codecs:
+        if sock in self._codecs or sock in self._streams:
             evt = disconnect(sock)
             if sock in self._sessions:
                 evt.kwargs["session"] = self._sessions[sock] 
                 del self._sessions[sock]
             self.fire(evt, self._wschannel)
-            del self._codecs[sock]
+            self._codecs.pop(sock, None)
+            self._streams.pop(sock, None)
+            self._last_seen.pop(sock, None)
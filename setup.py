@@ -54,6 +54,8 @@ setup(
                                       'templates/themes/default/*'],
                   'circuits_minpor.portlets': ['templates/*.properties', 
                                                'templates/*.pyhtml',
+                                               'templates/*.js',
+                                               'templates/*.html',
                                                'templates/themes/default/*']},
     install_requires = ['Tenjin', 'rbtranslations', 'circuits-bricks==0.4.4',
                         'circuits==3.2'],